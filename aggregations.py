@@ -0,0 +1,197 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from analytics_store import query_totals
+
+# Memory the groupings/pivots kept across reruns and sessions may take up;
+# the least recently used ones are dropped beyond it
+CACHE_BYTES = 64 * 1024 * 1024
+
+# Columns of the Main/CO/DCR and CO/Added pivots in the AP and AR tabs
+AP_PIVOT_ORDER = [
+    'Main Contract Scope',
+    'CO Scope (adding/additional scope)',
+    'DCR Scope',
+    'The budget execution does not pertain to this project',
+    'Unspecified'
+]
+AR_PIVOT_ORDER = ['Main', 'CO', 'Added', 'Unspecified']
+
+# What the AP and AR tabs compute when first opened: (sheet, value column,
+# default group-by columns, shares, pivot index, pivot columns, pivot order)
+DEFAULT_BREAKDOWNS = [
+    ('pc_overview AP', 'Amount', ['PM Type'], {'Percentage of PM Type': ['PM Type']},
+     'PM Type', 'Main/CO/DCR', AP_PIVOT_ORDER),
+    ('pc_overview AR', 'Total Contract $', ['Main Page'], None,
+     'Main Page', 'CO/Added', AR_PIVOT_ORDER),
+]
+
+# key -> (frame, bytes), least recently used first
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+
+def _cache_get(key):
+    with _cache_lock:
+        if key not in _cache:
+            _cache_stats['misses'] += 1
+            return None
+        _cache_stats['hits'] += 1
+        _cache.move_to_end(key)
+        return _cache[key][0]
+
+
+def _cache_put(key, value):
+    size = int(value.memory_usage(index=True, deep=True).sum())
+    if size > CACHE_BYTES:
+        return
+    with _cache_lock:
+        if key in _cache:
+            _cache_stats['bytes'] -= _cache[key][1]
+        _cache[key] = (value, size)
+        _cache.move_to_end(key)
+        _cache_stats['bytes'] += size
+        while _cache_stats['bytes'] > CACHE_BYTES:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _cache_stats['bytes'] -= evicted
+            _cache_stats['evictions'] += 1
+
+
+def cache_stats():
+    """Hits, misses, evictions and bytes of the breakdown cache, with its entry count and budget"""
+    with _cache_lock:
+        return dict(_cache_stats, entries=len(_cache), budget=CACHE_BYTES)
+
+
+def drop_stale(version):
+    """Drop cached breakdowns of every data version but version"""
+    with _cache_lock:
+        for key in [key for key in _cache if key[1] != version]:
+            _cache_stats['bytes'] -= _cache.pop(key)[1]
+
+
+def _finest_cached_superset(version, value_column, columns):
+    # Smallest cached grouping of the same data that contains every requested column
+    wanted = set(columns)
+    with _cache_lock:
+        candidates = [
+            value for key, (value, _) in _cache.items()
+            if key[:3] == ('group', version, value_column) and wanted < set(key[3])
+        ]
+    return min(candidates, key=len, default=None)
+
+
+def grouped_totals(df, version, columns, value_column, store=None):
+    """Sum and count of value_column per combination of columns, NaN keys included
+
+    With a store ((db path, table) from analytics_store.open_store) the rows are
+    grouped in SQL and df is not used.
+    """
+    columns = list(columns)
+    key = ('group', version, value_column, tuple(columns))
+    totals = _cache_get(key)
+    if totals is not None:
+        return totals
+
+    finer = _finest_cached_superset(version, value_column, columns)
+    if finer is not None:
+        # Roll the finer grouping up instead of rescanning the raw rows
+        totals = finer.groupby(columns, dropna=False, observed=True).agg(
+            sum=('sum', 'sum'),
+            count=('count', 'sum')
+        ).reset_index()
+    elif store is not None:
+        totals = query_totals(store, columns, value_column)
+    else:
+        # Keep NaN keys so coarser groupings can still be rolled up from this one
+        totals = df.groupby(columns, dropna=False, observed=True).agg(
+            sum=(value_column, 'sum'),
+            count=(value_column, 'count')
+        ).reset_index()
+        # Categorical keys only speed up the scan; the small result is plain text again
+        totals = totals.astype({col: object for col in columns if isinstance(totals[col].dtype, pd.CategoricalDtype)})
+
+    _cache_put(key, totals)
+    return totals
+
+
+def seed_grouped_totals(totals, version, columns, value_column):
+    """Cache totals computed elsewhere (e.g. published by the pipeline) as grouped_totals' result"""
+    totals = totals.astype({col: object for col in columns})
+    _cache_put(('group', version, value_column, tuple(columns)), totals)
+
+
+def share_of_parent(df, parent_columns, value_column='Total Amount'):
+    """Percentage of each row's value_column within its parent group"""
+    parent_totals = df.groupby(parent_columns, dropna=False, observed=True)[value_column].transform('sum')
+    return df[value_column] / parent_totals * 100
+
+
+def grouped_breakdown(df, version, columns, value_column, shares=None, store=None):
+    """Total Amount and Count of value_column grouped by columns
+
+    Same result as df.groupby(columns).agg({value_column: ['sum', 'count']}),
+    cached per dataset version and tuple of group-by columns. shares maps a
+    new column name to the parent columns it is a percentage of. With a store,
+    the grouping runs as SQL against it instead of over df.
+    """
+    totals = grouped_totals(df, version, columns, value_column, store).rename(columns={
+        'sum': 'Total Amount',
+        'count': 'Count'
+    })
+    # Shares are taken before dropping NaN keys so parents keep all their rows
+    for share_column, parent_columns in (shares or {}).items():
+        totals[share_column] = share_of_parent(totals, parent_columns)
+    return totals.dropna(subset=list(columns)).reset_index(drop=True)
+
+
+def pivot_breakdown(df, version, index, columns, value_column, column_order, blank_label='Unspecified', store=None):
+    """Sum of value_column by index x columns with columns in column_order
+
+    Blank, NaN and 0 labels in the columns field are reported as blank_label.
+    With a store, the totals come from SQL as in grouped_breakdown.
+    """
+    key = ('pivot', version, value_column, index, columns, tuple(column_order), blank_label)
+    pivot_df = _cache_get(key)
+    if pivot_df is None:
+        totals = grouped_totals(df, version, [index, columns], value_column, store).dropna(subset=[index])
+        labels = totals[columns].fillna(blank_label).replace(['', '0', 0], blank_label)
+        pivot_df = totals.assign(**{columns: labels}).pivot_table(
+            values='sum',
+            index=index,
+            columns=columns,
+            aggfunc='sum'
+        ).fillna(0)
+
+        # Reorder columns (and add any missing columns with zeros)
+        for col in column_order:
+            if col not in pivot_df.columns:
+                pivot_df[col] = 0
+        pivot_df = pivot_df[column_order]
+        _cache_put(key, pivot_df)
+
+    return pivot_df.copy()
+
+
+def cached_frame(kind, version, params, compute):
+    """compute()'s DataFrame, kept in the same cache as the breakdowns under (kind, version, *params)
+
+    For results other than groupings and pivots (e.g. the reconciliation)
+    that only depend on the data version and params; like the breakdowns
+    they are shared by every session and dropped with their version.
+    """
+    key = (kind, version, *params)
+    result = _cache_get(key)
+    if result is None:
+        result = compute()
+        _cache_put(key, result)
+    return result
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        _cache_stats.update(hits=0, misses=0, evictions=0, bytes=0)
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from data_cache import load_sheet, source_version
+
+# Sheets of the analysis workbook copied into the store, with their table names
+STORE_TABLES = {
+    'pc_overview AP': 'pc_overview_ap',
+    'pc_overview AR': 'pc_overview_ar'
+}
+
+
+def store_path(workbook_path):
+    # e.g. summary_table_updated_analysis.xlsx -> summary_table_updated_analysis.sqlite
+    return f"{os.path.splitext(workbook_path)[0]}.sqlite"
+
+
+def _quote(name):
+    # Column names such as 'PO #' and 'Total Contract $' need quoting in SQL
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def fill_store(workbook_path, db_path=None):
+    """Copy the analysis sheets of workbook_path into a SQLite file for the dashboard
+
+    The store is built next to the old one and swapped in at the end, so the
+    app never queries a half-written file. Returns {table: rows}.
+    """
+    db_path = db_path or store_path(workbook_path)
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    loaded = {}
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("CREATE TABLE store_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("""
+            CREATE TABLE store_columns (
+                table_name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                is_numeric INTEGER NOT NULL,
+                PRIMARY KEY (table_name, position)
+            )
+        """)
+        for sheet_name, table in STORE_TABLES.items():
+            df = load_sheet(workbook_path, sheet_name)
+            conn.executemany("INSERT INTO store_columns VALUES (?, ?, ?, ?)", [
+                (table, i, col, int(pd.api.types.is_numeric_dtype(df[col])))
+                for i, col in enumerate(df.columns)
+            ])
+            df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}) \
+                .to_sql(table, conn, index=False)
+            loaded[table] = len(df)
+        conn.executemany("INSERT INTO store_state VALUES (?, ?)", [
+            ('version', source_version(workbook_path)),
+            ('workbook', os.path.abspath(workbook_path)),
+            ('built_at', datetime.now().isoformat(timespec='seconds'))
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, db_path)
+    return loaded
+
+
+def _connect(db_path):
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+
+def open_store(workbook_path, sheet_name, version=None):
+    """(db path, table) of sheet_name if the store holds the current workbook, else None"""
+    db_path = store_path(workbook_path)
+    if sheet_name not in STORE_TABLES or not os.path.exists(db_path):
+        return None
+    version = version or source_version(workbook_path)
+    try:
+        conn = _connect(db_path)
+        try:
+            row = conn.execute("SELECT value FROM store_state WHERE key = 'version'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    # A store left over from an older workbook would give stale numbers
+    return (db_path, STORE_TABLES[sheet_name]) if row and row[0] == version else None
+
+
+def source_columns(df, store=None):
+    """[(column, is numeric)] and the row count of a sheet, from the store when given"""
+    if store is None:
+        return [(col, pd.api.types.is_numeric_dtype(df[col])) for col in df.columns], len(df)
+    db_path, table = store
+    conn = _connect(db_path)
+    try:
+        columns = conn.execute(
+            "SELECT name, is_numeric FROM store_columns WHERE table_name = ? ORDER BY position", (table,)
+        ).fetchall()
+        rows = conn.execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0]
+    finally:
+        conn.close()
+    return [(name, bool(is_numeric)) for name, is_numeric in columns], rows
+
+
+def query_totals(store, columns, value_column):
+    """Sum and count of value_column per combination of columns, NULL keys included
+
+    Same frame as the pandas groupby in aggregations, ordered the same way
+    with blank keys last.
+    """
+    db_path, table = store
+    keys = [_quote(col) for col in columns]
+    sql = (
+        f"SELECT {', '.join(keys)}, TOTAL({_quote(value_column)}) AS sum, COUNT({_quote(value_column)}) AS count "
+        f"FROM {_quote(table)} GROUP BY {', '.join(keys)} "
+        f"ORDER BY {', '.join(f'{key} IS NULL, {key}' for key in keys)}"
+    )
+    conn = _connect(db_path)
+    try:
+        totals = pd.read_sql_query(sql, conn)
+    finally:
+        conn.close()
+    totals.columns = list(columns) + ['sum', 'count']
+    return totals
@@ -3,7 +3,7 @@ import pandas as pd
 import os
 from datetime import datetime
 import plotly.express as px 
-from st_aggrid import AgGrid, GridOptionsBuilder
+from st_aggrid import AgGrid, GridOptionsBuilder, JsCode
 from st_aggrid.grid_options_builder import GridOptionsBuilder
 
 # Import your existing functions
@@ -14,8 +14,19 @@ from process_excel import (
     update_ar_sheet,
     load_and_process_data,
     generate_reports,
-    cleanup_workbook
+    cleanup_workbook,
+    RECONCILE_KEYS,
+    RECONCILE_STATUSES,
+    reconcile_ap_ar,
+    reconciliation_summary
 )
+from dataset_registry import current_version, registry_stats, shared_sheet
+from aggregations import AP_PIVOT_ORDER, AR_PIVOT_ORDER, cached_frame, grouped_breakdown, pivot_breakdown, share_of_parent
+from analytics_store import open_store, source_columns
+from snapshots import SNAPSHOT_DATASETS, manifest_version, period_changes
+from grid_paging import PAGE_SIZE, apply_filter_model, apply_sort_model
+from instrumentation import begin_stage, configure_logging, end_stage, stages_frame, timed_stage
+from watcher import POLL_SECONDS, start_watcher, watcher_status
 
 # Add at the start of your file, after imports:
 st.set_page_config(
@@ -23,23 +34,64 @@ st.set_page_config(
     layout="wide"  # This makes the app use the full width
 )
 
+@st.cache_resource
+def perf_logging():
+    # Stage timings go to the server console, or to the file named by ARAP_PERF_LOG. Set up once per
+    # server process: replacing the handlers on every rerun would close them under other sessions
+    configure_logging(os.environ.get('ARAP_PERF_LOG'))
+
+perf_logging()
+
+@st.cache_resource
+def background_refresh():
+    # One watcher per server process, shared by every session. By default it only warms the
+    # caches and `python watcher.py` rebuilds the report; ARAP_WATCHER=reports rebuilds it
+    # from the server instead, =off disables the watcher
+    mode = os.environ.get('ARAP_WATCHER', 'cache')
+    if mode == 'off':
+        return None
+    return start_watcher('summary_table_updated_analysis.xlsx', run_reports=mode != 'cache')
+
+background_refresh()
+
+@st.fragment(run_every=POLL_SECONDS)
+def refresh_badge():
+    # Which data the tabs are reading and how fresh it is
+    status = watcher_status()
+    if status['state'] == 'error':
+        st.badge(f"Refresh failed: {status['error']}", icon=":material/error:", color='red')
+    elif status['refreshed_at'] is None:
+        st.badge("Warming up data", icon=":material/hourglass_top:", color='gray')
+    else:
+        label = f"Data {status['version']} · refreshed {status['refreshed_at']:%Y-%m-%d %H:%M:%S}"
+        if status['state'] == 'refreshing':
+            st.badge(f"{label} · refreshing", icon=":material/sync:", color='orange')
+        else:
+            st.badge(label, icon=":material/check_circle:", color='green')
+
 def load_existing_data():
     try:
         # Load the existing analysis file
         file_path = 'summary_table_updated_analysis.xlsx'  # Adjust path as needed
-        pc_overview_ap = pd.read_excel(file_path, sheet_name='pc_overview AP')
-        pc_overview_ar = pd.read_excel(file_path, sheet_name='pc_overview AR')
+        pc_overview_ap = shared_sheet(file_path, 'pc_overview AP')
+        pc_overview_ar = shared_sheet(file_path, 'pc_overview AR')
         return pc_overview_ap, pc_overview_ar
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         return None, None
 
-def create_aggrid_table(df, table_id):
+def create_aggrid_table(df, table_id, stages=None):
     # Initialize session state for this table if not exists
     if f'filter_cleared_{table_id}' not in st.session_state:
         st.session_state[f'filter_cleared_{table_id}'] = False
+    # Filter/sort models from the grid; applied to the whole frame here, not in the browser
+    if f'grid_models_{table_id}' not in st.session_state:
+        st.session_state[f'grid_models_{table_id}'] = {'filter': {}, 'sort': []}
+        st.session_state[f'grid_generation_{table_id}'] = 0
+    models = st.session_state[f'grid_models_{table_id}']
+    generation = st.session_state[f'grid_generation_{table_id}']
     
-    gb = GridOptionsBuilder.from_dataframe(df)
+    gb = GridOptionsBuilder.from_dataframe(df.head(0))
     
     # Configure each column
     gb.configure_default_column(
@@ -48,8 +100,13 @@ def create_aggrid_table(df, table_id):
         resizable=True,
         filter=True,
         floatingFilter=False,
-        minWidth=150
+        minWidth=150,
+        # Rows arrive sorted, so the grid only shows the sort arrows
+        comparator=JsCode("function() { return 0; }")
     )
+    for col in df.columns:
+        numeric = pd.api.types.is_numeric_dtype(df[col])
+        gb.configure_column(col, filter='agNumberColumnFilter' if numeric else 'agTextColumnFilter')
     
     # Enable filter icons and menu
     gb.configure_grid_options(
@@ -70,39 +127,24 @@ def create_aggrid_table(df, table_id):
             ],
             'defaultToolPanel': ''
         },
-        # Add function to clear filters and close panel
-        onGridReady="""
-        function(params) {
-            window.gridApi_%s = params.api;
-        }
-        """ % table_id,
-        onFirstDataRendered="""
-        function(params) {
-            window.clearFilters_%s = function() {
-                window.gridApi_%s.setFilterModel(null);
-                window.gridApi_%s.closeToolPanel();
-            };
+        initialState={
+            'filter': {'filterModel': models['filter']},
+            'sort': {'sortModel': models['sort']}
         }
-        """ % (table_id, table_id, table_id)
     )
     
     grid_options = gb.build()
     
     # Add clear filters button and confirmation message
     col1, col2 = st.columns([6,1])
+    with col1:
+        page_info = st.empty()
     with col2:
         if st.button('Clear All Filters', key=f'clear_filters_{table_id}'):
             st.session_state[f'filter_cleared_{table_id}'] = True
-            # Add JavaScript to clear filters and close panel
-            js_code = """
-            <script>
-                if (typeof clearFilters_%s === 'function') {
-                    clearFilters_%s();
-                }
-            </script>
-            """ % (table_id, table_id)
-            st.components.v1.html(js_code, height=0)
-            st.rerun()
+            st.session_state[f'grid_models_{table_id}'] = {'filter': {}, 'sort': models['sort']}
+            st.session_state[f'grid_generation_{table_id}'] += 1
+            st.rerun(scope='fragment')
     
     # Show confirmation message if filters were just cleared
     if st.session_state[f'filter_cleared_{table_id}']:
@@ -110,17 +152,64 @@ def create_aggrid_table(df, table_id):
         # Reset the state after showing the message
         st.session_state[f'filter_cleared_{table_id}'] = False
     
-    return AgGrid(
-        df,
+    # Only the requested page of the filtered and sorted rows goes to the browser
+    with timed_stage(f"{table_id} grid filter and sort", rows=len(df), records=stages):
+        matching = apply_sort_model(apply_filter_model(df, models['filter']), models['sort'])
+    page_count = max(1, -(-len(matching) // PAGE_SIZE))
+    page = st.number_input(
+        f'Page (of {page_count})', min_value=1, max_value=page_count, value=1,
+        key=f'grid_page_{table_id}_{generation}'
+    )
+    start = (page - 1) * PAGE_SIZE
+    page_df = matching.iloc[start:start + PAGE_SIZE]
+    page_info.caption(
+        f"Rows {min(start + 1, len(matching)):,}-{start + len(page_df):,} "
+        f"of {len(matching):,} matching ({len(df):,} total)"
+    )
+    
+    response = AgGrid(
+        page_df,
         gridOptions=grid_options,
         enable_enterprise_modules=True,
         allow_unsafe_jscode=True,
-        update_mode='MODEL_CHANGED',
+        update_on=['filterChanged', 'sortChanged'],
         theme='material',
         width='100%',
         height=500,
-        custom_js=True
+        custom_js=True,
+        key=f'grid_{table_id}_{generation}_{page}'
     )
+    
+    # A changed filter or sort in the grid is re-run over the full data from page 1
+    grid_state = response.grid_state or {}
+    if grid_state:
+        new_models = {
+            'filter': grid_state.get('filter', {}).get('filterModel') or {},
+            'sort': grid_state.get('sort', {}).get('sortModel') or []
+        }
+        if new_models != models:
+            st.session_state[f'grid_models_{table_id}'] = new_models
+            st.session_state[f'grid_generation_{table_id}'] += 1
+            st.rerun(scope='fragment')
+    
+    return response
+
+def performance_panel(stages):
+    # Timings of the last run of a tab, slowest first
+    with st.expander("Performance"):
+        stats = registry_stats()
+        breakdowns = stats['breakdowns']
+        st.caption(
+            f"Shared by all sessions: {stats['sheets']} sheets ({stats['sheet_bytes'] / 2**20:.1f} MB, "
+            f"{stats['hits']} reuses, {stats['mapped']} mapped, {stats['loads']} loads); {breakdowns['entries']} breakdowns "
+            f"({breakdowns['bytes'] / 2**20:.1f} of {breakdowns['budget'] / 2**20:.0f} MB, "
+            f"{breakdowns['hits']} hits, {breakdowns['misses']} misses, {breakdowns['evictions']} evicted)"
+        )
+        if not stages:
+            st.caption("Nothing was computed in this run.")
+            return
+        st.caption(f"{len(stages)} stages, {sum(stage['seconds'] for stage in stages):.3f}s in total")
+        st.dataframe(stages_frame(stages), use_container_width=True, hide_index=True)
 
 def get_ap_column_descriptions():
     """Return descriptions for AP columns"""
@@ -151,503 +240,583 @@ def get_ar_column_descriptions():
         'CO/Added': 'Change Order or Additional work'
     }
 
-def main():
-    st.title("MICU AR/AP Breakdown Analysis")
-    
-    # Main tabs - add AR Analysis
-    tab1, tab2, tab3 = st.tabs(["AP Analysis", "AR Analysis", "Data View"])
+@st.fragment
+def ap_analysis_tab():
+    # Widget changes in this tab rerun only this function
+    st.header("AP Analysis")
+    stages = []
     
-    # AP Analysis Tab
-    with tab1:
-        st.header("AP Analysis")
+    try:
+        # Load the analysis file - AP sheet
+        file_path = 'summary_table_updated_analysis.xlsx'
+        with timed_stage("AP load", records=stages) as stage:
+            version = current_version(file_path)
+            # Breakdowns run as SQL when the pipeline filled a store for this version
+            store = open_store(file_path, 'pc_overview AP', version)
+            df_ap = None if store else shared_sheet(file_path, 'pc_overview AP')
+            source_column_types, n_rows = source_columns(df_ap, store)
+            stage['rows'] = n_rows
         
-        try:
-            # Load the analysis file - AP sheet
-            file_path = 'summary_table_updated_analysis.xlsx'
-            df_ap = pd.read_excel(file_path, sheet_name='pc_overview AP')
-            
-            # Get AP column descriptions
-            column_descriptions = get_ap_column_descriptions()
+        # Get AP column descriptions
+        column_descriptions = get_ap_column_descriptions()
+        
+        # Get all possible columns for grouping
+        groupable_columns = [col for col, numeric in source_column_types if col != 'Amount' 
+                           and not numeric]
+        
+        # Create formatted options for the multiselect
+        formatted_options = []
+        for col in groupable_columns:
+            desc = column_descriptions.get(col, '')
+            if desc:
+                formatted_options.append(f"{col} - {desc}")
+            else:
+                formatted_options.append(col)
+        
+        # Find PM Type in formatted options
+        default_option = next(
+            (opt for opt in formatted_options if opt.startswith('PM Type')),
+            formatted_options[0] if formatted_options else None
+        )
+        
+        # Multi-select dropdown with descriptions - PM Type default for AP only
+        selected_formatted = st.multiselect(
+            'Select columns for analysis:',
+            options=formatted_options,
+            default=default_option,
+            help="Hover over options to see descriptions",
+            key='ap_select'
+        )
+        
+        # Convert selected formatted options back to column names
+        selected_columns = [opt.split(' - ')[0] for opt in selected_formatted]
+        
+        if selected_columns:
+            # Create grouped analysis (cached per data version and selected columns),
+            # with each row's share of its PM Type total if PM Type is selected
+            shares = {'Percentage of PM Type': ['PM Type']} if 'PM Type' in selected_columns else None
+            with timed_stage("AP groupby", rows=n_rows, records=stages):
+                grouped_df = grouped_breakdown(df_ap, version, selected_columns, 'Amount', shares=shares, store=store)
             
-            # Get all possible columns for grouping
-            groupable_columns = [col for col in df_ap.columns if col != 'Amount' 
-                               and not pd.api.types.is_numeric_dtype(df_ap[col])]
+            if 'PM Type' in selected_columns:
+                # Format percentage to 2 decimal places
+                grouped_df['Percentage of PM Type'] = grouped_df['Percentage of PM Type'].round(2)
+                
+                # Add % symbol
+                grouped_df['Percentage of PM Type'] = grouped_df['Percentage of PM Type'].astype(str) + '%'
             
-            # Create formatted options for the multiselect
-            formatted_options = []
-            for col in groupable_columns:
-                desc = column_descriptions.get(col, '')
-                if desc:
-                    formatted_options.append(f"{col} - {desc}")
-                else:
-                    formatted_options.append(col)
+            # Sort by first selected column and Total Amount
+            grouped_df = grouped_df.sort_values([selected_columns[0], 'Total Amount'], ascending=[True, False])
             
-            # Find PM Type in formatted options
-            default_option = next(
-                (opt for opt in formatted_options if opt.startswith('PM Type')),
-                formatted_options[0] if formatted_options else None
-            )
+            # Display results
+            st.subheader("Breakdown By Selected Columns")
             
-            # Multi-select dropdown with descriptions - PM Type default for AP only
-            selected_formatted = st.multiselect(
-                'Select columns for analysis:',
-                options=formatted_options,
-                default=default_option,
-                help="Hover over options to see descriptions",
-                key='ap_select'
+            # Show table
+            st.dataframe(
+                grouped_df,
+                use_container_width=True,
+                hide_index=True
             )
             
-            # Convert selected formatted options back to column names
-            selected_columns = [opt.split(' - ')[0] for opt in selected_formatted]
-            
-            if selected_columns:
-                # First, calculate total amount per PM Type
-                pm_type_totals = df_ap.groupby('PM Type')['Amount'].sum().to_dict()
+            # Create visualization
+            plot_stage = begin_stage("AP plot", rows=len(grouped_df))
+            if len(selected_columns) <= 2:  # Bar chart for 1-2 columns
+                first_col = selected_columns[0]
+                second_col = selected_columns[1] if len(selected_columns) > 1 else None
                 
-                # Create grouped analysis
-                grouped_df = df_ap.groupby(selected_columns).agg({
-                    'Amount': ['sum', 'count']
-                }).reset_index()
+                # Get total amount for each value in first column
+                first_col_totals = grouped_df.groupby(first_col)['Total Amount'].sum().sort_values(ascending=False)
                 
-                # Flatten column names and rename
-                grouped_df.columns = [
-                    col[0] if col[1] == '' else f"{col[0]}_{col[1]}" 
-                    for col in grouped_df.columns
-                ]
-                grouped_df = grouped_df.rename(columns={
-                    'Amount_sum': 'Total Amount',
-                    'Amount_count': 'Count'
-                })
-                
-                # Add percentage calculation if PM Type is selected
-                if 'PM Type' in selected_columns:
-                    # Calculate percentage
-                    grouped_df['Percentage of PM Type'] = grouped_df.apply(
-                        lambda row: (row['Total Amount'] / pm_type_totals[row['PM Type']]) * 100,
-                        axis=1
+                # If more than 10 unique values in first column, take top 10
+                if len(first_col_totals) > 10:
+                    top_10_first_col = first_col_totals.head(10).index
+                    plot_df = grouped_df[grouped_df[first_col].isin(top_10_first_col)].copy()
+                    plot_df[first_col] = pd.Categorical(
+                        plot_df[first_col], 
+                        categories=top_10_first_col, 
+                        ordered=True
                     )
-                    
-                    # Format percentage to 2 decimal places
-                    grouped_df['Percentage of PM Type'] = grouped_df['Percentage of PM Type'].round(2)
-                    
-                    # Add % symbol
-                    grouped_df['Percentage of PM Type'] = grouped_df['Percentage of PM Type'].astype(str) + '%'
-                
-                # Sort by first selected column and Total Amount
-                grouped_df = grouped_df.sort_values([selected_columns[0], 'Total Amount'], ascending=[True, False])
-                
-                # Display results
-                st.subheader("Breakdown By Selected Columns")
-                
-                # Show table
-                st.dataframe(
-                    grouped_df,
-                    use_container_width=True,
-                    hide_index=True
-                )
+                    plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
+                else:
+                    plot_df = grouped_df.copy()
+                    plot_df[first_col] = pd.Categorical(
+                        plot_df[first_col], 
+                        categories=first_col_totals.index, 
+                        ordered=True
+                    )
+                    plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
                 
-                # Create visualization
-                if len(selected_columns) <= 2:  # Bar chart for 1-2 columns
-                    first_col = selected_columns[0]
-                    second_col = selected_columns[1] if len(selected_columns) > 1 else None
+                if second_col:  # Two columns selected
+                    # Calculate percentages within each first column category
+                    plot_df['Percentage of Total'] = share_of_parent(plot_df, [first_col])
                     
-                    # Get total amount for each value in first column
-                    first_col_totals = grouped_df.groupby(first_col)['Total Amount'].sum().sort_values(ascending=False)
+                    fig = px.bar(
+                        plot_df,
+                        x=first_col,
+                        y='Total Amount',
+                        color=second_col,
+                        title=f'Amount by {first_col}' + 
+                              f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
+                        labels={'Total Amount': 'Total Amount ($)'},
+                        custom_data=[plot_df['Percentage of Total'], plot_df[second_col]]
+                    )
                     
-                    # If more than 10 unique values in first column, take top 10
-                    if len(first_col_totals) > 10:
-                        top_10_first_col = first_col_totals.head(10).index
-                        plot_df = grouped_df[grouped_df[first_col].isin(top_10_first_col)].copy()
-                        plot_df[first_col] = pd.Categorical(
-                            plot_df[first_col], 
-                            categories=top_10_first_col, 
-                            ordered=True
+                    fig.update_traces(
+                        hovertemplate=(
+                            "%{x}<br>" +
+                            "%{customdata[1]}: %{y:,.2f}<br>" +
+                            "Percentage within %{x}: %{customdata[0]:.1f}%<extra></extra>"
                         )
-                        plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
-                    else:
-                        plot_df = grouped_df.copy()
-                        plot_df[first_col] = pd.Categorical(
-                            plot_df[first_col], 
-                            categories=first_col_totals.index, 
-                            ordered=True
-                        )
-                        plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
+                    )
+                else:  # Single column
+                    fig = px.bar(
+                        plot_df,
+                        x=first_col,
+                        y='Total Amount',
+                        title=f'Amount by {first_col}' + 
+                              f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
+                        labels={'Total Amount': 'Total Amount ($)'}
+                    )
                     
-                    if second_col:  # Two columns selected
-                        # Calculate percentages within each first column category
-                        plot_df['Percentage of Total'] = plot_df.apply(
-                            lambda row: (row['Total Amount'] / first_col_totals[row[first_col]]) * 100,
-                            axis=1
-                        )
-                        
-                        fig = px.bar(
-                            plot_df,
-                            x=first_col,
-                            y='Total Amount',
-                            color=second_col,
-                            title=f'Amount by {first_col}' + 
-                                  f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
-                            labels={'Total Amount': 'Total Amount ($)'},
-                            custom_data=[plot_df['Percentage of Total'], plot_df[second_col]]
-                        )
-                        
-                        fig.update_traces(
-                            hovertemplate=(
-                                "%{x}<br>" +
-                                "%{customdata[1]}: %{y:,.2f}<br>" +
-                                "Percentage within %{x}: %{customdata[0]:.1f}%<extra></extra>"
-                            )
-                        )
-                    else:  # Single column
-                        fig = px.bar(
-                            plot_df,
-                            x=first_col,
-                            y='Total Amount',
-                            title=f'Amount by {first_col}' + 
-                                  f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
-                            labels={'Total Amount': 'Total Amount ($)'}
+                    fig.update_traces(
+                        hovertemplate=(
+                            "%{x}<br>" +
+                            "Amount: %{y:,.2f}<extra></extra>"
                         )
-                        
-                        fig.update_traces(
-                            hovertemplate=(
-                                "%{x}<br>" +
-                                "Amount: %{y:,.2f}<extra></extra>"
-                            )
-                        )
-                else:  # Treemap for 3+ columns
-                    fig = px.treemap(
-                        grouped_df,
-                        path=selected_columns,
-                        values='Total Amount',
-                        title='Distribution of Total Amount'
                     )
-                
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # First clean up blank/NaN/0 values in Main/CO/DCR
-                df_ap['Main/CO/DCR'] = df_ap['Main/CO/DCR'].fillna('Unspecified')
-                df_ap['Main/CO/DCR'] = df_ap['Main/CO/DCR'].replace(['', '0', 0], 'Unspecified')
-
-                # Define column order
-                column_order = [
-                    'Main Contract Scope',
-                    'CO Scope (adding/additional scope)',
-                    'DCR Scope',
-                    'The budget execution does not pertain to this project',
-                    'Unspecified'
-                ]
-
-                # Create pivot tables for percentages and amounts
-                pivot_df = df_ap.pivot_table(
-                    values='Amount',
-                    index='PM Type',
-                    columns='Main/CO/DCR',
-                    aggfunc='sum'
-                ).fillna(0)
-
-                # Reorder columns (and add any missing columns with zeros)
-                for col in column_order:
-                    if col not in pivot_df.columns:
-                        pivot_df[col] = 0
-                pivot_df = pivot_df[column_order]
-
-                # Calculate percentages
-                pivot_pct = pivot_df.div(pivot_df.sum(axis=1), axis=0) * 100
-                pivot_pct_display = pivot_pct.round(2)
-
-                # Format with % symbol
-                for column in pivot_pct_display.columns:
-                    pivot_pct_display[column] = pivot_pct_display[column].astype(str) + '%'
-
-                # View selection dropdown
-                selected_view = st.selectbox(
-                    "Select Analysis View:",
-                    options=[
-                        "Percentage Breakdown by PM Type",
-                        "Amount Breakdown by PM Type (in dollars)"
-                    ],
-                    key='ap_view'  # Unique key for AP
+            else:  # Treemap for 3+ columns
+                fig = px.treemap(
+                    grouped_df,
+                    path=selected_columns,
+                    values='Total Amount',
+                    title='Distribution of Total Amount'
                 )
+            
+            st.plotly_chart(fig, use_container_width=True)
+            end_stage(plot_stage, records=stages)
+            
+            # Define column order (blank/NaN/0 Main/CO/DCR values count as Unspecified)
+            column_order = AP_PIVOT_ORDER
 
-                # Display selected view for AP
-                if selected_view == "Percentage Breakdown by PM Type":
-                    st.dataframe(
-                        pivot_pct_display,
-                        use_container_width=True,
-                        hide_index=False
-                    )
-                elif selected_view == "Amount Breakdown by PM Type (in dollars)":
-                    st.dataframe(
-                        pivot_df.round(2),
-                        use_container_width=True,
-                        hide_index=False
-                    )
+            # Create pivot tables for percentages and amounts
+            with timed_stage("AP pivot", rows=n_rows, records=stages):
+                pivot_df = pivot_breakdown(df_ap, version, 'PM Type', 'Main/CO/DCR', 'Amount', column_order, store=store)
 
-                # Add download button for the analysis
-                csv = grouped_df.to_csv(index=False)
-                st.download_button(
-                    "Download Analysis",
-                    csv,
-                    "analysis_results.csv",
-                    "text/csv"
+            # Calculate percentages
+            pivot_pct = pivot_df.div(pivot_df.sum(axis=1), axis=0) * 100
+            pivot_pct_display = pivot_pct.round(2)
+
+            # Format with % symbol
+            for column in pivot_pct_display.columns:
+                pivot_pct_display[column] = pivot_pct_display[column].astype(str) + '%'
+
+            # View selection dropdown
+            selected_view = st.selectbox(
+                "Select Analysis View:",
+                options=[
+                    "Percentage Breakdown by PM Type",
+                    "Amount Breakdown by PM Type (in dollars)"
+                ],
+                key='ap_view'  # Unique key for AP
+            )
+
+            # Display selected view for AP
+            if selected_view == "Percentage Breakdown by PM Type":
+                st.dataframe(
+                    pivot_pct_display,
+                    use_container_width=True,
+                    hide_index=False
                 )
-                
-        except Exception as e:
-            st.error(f"Error in AP analysis: {str(e)}")
+            elif selected_view == "Amount Breakdown by PM Type (in dollars)":
+                st.dataframe(
+                    pivot_df.round(2),
+                    use_container_width=True,
+                    hide_index=False
+                )
+
+            # Add download button for the analysis
+            csv = grouped_df.to_csv(index=False)
+            st.download_button(
+                "Download Analysis",
+                csv,
+                "analysis_results.csv",
+                "text/csv"
+            )
+            
+    except Exception as e:
+        st.error(f"Error in AP analysis: {str(e)}")
     
-    # AR Analysis Tab
-    with tab2:
-        st.header("AR Analysis")
+    performance_panel(stages)
+
+@st.fragment
+def ar_analysis_tab():
+    # Widget changes in this tab rerun only this function
+    st.header("AR Analysis")
+    stages = []
+    
+    try:
+        # Load the analysis file - AR sheet
+        file_path = 'summary_table_updated_analysis.xlsx'
+        with timed_stage("AR load", records=stages) as stage:
+            version = current_version(file_path)
+            # Breakdowns run as SQL when the pipeline filled a store for this version
+            store = open_store(file_path, 'pc_overview AR', version)
+            df_ar = None if store else shared_sheet(file_path, 'pc_overview AR')
+            source_column_types, n_rows = source_columns(df_ar, store)
+            stage['rows'] = n_rows
         
-        try:
-            # Load the analysis file - AR sheet
-            file_path = 'summary_table_updated_analysis.xlsx'
-            df_ar = pd.read_excel(file_path, sheet_name='pc_overview AR')
-            
-            # Get AR column descriptions
-            column_descriptions = get_ar_column_descriptions()
-            
-            # Get all possible columns for grouping (excluding amount column)
-            groupable_columns = [col for col in df_ar.columns if col != 'Total Contract $' 
-                               and not pd.api.types.is_numeric_dtype(df_ar[col])]
+        # Get AR column descriptions
+        column_descriptions = get_ar_column_descriptions()
+        
+        # Get all possible columns for grouping (excluding amount column)
+        groupable_columns = [col for col, numeric in source_column_types if col != 'Total Contract $' 
+                           and not numeric]
+        
+        # Create formatted options for the multiselect
+        formatted_options = []
+        for col in groupable_columns:
+            desc = column_descriptions.get(col, '')
+            if desc:
+                formatted_options.append(f"{col} - {desc}")
+            else:
+                formatted_options.append(col)
+        
+        # Find Main Page in formatted options
+        default_option = next(
+            (opt for opt in formatted_options if opt.startswith('Main Page')),
+            formatted_options[0] if formatted_options else None
+        )
+        
+        # Multi-select dropdown with descriptions - Main Page default for AR
+        selected_formatted = st.multiselect(
+            'Select columns for analysis:',
+            options=formatted_options,
+            default=default_option,
+            help="Hover over options to see descriptions",
+            key='ar_select'
+        )
+        
+        # Convert selected formatted options back to column names
+        selected_columns = [opt.split(' - ')[0] for opt in selected_formatted]
+        
+        if selected_columns:
+            # Create grouped analysis using 'Total Contract $' instead of 'Amount'
+            with timed_stage("AR groupby", rows=n_rows, records=stages):
+                grouped_df = grouped_breakdown(df_ar, version, selected_columns, 'Total Contract $', store=store)
             
-            # Create formatted options for the multiselect
-            formatted_options = []
-            for col in groupable_columns:
-                desc = column_descriptions.get(col, '')
-                if desc:
-                    formatted_options.append(f"{col} - {desc}")
-                else:
-                    formatted_options.append(col)
+            # Sort by Total Amount descending
+            grouped_df = grouped_df.sort_values('Total Amount', ascending=False)
             
-            # Find Main Page in formatted options
-            default_option = next(
-                (opt for opt in formatted_options if opt.startswith('Main Page')),
-                formatted_options[0] if formatted_options else None
-            )
+            # Display results
+            st.subheader("Breakdown By Selected Columns")
             
-            # Multi-select dropdown with descriptions - Main Page default for AR
-            selected_formatted = st.multiselect(
-                'Select columns for analysis:',
-                options=formatted_options,
-                default=default_option,
-                help="Hover over options to see descriptions",
-                key='ar_select'
+            # Show table
+            st.dataframe(
+                grouped_df,
+                use_container_width=True,
+                hide_index=True
             )
             
-            # Convert selected formatted options back to column names
-            selected_columns = [opt.split(' - ')[0] for opt in selected_formatted]
-            
-            if selected_columns:
-                # Create grouped analysis using 'Total Contract $' instead of 'Amount'
-                grouped_df = df_ar.groupby(selected_columns).agg({
-                    'Total Contract $': ['sum', 'count']
-                }).reset_index()
+            # Create visualization
+            plot_stage = begin_stage("AR plot", rows=len(grouped_df))
+            if len(selected_columns) <= 2:  # Bar chart for 1-2 columns
+                first_col = selected_columns[0]
+                second_col = selected_columns[1] if len(selected_columns) > 1 else None
                 
-                # Flatten column names and rename
-                grouped_df.columns = [
-                    col[0] if col[1] == '' else f"{col[0]}_{col[1]}" 
-                    for col in grouped_df.columns
-                ]
-                grouped_df = grouped_df.rename(columns={
-                    'Total Contract $_sum': 'Total Amount',
-                    'Total Contract $_count': 'Count'
-                })
+                # Get total amount for each value in first column
+                first_col_totals = grouped_df.groupby(first_col)['Total Amount'].sum().sort_values(ascending=False)
                 
-                # Sort by Total Amount descending
-                grouped_df = grouped_df.sort_values('Total Amount', ascending=False)
-                
-                # Display results
-                st.subheader("Breakdown By Selected Columns")
-                
-                # Show table
-                st.dataframe(
-                    grouped_df,
-                    use_container_width=True,
-                    hide_index=True
-                )
+                # If more than 10 unique values in first column, take top 10
+                if len(first_col_totals) > 10:
+                    top_10_first_col = first_col_totals.head(10).index
+                    plot_df = grouped_df[grouped_df[first_col].isin(top_10_first_col)].copy()
+                    plot_df[first_col] = pd.Categorical(
+                        plot_df[first_col], 
+                        categories=top_10_first_col, 
+                        ordered=True
+                    )
+                    plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
+                else:
+                    plot_df = grouped_df.copy()
+                    plot_df[first_col] = pd.Categorical(
+                        plot_df[first_col], 
+                        categories=first_col_totals.index, 
+                        ordered=True
+                    )
+                    plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
                 
-                # Create visualization
-                if len(selected_columns) <= 2:  # Bar chart for 1-2 columns
-                    first_col = selected_columns[0]
-                    second_col = selected_columns[1] if len(selected_columns) > 1 else None
+                if second_col:  # Two columns selected
+                    # Calculate percentages within each first column category
+                    plot_df['Percentage of Total'] = share_of_parent(plot_df, [first_col])
                     
-                    # Get total amount for each value in first column
-                    first_col_totals = grouped_df.groupby(first_col)['Total Amount'].sum().sort_values(ascending=False)
+                    fig = px.bar(
+                        plot_df,
+                        x=first_col,
+                        y='Total Amount',
+                        color=second_col,
+                        title=f'Amount by {first_col}' + 
+                              f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
+                        labels={'Total Amount': 'Total Amount ($)'},
+                        custom_data=[plot_df['Percentage of Total'], plot_df[second_col]]
+                    )
                     
-                    # If more than 10 unique values in first column, take top 10
-                    if len(first_col_totals) > 10:
-                        top_10_first_col = first_col_totals.head(10).index
-                        plot_df = grouped_df[grouped_df[first_col].isin(top_10_first_col)].copy()
-                        plot_df[first_col] = pd.Categorical(
-                            plot_df[first_col], 
-                            categories=top_10_first_col, 
-                            ordered=True
-                        )
-                        plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
-                    else:
-                        plot_df = grouped_df.copy()
-                        plot_df[first_col] = pd.Categorical(
-                            plot_df[first_col], 
-                            categories=first_col_totals.index, 
-                            ordered=True
+                    fig.update_traces(
+                        hovertemplate=(
+                            "%{x}<br>" +
+                            "%{customdata[1]}: %{y:,.2f}<br>" +
+                            "Percentage within %{x}: %{customdata[0]:.1f}%<extra></extra>"
                         )
-                        plot_df = plot_df.sort_values([first_col, 'Total Amount'], ascending=[True, False])
+                    )
+                else:  # Single column
+                    fig = px.bar(
+                        plot_df,
+                        x=first_col,
+                        y='Total Amount',
+                        title=f'Amount by {first_col}' + 
+                              f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
+                        labels={'Total Amount': 'Total Amount ($)'}
+                    )
                     
-                    if second_col:  # Two columns selected
-                        # Calculate percentages within each first column category
-                        plot_df['Percentage of Total'] = plot_df.apply(
-                            lambda row: (row['Total Amount'] / first_col_totals[row[first_col]]) * 100,
-                            axis=1
-                        )
-                        
-                        fig = px.bar(
-                            plot_df,
-                            x=first_col,
-                            y='Total Amount',
-                            color=second_col,
-                            title=f'Amount by {first_col}' + 
-                                  f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
-                            labels={'Total Amount': 'Total Amount ($)'},
-                            custom_data=[plot_df['Percentage of Total'], plot_df[second_col]]
-                        )
-                        
-                        fig.update_traces(
-                            hovertemplate=(
-                                "%{x}<br>" +
-                                "%{customdata[1]}: %{y:,.2f}<br>" +
-                                "Percentage within %{x}: %{customdata[0]:.1f}%<extra></extra>"
-                            )
-                        )
-                    else:  # Single column
-                        fig = px.bar(
-                            plot_df,
-                            x=first_col,
-                            y='Total Amount',
-                            title=f'Amount by {first_col}' + 
-                                  f' (Top 10 by Total Amount)' if len(first_col_totals) > 10 else '',
-                            labels={'Total Amount': 'Total Amount ($)'}
-                        )
-                        
-                        fig.update_traces(
-                            hovertemplate=(
-                                "%{x}<br>" +
-                                "Amount: %{y:,.2f}<extra></extra>"
-                            )
+                    fig.update_traces(
+                        hovertemplate=(
+                            "%{x}<br>" +
+                            "Amount: %{y:,.2f}<extra></extra>"
                         )
-                else:  # Treemap for 3+ columns
-                    fig = px.treemap(
-                        grouped_df,
-                        path=selected_columns,
-                        values='Total Amount',
-                        title='Distribution of Total Amount'
                     )
-                
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # First clean up blank/NaN/0 values in CO/Added
-                df_ar['CO/Added'] = df_ar['CO/Added'].fillna('Unspecified')
-                df_ar['CO/Added'] = df_ar['CO/Added'].replace(['', '0', 0], 'Unspecified')
-
-                # Define column order
-                column_order = [
-                    'Main',
-                    'CO',
-                    'Added',
-                    'Unspecified'
-                ]
-
-                # Create pivot tables for percentages and amounts
-                pivot_df = df_ar.pivot_table(
-                    values='Total Contract $',
-                    index='Main Page',
-                    columns='CO/Added',
-                    aggfunc='sum'
-                ).fillna(0)
-
-                # Reorder columns (and add any missing columns with zeros)
-                for col in column_order:
-                    if col not in pivot_df.columns:
-                        pivot_df[col] = 0
-                pivot_df = pivot_df[column_order]
-
-                # Calculate percentages
-                pivot_pct = pivot_df.div(pivot_df.sum(axis=1), axis=0) * 100
-                pivot_pct_display = pivot_pct.round(2)
-
-                # Format with % symbol
-                for column in pivot_pct_display.columns:
-                    pivot_pct_display[column] = pivot_pct_display[column].astype(str) + '%'
-
-                # Create a new dataframe for the ratio calculations
-                ratio_df = pd.DataFrame(index=pivot_df.index)
-
-                # Calculate the ratios with more descriptive names
-                ratio_df['Change Order %'] = (pivot_df['CO'] / pivot_df['Main'] * 100).round(2)
-                ratio_df['Added Work %'] = (pivot_df['Added'] / pivot_df['Main'] * 100).round(2)
-                ratio_df['Total Changes %'] = ((pivot_df['CO'] + pivot_df['Added']) / pivot_df['Main'] * 100).round(2)
-
-                # Format with % symbol
-                for column in ratio_df.columns:
-                    ratio_df[column] = ratio_df[column].astype(str) + '%'
-
-                # View selection dropdown
-                selected_view = st.selectbox(
-                    "Select Analysis View:",
-                    options=[
-                        "Percentage Breakdown by Main Page",
-                        "Amount Breakdown by Main Page (in dollars)",
-                        "Change Order Ratios"
-                    ],
-                    key='ar_view'  # Unique key for AR
+            else:  # Treemap for 3+ columns
+                fig = px.treemap(
+                    grouped_df,
+                    path=selected_columns,
+                    values='Total Amount',
+                    title='Distribution of Total Amount'
                 )
+            
+            st.plotly_chart(fig, use_container_width=True)
+            end_stage(plot_stage, records=stages)
+            
+            # Define column order (blank/NaN/0 CO/Added values count as Unspecified)
+            column_order = AR_PIVOT_ORDER
 
-                # Display selected view for AR
-                if selected_view == "Percentage Breakdown by Main Page":
-                    st.dataframe(
-                        pivot_pct_display,
-                        use_container_width=True,
-                        hide_index=False
-                    )
-                elif selected_view == "Amount Breakdown by Main Page (in dollars)":
-                    st.dataframe(
-                        pivot_df.round(2),
-                        use_container_width=True,
-                        hide_index=False
-                    )
-                elif selected_view == "Change Order Ratios":
-                    st.dataframe(
-                        ratio_df,
-                        use_container_width=True,
-                        hide_index=False
-                    )
+            # Create pivot tables for percentages and amounts
+            with timed_stage("AR pivot", rows=n_rows, records=stages):
+                pivot_df = pivot_breakdown(df_ar, version, 'Main Page', 'CO/Added', 'Total Contract $', column_order, store=store)
+
+            # Calculate percentages
+            pivot_pct = pivot_df.div(pivot_df.sum(axis=1), axis=0) * 100
+            pivot_pct_display = pivot_pct.round(2)
+
+            # Format with % symbol
+            for column in pivot_pct_display.columns:
+                pivot_pct_display[column] = pivot_pct_display[column].astype(str) + '%'
+
+            # Create a new dataframe for the ratio calculations
+            ratio_df = pd.DataFrame(index=pivot_df.index)
 
-                # Add download button for the analysis
-                csv = grouped_df.to_csv(index=False)
-                st.download_button(
-                    "Download Analysis",
-                    csv,
-                    "ar_analysis_results.csv",  # Different filename for AR
-                    "text/csv",
-                    key='ar_download'  # Unique key for AR
+            # Calculate the ratios with more descriptive names
+            ratio_df['Change Order %'] = (pivot_df['CO'] / pivot_df['Main'] * 100).round(2)
+            ratio_df['Added Work %'] = (pivot_df['Added'] / pivot_df['Main'] * 100).round(2)
+            ratio_df['Total Changes %'] = ((pivot_df['CO'] + pivot_df['Added']) / pivot_df['Main'] * 100).round(2)
+
+            # Format with % symbol
+            for column in ratio_df.columns:
+                ratio_df[column] = ratio_df[column].astype(str) + '%'
+
+            # View selection dropdown
+            selected_view = st.selectbox(
+                "Select Analysis View:",
+                options=[
+                    "Percentage Breakdown by Main Page",
+                    "Amount Breakdown by Main Page (in dollars)",
+                    "Change Order Ratios"
+                ],
+                key='ar_view'  # Unique key for AR
+            )
+
+            # Display selected view for AR
+            if selected_view == "Percentage Breakdown by Main Page":
+                st.dataframe(
+                    pivot_pct_display,
+                    use_container_width=True,
+                    hide_index=False
                 )
-                
-        except Exception as e:
-            st.error(f"Error in AR analysis: {str(e)}")
+            elif selected_view == "Amount Breakdown by Main Page (in dollars)":
+                st.dataframe(
+                    pivot_df.round(2),
+                    use_container_width=True,
+                    hide_index=False
+                )
+            elif selected_view == "Change Order Ratios":
+                st.dataframe(
+                    ratio_df,
+                    use_container_width=True,
+                    hide_index=False
+                )
+
+            # Add download button for the analysis
+            csv = grouped_df.to_csv(index=False)
+            st.download_button(
+                "Download Analysis",
+                csv,
+                "ar_analysis_results.csv",  # Different filename for AR
+                "text/csv",
+                key='ar_download'  # Unique key for AR
+            )
+            
+    except Exception as e:
+        st.error(f"Error in AR analysis: {str(e)}")
     
-    # Data View Tab
-    with tab3:
-        st.header("Data Overview")
+    performance_panel(stages)
+
+@st.fragment
+def data_view_tab():
+    # Grid paging and filters rerun only this function
+    st.header("Data Overview")
+    stages = []
+    with timed_stage("Data View load", records=stages):
         pc_overview_ap, pc_overview_ar = load_existing_data()
+    
+    if pc_overview_ap is not None and pc_overview_ar is not None:
+        # AP Overview Section
+        st.subheader("PC Overview AP")
+        ap_grid = create_aggrid_table(pc_overview_ap, 'ap', stages)
         
-        if pc_overview_ap is not None and pc_overview_ar is not None:
-            # AP Overview Section
-            st.subheader("PC Overview AP")
-            ap_grid = create_aggrid_table(pc_overview_ap, 'ap')
-            
-            # AR Overview Section
-            st.subheader("PC Overview AR")
-            ar_grid = create_aggrid_table(pc_overview_ar, 'ar')
+        # AR Overview Section
+        st.subheader("PC Overview AR")
+        ar_grid = create_aggrid_table(pc_overview_ar, 'ar', stages)
+    
+    performance_panel(stages)
+
+@st.cache_data(max_entries=8)
+def snapshot_trend(dataset, snapshots):
+    # period_changes reads every delta, so it runs once per dataset and set of snapshots taken
+    return period_changes(dataset)
+
+@st.fragment
+def trend_tab():
+    # Month-over-month changes from the snapshot store, without loading past reports
+    st.header("Trends")
+    stages = []
+
+    try:
+        snapshots = manifest_version()
+        if not snapshots:
+            st.info("No snapshots yet. Run `python pipeline.py --snapshot` to record this month's report.")
+            return
+
+        dataset = st.radio('Data:', list(SNAPSHOT_DATASETS), horizontal=True, key='trend_dataset')
+        group, value = SNAPSHOT_DATASETS[dataset]['group'], SNAPSHOT_DATASETS[dataset]['value']
+        with timed_stage("Trends load", rows=len(snapshots), records=stages):
+            trend = snapshot_trend(dataset, snapshots)
+
+        fig = px.line(
+            trend,
+            x='Snapshot',
+            y='Total',
+            color=group,
+            markers=True,
+            title=f'{value} by {group} per snapshot',
+            labels={'Total': f'{value} ($)'}
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+        # Change per group in each snapshot, latest first
+        st.subheader("Change since the previous snapshot")
+        changes = trend.pivot(index=group, columns='Snapshot', values='Change').iloc[:, ::-1]
+        st.dataframe(changes, use_container_width=True)
+    except Exception as e:
+        st.error(f"Error in trends: {str(e)}")
+
+    performance_panel(stages)
+
+def reconcile_report(file_path, keys):
+    # AP against AR in one join over the shared report sheets
+    pc_overview_ap = shared_sheet(file_path, 'pc_overview AP')
+    pc_overview_ar = shared_sheet(file_path, 'pc_overview AR')
+    return reconcile_ap_ar(pc_overview_ap, pc_overview_ar, keys)
+
+@st.fragment
+def reconciliation_tab():
+    # The join runs once per data version and keys for every session; the widgets rerun only this tab
+    st.header("AP/AR Reconciliation")
+    stages = []
+
+    try:
+        file_path = 'summary_table_updated_analysis.xlsx'
+        match_on = {'Project and PM Type': RECONCILE_KEYS, 'PO #': ['PO #']}
+        selected_keys = st.radio(
+            'Match on:', list(match_on), horizontal=True, key='recon_keys',
+            help="AP lists vendor POs and AR the TSMC POs, so the two sides usually meet per project and PM Type"
+        )
+        keys = match_on[selected_keys]
+        with timed_stage("Reconciliation", records=stages) as stage:
+            reconciled = cached_frame(
+                'reconcile', current_version(file_path), (tuple(keys),), lambda: reconcile_report(file_path, keys)
+            )
+            stage['rows'] = len(reconciled)
+
+        st.subheader("Summary")
+        st.dataframe(reconciliation_summary(reconciled), use_container_width=True, hide_index=True)
+
+        status = st.selectbox('Show:', RECONCILE_STATUSES, index=1, key='recon_status')
+        rows = reconciled[reconciled['Status'] == status]
+        st.subheader(f"{status} ({len(rows)})")
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+        st.download_button(
+            "Download Reconciliation",
+            reconciled.to_csv(index=False),
+            "ap_ar_reconciliation.csv",
+            "text/csv",
+            key='recon_download'
+        )
+    except Exception as e:
+        st.error(f"Error in reconciliation: {str(e)}")
+
+    performance_panel(stages)
+
+def main():
+    st.title("MICU AR/AP Breakdown Analysis")
+    refresh_badge()
+    
+    # Main tabs - switching tabs reruns the app so only the open tab is computed
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(
+        ["AP Analysis", "AR Analysis", "Data View", "Trends", "Reconciliation"], key='main_tabs', on_change='rerun'
+    )
+    
+    # Widgets of closed tabs are not rendered, so keep their values for when the tab reopens
+    for tab, keys in [
+        (tab1, ['ap_select', 'ap_view']), (tab2, ['ar_select', 'ar_view']),
+        (tab4, ['trend_dataset']), (tab5, ['recon_keys', 'recon_status'])
+    ]:
+        if not tab.open:
+            for key in keys:
+                if key in st.session_state:
+                    st.session_state[key] = st.session_state[key]
+    
+    # AP Analysis Tab
+    with tab1:
+        if tab1.open:
+            ap_analysis_tab()
+    
+    # AR Analysis Tab
+    with tab2:
+        if tab2.open:
+            ar_analysis_tab()
+    
+    # Data View Tab
+    with tab3:
+        if tab3.open:
+            data_view_tab()
+    
+    # Trends Tab
+    with tab4:
+        if tab4.open:
+            trend_tab()
+    
+    # Reconciliation Tab
+    with tab5:
+        if tab5.open:
+            reconciliation_tab()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
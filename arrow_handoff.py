@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+from aggregations import DEFAULT_BREAKDOWNS, grouped_totals
+from data_cache import CACHE_DIR, file_fingerprint, normalize_for_parquet
+from schema import apply_schema
+
+# Published versions kept on disk; a dashboard may still have the previous one mapped
+KEEP_VERSIONS = 2
+
+
+def handoff_dir(workbook_path):
+    source_dir, file_name = os.path.split(os.path.abspath(workbook_path))
+    return os.path.join(source_dir, CACHE_DIR, f"{os.path.splitext(file_name)[0]}_arrow")
+
+
+def _pointer_path(workbook_path):
+    return os.path.join(handoff_dir(workbook_path), 'current.json')
+
+
+def _file_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name) + '.arrow'
+
+
+def write_arrow(df, path):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_arrow(path):
+    """DataFrame over a memory-mapped Arrow IPC file
+
+    The mapping stays open for as long as the frame uses it. Text columns are
+    Arrow-backed and point straight into it, so processes mapping the same
+    file share its pages through the OS cache instead of each holding a copy.
+    """
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all().to_pandas(split_blocks=True)
+
+
+def publish(workbook_path, frames):
+    """Publish the sheets just written to workbook_path as Arrow files and make them current
+
+    frames maps sheet names to the DataFrames written. The totals behind the
+    tabs' default breakdowns (DEFAULT_BREAKDOWNS) are published with them.
+    Everything goes into a directory named after the workbook's data version.
+    Readers switch to it when current.json is replaced, which is atomic, so
+    they never see a half-written version. Returns the new pointer.
+    """
+    fingerprint = file_fingerprint(workbook_path)
+    version = fingerprint['sha256'][:16]
+    root = handoff_dir(workbook_path)
+    version_dir = os.path.join(root, version)
+    sheets, totals = {}, []
+
+    tmp_dir = f"{version_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for sheet_name, df in frames.items():
+        # The frame as the dashboard would read it back from the workbook, whose categories are
+        # only the labels written: rows filtered out after the dtypes were set leave unused ones
+        df = apply_schema(normalize_for_parquet(df))
+        df = df.assign(**{
+            col: df[col].cat.remove_unused_categories()
+            for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)
+        })
+        sheets[sheet_name] = _file_name(sheet_name)
+        write_arrow(df, os.path.join(tmp_dir, sheets[sheet_name]))
+        for breakdown_sheet, value_column, columns, _, index, pivot_columns, _ in DEFAULT_BREAKDOWNS:
+            if breakdown_sheet != sheet_name:
+                continue
+            for group in (list(columns), [index, pivot_columns]):
+                if not set(group + [value_column]) <= set(df.columns):
+                    continue
+                file_name = f"totals_{len(totals)}.arrow"
+                write_arrow(normalize_for_parquet(grouped_totals(df, version, group, value_column)),
+                            os.path.join(tmp_dir, file_name))
+                totals.append({'value_column': value_column, 'columns': group, 'file': file_name})
+    if os.path.exists(version_dir):
+        # Already published (the same data was written again); mapped files are left alone
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, version_dir)
+
+    pointer = {
+        'version': version,
+        'mtime_ns': fingerprint['mtime_ns'],
+        'size': fingerprint['size'],
+        'published_at': datetime.now().isoformat(timespec='seconds'),
+        'sheets': sheets,
+        'totals': totals
+    }
+    path = _pointer_path(workbook_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(tmp_path, path)
+
+    # Older versions go; on Windows a version still mapped by a dashboard stays until the next publish
+    versions = sorted(
+        (entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.endswith('.tmp')),
+        key=lambda entry: entry.stat().st_mtime_ns
+    )
+    for entry in versions[:-KEEP_VERSIONS]:
+        if entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return pointer
+
+
+def current_handoff(workbook_path):
+    """The current pointer if it was published for workbook_path as it is now, else None"""
+    try:
+        with open(_pointer_path(workbook_path), 'r') as f:
+            pointer = json.load(f)
+        stat = os.stat(workbook_path)
+    except (OSError, ValueError):
+        return None
+    if (pointer['mtime_ns'], pointer['size']) != (stat.st_mtime_ns, stat.st_size):
+        return None
+    return pointer
+
+
+def map_sheet(workbook_path, pointer, sheet_name):
+    """The published sheet_name of pointer, memory-mapped, or None if it was not published"""
+    if sheet_name not in pointer['sheets']:
+        return None
+    return apply_schema(read_arrow(os.path.join(handoff_dir(workbook_path), pointer['version'], pointer['sheets'][sheet_name])))
+
+
+def published_totals(workbook_path, pointer):
+    """(value column, group-by columns, totals) for every grouping published with pointer"""
+    version_dir = os.path.join(handoff_dir(workbook_path), pointer['version'])
+    return [
+        (entry['value_column'], entry['columns'], read_arrow(os.path.join(version_dir, entry['file'])))
+        for entry in pointer['totals']
+    ]
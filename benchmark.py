@@ -0,0 +1,310 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import xlsxwriter
+
+from aggregations import AP_PIVOT_ORDER, AR_PIVOT_ORDER, clear_cache, grouped_breakdown, pivot_breakdown
+from grid_paging import apply_filter_model, apply_sort_model
+from instrumentation import peak_rss_mb
+from po_index import po_hashes
+from process_excel import (
+    PC_OVERVIEW_COLUMNS,
+    DERIVED_COLUMNS,
+    classify_pm_types,
+    map_categories,
+    categorize_pm_types,
+    upsert_po_data,
+    read_sheet_streaming,
+    filter_sheets,
+    process_data,
+    update_stack_sheet,
+    preprocess_ar,
+    update_ar_sheet,
+    load_and_process_data,
+    pm_type_totals,
+    process_pm_types,
+    detailed_pm_type_totals,
+    create_base_build_breakdown,
+    reconcile_ap_ar,
+    generate_reports,
+    cleanup_workbook
+)
+from sheet_format import PC_OVERVIEW_WIDTHS, column_widths
+from schema import apply_schema
+from synthetic_data import make_ar_data, make_ar_export, make_pc_overview, write_workspace
+
+BENCHMARK_SIZES = [10000, 100000, 1000000]
+
+# Workbook steps read and write real xlsx files, which takes minutes at 1M rows,
+# so larger sizes only run the in-memory benchmarks unless the limit is raised
+FILE_ROW_LIMIT = 100000
+
+# A typical Data View grid state: a text filter plus a sort on Amount
+GRID_FILTER = {'PO Description': {'filterType': 'text', 'type': 'contains', 'filter': 'mechanical'}}
+GRID_SORT = [{'colId': 'Amount', 'sort': 'desc'}]
+
+
+def measure(run, setup=None, repeat=3):
+    """Best wall time of run over repeat runs, then its peak traced memory in one more run
+
+    setup is called untimed before every run and returns the arguments for run.
+    """
+    seconds = []
+    for _ in range(repeat + 1):
+        args = setup() if setup else ()
+        if len(seconds) < repeat:
+            start = time.perf_counter()
+            run(*args)
+            seconds.append(time.perf_counter() - start)
+        else:
+            # Tracing slows Python code down, so memory gets a run of its own
+            tracemalloc.start()
+            try:
+                run(*args)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+    return {'seconds': min(seconds), 'peak_mb': peak / 2 ** 20}
+
+
+def _run_file_benchmark(root, name):
+    with contextlib.chdir(root):
+        setup, run = file_benchmarks()[name]
+        args = setup() if setup else ()
+        before = peak_rss_mb()
+        start = time.perf_counter()
+        run(*args)
+        seconds = time.perf_counter() - start
+    after = peak_rss_mb()
+    peak_mb = None if after is None else after - before
+    return {'seconds': seconds, 'peak_mb': peak_mb}
+
+
+def measure_in_process(root, name):
+    """Time one run of a workbook step in a fresh process, with how far it raised peak RSS
+
+    openpyxl runs several times slower under tracemalloc, so the workbook steps
+    get one untraced run each and their memory comes from the process instead.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_run_file_benchmark, root, name).result()
+
+
+def _processed_frames(n_rows, seed):
+    # The pc_overview AP/AR sheets as load_and_process_data returns them
+    raw = apply_schema(make_pc_overview(n_rows, seed))
+    pc_overview = raw[raw['TSMC 新工'] == 'Base-Build'].copy()
+    pc_overview['PM Type'] = classify_pm_types(pc_overview)
+    pc_overview['Mapped_Category'] = map_categories(pc_overview['Category'])
+    pc_overview = apply_schema(pc_overview[pc_overview['Amount'] != 0][PC_OVERVIEW_COLUMNS])
+    return raw, pc_overview, apply_schema(make_ar_data(n_rows, seed))
+
+
+def frame_benchmarks(n_rows, seed=0):
+    """{name: (setup, run)} for the functions that work on DataFrames already in memory"""
+    raw, df_ap, df_ar = _processed_frames(n_rows, seed)
+    export = make_ar_export(df_ar, seed=seed).rename(columns={
+        'tsmc PO #': 'PO #',
+        'System': 'Main Page',
+        'PO Amount': 'Total Contract $'
+    })
+
+    def uncached(*args):
+        # The app caches groupings per data version, so start each run cold
+        def setup():
+            clear_cache()
+            return args
+        return setup
+
+    return {
+        'classify_pm_types': (lambda: (raw,), classify_pm_types),
+        'map_categories': (lambda: (raw['Category'],), map_categories),
+        'categorize_pm_types': (lambda: (raw['PO Description'],), categorize_pm_types),
+        'po_hashes': (lambda: (raw,), po_hashes),
+        'upsert_po_data': (lambda: (df_ar, export[export['TSMC Depart'] == '新工']), upsert_po_data),
+        'pm_type_totals': (lambda: (df_ap, df_ar), pm_type_totals),
+        'process_pm_types': (lambda: (df_ap, df_ar), process_pm_types),
+        'detailed_pm_type_totals': (lambda: (df_ap,), detailed_pm_type_totals),
+        'create_base_build_breakdown': (lambda: (df_ap,), create_base_build_breakdown),
+        'reconcile_ap_ar': (lambda: (df_ap, df_ar), reconcile_ap_ar),
+        'ap_grouped_breakdown': (
+            uncached(df_ap, 'benchmark', ['PM Type', 'Main/CO/DCR'], 'Amount', {'Percentage of PM Type': ['PM Type']}),
+            grouped_breakdown
+        ),
+        'ap_pivot_breakdown': (
+            uncached(df_ap, 'benchmark', 'PM Type', 'Main/CO/DCR', 'Amount', AP_PIVOT_ORDER),
+            pivot_breakdown
+        ),
+        'ar_grouped_breakdown': (
+            uncached(df_ar, 'benchmark', ['Main Page', 'CO/Added'], 'Total Contract $'),
+            grouped_breakdown
+        ),
+        'ar_pivot_breakdown': (
+            uncached(df_ar, 'benchmark', 'Main Page', 'CO/Added', 'Total Contract $', AR_PIVOT_ORDER),
+            pivot_breakdown
+        ),
+        'grid_filter_sort': (
+            lambda: (df_ap,),
+            lambda df: apply_sort_model(apply_filter_model(df, GRID_FILTER), GRID_SORT)
+        ),
+        'column_widths': (lambda: (df_ap, PC_OVERVIEW_WIDTHS), column_widths),
+    }
+
+
+def file_benchmarks():
+    """{name: (setup, run)} for the workbook steps, in pipeline order, run from a write_workspace directory"""
+    all_stack = os.path.join('AP_Files', 'All_Stack.xlsx')
+    filtered = os.path.join('AP_Files', 'All_Stack_Filtered.xlsx')
+    ar_updated = os.path.join('AR_Files', 'AR_updated.xlsx')
+    loaded = {}
+
+    def restore(path):
+        # update_* steps append to their workbook, so every run starts from the generated copy
+        def setup():
+            if not os.path.exists(f"{path}.orig"):
+                shutil.copyfile(path, f"{path}.orig")
+            shutil.copyfile(f"{path}.orig", path)
+            return ()
+        return setup
+
+    def report_inputs():
+        if not loaded:
+            loaded['frames'] = load_and_process_data()
+        return loaded['frames']
+
+    return {
+        'filter_sheets': (
+            lambda: (all_stack, filtered, os.path.join('AP_Files', 'po_exclusions.txt')),
+            filter_sheets
+        ),
+        'read_sheet_streaming': (
+            lambda: (filtered, 'pc_overview', [col for col in PC_OVERVIEW_COLUMNS if col not in DERIVED_COLUMNS]),
+            read_sheet_streaming
+        ),
+        'process_data': (None, process_data),
+        'update_stack_sheet': (restore(all_stack), update_stack_sheet),
+        'preprocess_ar': (None, preprocess_ar),
+        'update_ar_sheet': (restore(ar_updated), update_ar_sheet),
+        'load_and_process_data': (None, load_and_process_data),
+        'generate_reports': (report_inputs, generate_reports),
+        'generate_reports_formulas': (lambda: (*report_inputs(), 'formulas'), generate_reports),
+        'cleanup_workbook': (None, cleanup_workbook),
+    }
+
+
+def _megabytes(peak_mb):
+    return 'n/a' if peak_mb is None else f"{peak_mb:.1f} MB"
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, repeat=3, file_row_limit=FILE_ROW_LIMIT, seed=0, only=None):
+    """Time and memory-profile every benchmark at each size, returning one record per run
+
+    In-memory benchmarks report the tracemalloc peak, workbook steps the growth
+    of the peak RSS of their process (None where the platform has no rusage).
+    """
+    results = []
+
+    def record(name, n_rows, memory, result):
+        result = dict(name=name, rows=n_rows, memory=memory, **result)
+        print(f"{n_rows:>9,} rows  {name:<28} {result['seconds']:>9.3f}s {_megabytes(result['peak_mb']):>12}", flush=True)
+        results.append(result)
+
+    for n_rows in sizes:
+        for name, (setup, run) in frame_benchmarks(n_rows, seed).items():
+            if not only or name in only:
+                record(name, n_rows, 'tracemalloc', measure(run, setup, repeat))
+
+        steps = list(file_benchmarks())
+        selected = [name for name in steps if not only or name in only]
+        if n_rows > file_row_limit or not selected:
+            continue
+        with tempfile.TemporaryDirectory() as root:
+            write_workspace(root, n_rows, seed)
+            # Earlier steps write the workbooks later ones read, so they still run, untimed
+            for name in steps[:steps.index(selected[-1]) + 1]:
+                if name in selected:
+                    record(name, n_rows, 'rss', measure_in_process(root, name))
+                else:
+                    _run_file_benchmark(root, name)
+
+    return results
+
+
+def environment():
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'openpyxl': openpyxl.__version__,
+        'xlsxwriter': xlsxwriter.__version__,
+    }
+
+
+def compare(results, baseline, tolerance=1.25):
+    """Runs slower or hungrier than tolerance x their baseline record, as (result, baseline) pairs"""
+    previous = {(b['name'], b['rows']): b for b in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result['name'], result['rows']))
+        if base is None:
+            continue
+        # Differences under 10 ms or 1 MB are noise, mostly for the small summary frames
+        slower = result['seconds'] > max(base['seconds'] * tolerance, base['seconds'] + 0.01)
+        hungrier = (result['peak_mb'] is not None and base['peak_mb'] is not None
+                    and result['peak_mb'] > max(base['peak_mb'] * tolerance, base['peak_mb'] + 1))
+        if slower or hungrier:
+            regressions.append((result, base))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark process_excel and the app aggregations on synthetic data")
+    parser.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')], default=BENCHMARK_SIZES,
+                        help="comma-separated row counts (default: 10000,100000,1000000)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per in-memory benchmark (best is kept)")
+    parser.add_argument('--file-rows-limit', type=int, default=FILE_ROW_LIMIT,
+                        help=f"largest size that also runs the workbook steps (default: {FILE_ROW_LIMIT})")
+    parser.add_argument('--only', type=lambda s: s.split(','), help="comma-separated benchmark names to run")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to save the results")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="slowdown or memory growth that counts as a regression (default: 1.25)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat, file_row_limit=args.file_rows_limit, only=args.only)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"Saved {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for result, base in regressions:
+            print(f"REGRESSION {result['name']} at {result['rows']:,} rows: "
+                  f"{base['seconds']:.3f}s -> {result['seconds']:.3f}s, "
+                  f"{_megabytes(base['peak_mb'])} -> {_megabytes(result['peak_mb'])}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
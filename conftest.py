@@ -0,0 +1,8 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def df():
+    # Same sheet test_calculations.py loads when run as a script
+    return pd.read_excel('summary_table_updated_analysis.xlsx', sheet_name='pc_overview AP')
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+from schema import apply_schema
+
+# Sheets converted together whenever the analysis workbook changes
+ANALYSIS_SHEETS = ['pc_overview AP', 'pc_overview AR']
+
+CACHE_DIR = '.cache'
+
+# Sessions and the background watcher share the cache; one of them rebuilds it at a time
+_build_lock = threading.Lock()
+
+
+def file_fingerprint(file_path, chunk_size=1024 * 1024):
+    """Return the mtime, size and sha256 of a source file"""
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': digest.hexdigest()
+    }
+
+
+def _cache_dir(file_path):
+    source_dir, file_name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(source_dir, CACHE_DIR, os.path.splitext(file_name)[0])
+
+
+def _sheet_cache_path(cache_dir, sheet_name):
+    safe_name = ''.join(c if c.isalnum() else '_' for c in sheet_name)
+    return os.path.join(cache_dir, f"{safe_name}.parquet")
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, 'manifest.json')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def normalize_for_parquet(df):
+    # Columns such as Main/CO/DCR mix numbers and text in Excel, which
+    # Arrow cannot store in one column, so keep non-null values as text
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            values = df[col].dropna()
+            if values.map(type).nunique() > 1:
+                df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def _rebuild(file_path, cache_dir, sheet_names, fingerprint):
+    os.makedirs(cache_dir, exist_ok=True)
+    # One pass over the workbook for every cached sheet
+    frames = pd.read_excel(file_path, sheet_name=list(sheet_names))
+    for sheet_name, df in frames.items():
+        path = _sheet_cache_path(cache_dir, sheet_name)
+        # Per-process temporary name, as the watcher may run as a process of its own
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        # Typed columns are stored as such, so reading the cache needs no inference
+        normalize_for_parquet(apply_schema(df)).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    manifest = dict(fingerprint, sheets=list(sheet_names))
+    _write_manifest(cache_dir, manifest)
+    return manifest
+
+
+def ensure_cache(file_path, sheet_names=ANALYSIS_SHEETS):
+    """Make sure the columnar cache for file_path is current and return its manifest"""
+    with _build_lock:
+        return _ensure_cache(file_path, sheet_names)
+
+
+def _ensure_cache(file_path, sheet_names):
+    cache_dir = _cache_dir(file_path)
+    manifest = _read_manifest(cache_dir)
+    stat = os.stat(file_path)
+
+    sheets_cached = manifest is not None and all(
+        name in manifest['sheets'] and os.path.exists(_sheet_cache_path(cache_dir, name))
+        for name in sheet_names
+    )
+    if sheets_cached and manifest['mtime_ns'] == stat.st_mtime_ns and manifest['size'] == stat.st_size:
+        return manifest
+
+    # The file was touched or a sheet is missing: only rebuild if the contents changed
+    fingerprint = file_fingerprint(file_path)
+    if sheets_cached and manifest['sha256'] == fingerprint['sha256']:
+        manifest.update(fingerprint)
+        _write_manifest(cache_dir, manifest)
+        return manifest
+
+    wanted = list(dict.fromkeys(list(sheet_names) + (manifest['sheets'] if manifest else [])))
+    return _rebuild(file_path, cache_dir, wanted, fingerprint)
+
+
+def load_sheet(file_path, sheet_name, cached_sheets=ANALYSIS_SHEETS):
+    """Read one sheet of file_path through the columnar cache"""
+    ensure_cache(file_path, list(dict.fromkeys(list(cached_sheets) + [sheet_name])))
+    return apply_schema(pd.read_parquet(_sheet_cache_path(_cache_dir(file_path), sheet_name)))
+
+
+def source_version(file_path):
+    """Short content hash identifying the cached version of file_path"""
+    return ensure_cache(file_path)['sha256'][:16]
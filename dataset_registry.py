@@ -0,0 +1,77 @@
+import os
+import threading
+
+from aggregations import cache_stats, drop_stale, seed_grouped_totals
+from arrow_handoff import current_handoff, map_sheet, published_totals
+from data_cache import load_sheet, source_version
+
+# (workbook path, sheet name) -> (data version, frame), one per server process
+_datasets = {}
+# workbook path -> data version last seen
+_versions = {}
+# Held while a sheet loads, so sessions asking at the same time share one read
+_lock = threading.Lock()
+_stats = {'loads': 0, 'mapped': 0, 'hits': 0}
+
+
+def current_version(file_path):
+    """Data version of file_path; a new version drops the frames and breakdowns of the old one
+
+    When the pipeline published this very workbook as Arrow files, the
+    version comes from its pointer and the published totals seed the
+    breakdown cache, so nothing is hashed or parsed.
+    """
+    pointer = current_handoff(file_path)
+    version = pointer['version'] if pointer else source_version(file_path)
+    path = os.path.abspath(file_path)
+    with _lock:
+        if _versions.get(path) != version:
+            for key in [key for key in _datasets if key[0] == path]:
+                del _datasets[key]
+            drop_stale(version)
+            if pointer:
+                for value_column, columns, totals in published_totals(file_path, pointer):
+                    seed_grouped_totals(totals, version, columns, value_column)
+            _versions[path] = version
+    return version
+
+
+def shared_sheet(file_path, sheet_name):
+    """The current sheet_name of file_path, read once for every session
+
+    Callers get a shallow copy of the one shared frame; with copy-on-write
+    (always on from pandas 3, hence pandas>=3 in requirements.txt) a caller
+    that changes it, even in place, only copies the columns it touches, so
+    the frame the other sessions see stays as it was read.
+    """
+    version = current_version(file_path)
+    key = (os.path.abspath(file_path), sheet_name)
+    with _lock:
+        entry = _datasets.get(key)
+        if entry is None or entry[0] != version:
+            # Mapping the pipeline's Arrow file is near free; the workbook is read only without one
+            pointer = current_handoff(file_path)
+            df = map_sheet(file_path, pointer, sheet_name) if pointer and pointer['version'] == version else None
+            _stats['mapped' if df is not None else 'loads'] += 1
+            entry = (version, load_sheet(file_path, sheet_name) if df is None else df)
+            _datasets[key] = entry
+        else:
+            _stats['hits'] += 1
+    return entry[1].copy(deep=False)
+
+
+def registry_stats():
+    """Shared sheets held, their memory and hit/miss counts, plus the breakdown cache's"""
+    with _lock:
+        frames = [df for _, df in _datasets.values()]
+        stats = dict(_stats, sheets=len(frames))
+    stats['sheet_bytes'] = int(sum(df.memory_usage(index=True, deep=True).sum() for df in frames))
+    stats['breakdowns'] = cache_stats()
+    return stats
+
+
+def clear_registry():
+    with _lock:
+        _datasets.clear()
+        _versions.clear()
+        _stats.update(loads=0, mapped=0, hits=0)
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+# Rows sent to the browser per page of the Data View grids
+PAGE_SIZE = 500
+
+
+def _is_blank(values):
+    return values.isna() | (values.astype(str).str.strip() == '')
+
+
+def _text_condition(values, condition):
+    # AG Grid's text filter is case-insensitive and lets blanks through the negative types
+    kind = condition.get('type', 'contains')
+    if kind == 'blank':
+        return _is_blank(values)
+    if kind == 'notBlank':
+        return ~_is_blank(values)
+
+    text = values.astype(str).str.lower()
+    term = str(condition.get('filter', '')).lower()
+    if kind == 'equals':
+        match = text == term
+    elif kind == 'notEqual':
+        match = text != term
+    elif kind == 'startsWith':
+        match = text.str.startswith(term)
+    elif kind == 'endsWith':
+        match = text.str.endswith(term)
+    elif kind == 'notContains':
+        match = ~text.str.contains(term, regex=False)
+    else:
+        match = text.str.contains(term, regex=False)
+
+    if kind in ('notEqual', 'notContains'):
+        return match.fillna(True).astype(bool) | values.isna()
+    return match.fillna(False).astype(bool) & values.notna()
+
+
+def _number_condition(values, condition):
+    kind = condition.get('type', 'equals')
+    numbers = pd.to_numeric(values, errors='coerce')
+    if kind == 'blank':
+        return numbers.isna()
+    if kind == 'notBlank':
+        return numbers.notna()
+
+    value = condition.get('filter')
+    if kind == 'notEqual':
+        match = numbers != value
+    elif kind == 'lessThan':
+        match = numbers < value
+    elif kind == 'lessThanOrEqual':
+        match = numbers <= value
+    elif kind == 'greaterThan':
+        match = numbers > value
+    elif kind == 'greaterThanOrEqual':
+        match = numbers >= value
+    elif kind == 'inRange':
+        # Bounds are exclusive, as in AG Grid's default inRangeInclusive=false
+        match = (numbers > value) & (numbers < condition.get('filterTo'))
+    else:
+        match = numbers == value
+    return match & numbers.notna()
+
+
+def _column_mask(values, model):
+    filter_type = model.get('filterType', 'text')
+
+    if filter_type == 'multi':
+        mask = pd.Series(True, index=values.index)
+        for sub_model in model.get('filterModels') or []:
+            if sub_model:
+                mask &= _column_mask(values, sub_model)
+        return mask
+
+    if filter_type == 'set':
+        allowed = model.get('values') or []
+        mask = values.astype(str).isin([str(v) for v in allowed if v is not None])
+        return mask.fillna(False).astype(bool) | (values.isna() if None in allowed else False)
+
+    condition_mask = _number_condition if filter_type == 'number' else _text_condition
+    conditions = model.get('conditions')
+    if conditions is None:
+        # Older grids send condition1/condition2 instead of a conditions list
+        conditions = [model[key] for key in ('condition1', 'condition2') if key in model] or [model]
+    masks = [condition_mask(values, condition) for condition in conditions]
+    combine = np.logical_or if model.get('operator') == 'OR' else np.logical_and
+    return pd.Series(combine.reduce(masks), index=values.index)
+
+
+def apply_filter_model(df, filter_model):
+    """Rows of df passing an AG Grid filter model ({column: filter})"""
+    if not filter_model:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for column, model in filter_model.items():
+        if column in df.columns:
+            mask &= _column_mask(df[column], model)
+    return df[mask]
+
+
+def apply_sort_model(df, sort_model):
+    """df sorted by an AG Grid sort model ([{'colId': ..., 'sort': 'asc' | 'desc'}])"""
+    sort_model = [s for s in sort_model or [] if s.get('colId') in df.columns and s.get('sort')]
+    if not sort_model:
+        return df
+    # AG Grid sorts blanks below every value, in each key's own direction; stable sorts
+    # from the last key to the first leave the rows ordered by all of them
+    for s in reversed(sort_model):
+        ascending = s['sort'] == 'asc'
+        df = df.sort_values(s['colId'], ascending=ascending, na_position='first' if ascending else 'last', kind='stable')
+    return df
+
@@ -0,0 +1,145 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from instrumentation import timed_stage
+from report_writer import write_frames
+from schema import apply_schema
+
+# Export folders read by the ingestion mode: the sheets an export holds,
+# keyed by the column identifying a row (None to keep all rows), and the
+# workbook the combined sheets are written to for the pipeline steps
+INGEST_SOURCES = {
+    'AP': {
+        'folder': 'AP_Files',
+        'sheets': {'Stack': 'PO #', 'pc_overview': 'PO #'},
+        'output': os.path.join('AP_Files', 'All_Stack_Combined.xlsx')
+    },
+    'AR': {
+        'folder': 'AR_Files',
+        'sheets': {'AR & AP Real 0804': 'tsmc PO #'},
+        'output': os.path.join('AR_Files', 'PC_Overview_AR_Combined.xlsx')
+    },
+    'APN': {
+        'folder': 'APN_Files',
+        'sheets': {'From APN': None},
+        # The sheet has a title row above its Scope/Amount header
+        'read_options': {'header': 1, 'usecols': [0, 1]},
+        'output': os.path.join('APN_Files', 'From_APN_Combined.xlsx')
+    },
+}
+
+# Workbooks the pipeline writes into the export folders, never read back as exports
+PIPELINE_OUTPUTS = [
+    os.path.join('AP_Files', 'All_Stack_Filtered.xlsx'),
+    os.path.join('AP_Files', 'updated_all_stack.xlsx'),
+    os.path.join('AR_Files', 'AR_Analysis.xlsx'),
+    *(source['output'] for source in INGEST_SOURCES.values())
+]
+
+
+def discover_workbooks(folder):
+    """Every .xlsx under folder, least recently saved first
+
+    Excel lock files (~$...) and the pipeline's own outputs are left out.
+    """
+    outputs = {os.path.abspath(path) for path in PIPELINE_OUTPUTS}
+    paths = [
+        path for path in glob.glob(os.path.join(folder, '**', '*.xlsx'), recursive=True)
+        if not os.path.basename(path).startswith('~$') and os.path.abspath(path) not in outputs
+    ]
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def read_export(file_path, sheet_names, read_options=None):
+    """{sheet: frame} of one export, None unless the workbook holds all of sheet_names
+
+    Other workbooks in the folders, such as AR_updated.xlsx next to the AR
+    exports, are skipped this way.
+    """
+    with timed_stage(f"ingest {os.path.basename(file_path)}") as stage:
+        with pd.ExcelFile(file_path, engine='openpyxl') as workbook:
+            if not set(sheet_names) <= set(workbook.sheet_names):
+                return None
+            frames = {name: workbook.parse(name, **(read_options or {})) for name in sheet_names}
+        stage['rows'] = sum(len(df) for df in frames.values())
+    return frames
+
+
+def align_columns(frames):
+    """frames with header variants renamed to the first spelling seen
+
+    Exports differ in stray spaces and case ('PO # ', 'po #'); those are
+    matched, and every other column is kept as is.
+    """
+    names = {}
+    aligned = []
+    for df in frames:
+        renames = {}
+        for col in df.columns:
+            key = str(col).strip().casefold()
+            renames[col] = names.setdefault(key, col)
+        aligned.append(df.rename(columns=renames))
+    return aligned
+
+
+def combine_sheets(frames, key=None):
+    """One frame from the same sheet of several exports, oldest export first
+
+    Columns are aligned by name; values stay as exported, for the pipeline
+    steps to type. With a key column, a row that appears in several exports
+    is kept from the newest one.
+    """
+    combined = pd.concat(align_columns(frames), ignore_index=True)
+    if key is not None and key in combined.columns:
+        # PO 12345 read as a number in one export and as text in another is one PO
+        combined = apply_schema(combined, [key])
+        latest = ~combined.duplicated(subset=key, keep='last') | combined[key].isna()
+        combined = combined[latest].reset_index(drop=True)
+    return combined
+
+
+def ingest_sources(sources=None, max_workers=None):
+    """Read every export of the given sources in parallel and combine them per sheet
+
+    Each workbook is parsed in its own worker process, so a refresh of many
+    exports uses every core. Returns {source: {sheet: frame}}, with no
+    sheets for a source that has no exports.
+    """
+    sources = sources or list(INGEST_SOURCES)
+    tasks = [
+        (name, path)
+        for name in sources
+        for path in discover_workbooks(INGEST_SOURCES[name]['folder'])
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(read_export, path, list(INGEST_SOURCES[name]['sheets']), INGEST_SOURCES[name].get('read_options'))
+            for name, path in tasks
+        ]
+        # Results are collected in task order, so exports stay oldest first
+        exports = [future.result() for future in futures]
+
+    datasets = {}
+    for name in sources:
+        found = [frames for (source, _), frames in zip(tasks, exports) if source == name and frames is not None]
+        datasets[name] = {
+            sheet_name: combine_sheets([frames[sheet_name] for frames in found], key)
+            for sheet_name, key in INGEST_SOURCES[name]['sheets'].items()
+        } if found else {}
+    return datasets
+
+
+def ingest_workbooks(sources=None, max_workers=None):
+    """Write each source's combined sheets to its output workbook and return their row counts"""
+    datasets = ingest_sources(sources, max_workers)
+    rows = {}
+    for name, frames in datasets.items():
+        if not frames:
+            continue
+        with timed_stage(f"write {os.path.basename(INGEST_SOURCES[name]['output'])}"):
+            write_frames(INGEST_SOURCES[name]['output'], frames)
+        rows[name] = {sheet_name: len(df) for sheet_name, df in frames.items()}
+    return rows
@@ -0,0 +1,136 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows: stages are timed without memory figures
+    resource = None
+
+logger = logging.getLogger('arap.perf')
+
+# Stages kept in memory for the dashboard, newest last
+STAGE_HISTORY = 500
+
+_stages = deque(maxlen=STAGE_HISTORY)
+_stages_lock = threading.Lock()
+
+
+def peak_rss_mb():
+    """High-water resident memory of this process in MB, None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def count_rows(result):
+    # Rows of the first DataFrame or Series a step returns, if any
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    if isinstance(result, tuple):
+        return next((len(item) for item in result if isinstance(item, (pd.DataFrame, pd.Series))), None)
+    return None
+
+
+def begin_stage(name, rows=None):
+    """Start timing a stage; pass the returned record to end_stage"""
+    return {
+        'stage': name,
+        'rows': rows,
+        'started': time.time(),
+        '_start': time.perf_counter(),
+        '_peak_before': peak_rss_mb(),
+    }
+
+
+def end_stage(record, rows=None, records=None):
+    """Finish a stage: fill in its timings, log it as JSON and keep it for the dashboard
+
+    The memory figures are the process peak RSS after the stage and how far
+    the stage pushed it up (0 when it stayed under an earlier peak).
+    """
+    seconds = time.perf_counter() - record.pop('_start')
+    peak_before = record.pop('_peak_before')
+    peak_after = peak_rss_mb()
+    record.update(
+        rows=rows if rows is not None else record['rows'],
+        seconds=round(seconds, 6),
+        peak_rss_mb=None if peak_after is None else round(peak_after, 1),
+        rss_growth_mb=None if peak_after is None else round(peak_after - peak_before, 1),
+        pid=os.getpid(),
+    )
+    logger.info(json.dumps(record, ensure_ascii=False, default=str))
+    with _stages_lock:
+        _stages.append(record)
+    if records is not None:
+        records.append(record)
+    return record
+
+
+@contextlib.contextmanager
+def timed_stage(name, rows=None, records=None):
+    """Time the body as one stage; set record['rows'] inside the block if known only then"""
+    record = begin_stage(name, rows)
+    try:
+        yield record
+    finally:
+        end_stage(record, records=records)
+
+
+def instrumented(name=None):
+    """Decorator timing each call of a function as a stage, counting the rows it returns"""
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = begin_stage(stage_name)
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                end_stage(record, rows=count_rows(result))
+        return wrapper
+    return decorate
+
+
+def recent_stages(limit=None):
+    """The last stages recorded in this process, oldest first"""
+    with _stages_lock:
+        stages = list(_stages)
+    return stages[-limit:] if limit else stages
+
+
+def clear_stages():
+    with _stages_lock:
+        _stages.clear()
+
+
+def configure_logging(log_file=None, level=logging.INFO):
+    """Send the stage records to stderr, or append them to log_file, one JSON object per line"""
+    handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    for old in logger.handlers:
+        old.close()
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def stages_frame(records):
+    """Stage records as a table for display, slowest first"""
+    columns = ['stage', 'rows', 'seconds', 'peak_rss_mb', 'rss_growth_mb']
+    df = pd.DataFrame(list(records), columns=columns)
+    return df.sort_values('seconds', ascending=False, kind='stable').reset_index(drop=True)
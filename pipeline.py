@@ -0,0 +1,172 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+from analytics_store import fill_store
+from ingest import INGEST_SOURCES, ingest_workbooks
+from instrumentation import configure_logging
+from process_excel import (
+    filter_sheets,
+    process_data,
+    update_stack_sheet,
+    preprocess_ar,
+    update_ar_sheet,
+    cleanup_workbook,
+    config
+)
+from report_build import build_report
+from snapshots import take_snapshot
+
+
+def filter_ap_sheets(input_file_path=os.path.join('AP_Files', 'All_Stack.xlsx')):
+    output_file_path = os.path.join('AP_Files', 'All_Stack_Filtered.xlsx')
+    return filter_sheets(input_file_path, output_file_path, os.path.join('AP_Files', 'po_exclusions.txt'))
+
+
+def build_reports(ingested=False, force=False):
+    # Load and report in one worker so the frames never cross process boundaries;
+    # sheets whose inputs did not change since the last build are not rebuilt
+    apn_path, header = (INGEST_SOURCES['APN']['output'], 0) if ingested else (config['APN_FILE_PATH'], 1)
+    return build_report(apn_path, header, force=force)
+
+
+def fill_analysis_store():
+    return fill_store(config['NEW_FILE_PATH'])
+
+
+def snapshot_report():
+    return take_snapshot(config['NEW_FILE_PATH'])
+
+
+def build_pipeline(incremental=False, store=False, ingest=False, ingest_workers=None, full_rebuild=False,
+                   snapshot=False):
+    """The notebook steps as {name: step}, each listing the steps it runs after
+
+    Steps with a confirm question write back into a source workbook and
+    wait for a yes, like the input() prompts in the notebooks. With store,
+    the finished workbook is also copied into the SQLite store the dashboard
+    queries. With ingest, every export under AP_Files, AR_Files and
+    APN_Files is read in parallel first, and the AP and AR steps start from
+    the combined exports instead of All_Stack.xlsx and PC_Overview_AR.xlsx.
+    The report is only rewritten when the inputs of one of its sheets
+    changed, unless full_rebuild is set. With snapshot, the report's AP and
+    AR rows are then recorded in this month's snapshot.
+    """
+    steps = {
+        'filter_sheets': {'run': filter_ap_sheets, 'after': []},
+        'process_data': {'run': process_data, 'after': ['filter_sheets']},
+        'update_stack_sheet': {
+            'run': partial(update_stack_sheet, incremental=incremental),
+            'after': ['process_data'],
+            'confirm': "Add the new pc_overview rows to the Stack sheet of AP_Files/All_Stack.xlsx?"
+        },
+        'preprocess_ar': {'run': preprocess_ar, 'after': []},
+        'update_ar_sheet': {
+            'run': partial(update_ar_sheet, incremental=incremental),
+            'after': ['preprocess_ar'],
+            'confirm': "Add the new PO rows to the last_updated sheet of AR_Files/AR_updated.xlsx?"
+        },
+        'generate_reports': {
+            'run': partial(build_reports, force=full_rebuild),
+            'after': ['process_data', 'preprocess_ar']
+        },
+        'cleanup_workbook': {'run': cleanup_workbook, 'after': ['generate_reports']},
+    }
+    if ingest:
+        steps['ingest'] = {'run': partial(ingest_workbooks, max_workers=ingest_workers), 'after': []}
+        steps['filter_sheets'] = {
+            'run': partial(filter_ap_sheets, INGEST_SOURCES['AP']['output']),
+            'after': ['ingest']
+        }
+        steps['preprocess_ar'] = {
+            'run': partial(preprocess_ar, INGEST_SOURCES['AR']['output']),
+            'after': ['ingest']
+        }
+        steps['generate_reports']['run'] = partial(build_reports, ingested=True, force=full_rebuild)
+    if store:
+        steps['fill_store'] = {'run': fill_analysis_store, 'after': ['cleanup_workbook']}
+    if snapshot:
+        steps['snapshot'] = {'run': snapshot_report, 'after': ['cleanup_workbook']}
+    return steps
+
+
+def _timed(run):
+    start = time.perf_counter()
+    result = run()
+    return result, time.perf_counter() - start
+
+
+def run_pipeline(steps, yes=False, max_workers=2, ask=input, log_file=None):
+    """Run each step in a process pool as soon as the steps it depends on are done
+
+    Declined steps are skipped together with everything that depends on them.
+    The workers log their stage timings to stderr or log_file as JSON lines.
+    Returns {step name: result} for the steps that ran.
+    """
+    results = {}
+    skipped = set()
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=configure_logging, initargs=(log_file,)) as pool:
+        while len(results) + len(skipped) < len(steps):
+            for name, step in steps.items():
+                if name in results or name in skipped or name in running.values():
+                    continue
+                if any(dep in skipped for dep in step['after']):
+                    skipped.add(name)
+                    continue
+                if not all(dep in results for dep in step['after']):
+                    continue
+                question = step.get('confirm')
+                if question and not yes and ask(f"{question} (yes/no): ").strip().lower() != 'yes':
+                    print(f"Skipped {name}")
+                    skipped.add(name)
+                    continue
+                running[pool.submit(_timed, step['run'])] = name
+
+            if not running:
+                if len(results) + len(skipped) < len(steps):
+                    stuck = sorted(set(steps) - set(results) - skipped)
+                    raise ValueError(f"Steps with missing or circular dependencies: {stuck}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name], seconds = future.result()
+                print(f"Finished {name} in {seconds:.1f}s")
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the AP/AR workbooks and the summary report")
+    parser.add_argument('--yes', '-y', action='store_true',
+                        help="write back to the source workbooks without asking")
+    parser.add_argument('--incremental', action='store_true',
+                        help="append only new POs when updating the source workbooks")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="processes running independent steps (default: 2, one per branch)")
+    parser.add_argument('--ingest', action='store_true',
+                        help="combine every export under AP_Files, AR_Files and APN_Files first")
+    parser.add_argument('--ingest-workers', type=int,
+                        help="processes parsing the exports (default: one per CPU)")
+    parser.add_argument('--store', action='store_true',
+                        help="also load the report into a SQLite file the dashboard queries")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="record the report's AP and AR rows as this month's snapshot for the trend view")
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help="rewrite the report even if none of its inputs changed")
+    parser.add_argument('--log-file', help="append the per-stage timings here instead of printing them")
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_file)
+    start = time.perf_counter()
+    run_pipeline(build_pipeline(args.incremental, args.store, args.ingest, args.ingest_workers, args.full_rebuild, args.snapshot), yes=args.yes, max_workers=args.workers, log_file=args.log_file)
+    print(f"Pipeline finished in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
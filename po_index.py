@@ -0,0 +1,93 @@
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+
+def index_path(workbook_path):
+    # e.g. AP_Files/All_Stack.xlsx -> AP_Files/All_Stack.po_index.sqlite
+    return f"{os.path.splitext(workbook_path)[0]}.po_index.sqlite"
+
+
+def open_po_index(workbook_path):
+    conn = sqlite3.connect(index_path(workbook_path))
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS po_index (
+            sheet TEXT NOT NULL,
+            po TEXT NOT NULL,
+            row_hash INTEGER NOT NULL,
+            PRIMARY KEY (sheet, po)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS workbook_state (
+            sheet TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            columns TEXT NOT NULL
+        )
+    """)
+    return conn
+
+
+def _as_float_if_numeric(col):
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return col.astype('float64')
+    return col
+
+
+def po_hashes(df, key='PO #', columns=None):
+    """Return one content hash per PO #, combining every row of that PO"""
+    columns = list(df.columns) if columns is None else columns
+    # Excel round-trips 1.0 as 1, so hash every numeric column as float
+    values = df.reindex(columns=columns).apply(_as_float_if_numeric)
+    row_hashes = pd.util.hash_pandas_object(values, index=False)
+    # Keep 44 bits per row so summing many rows of one PO cannot overflow int64
+    row_hashes = pd.Series((row_hashes.to_numpy() >> 20).astype('int64'), index=df.index)
+    return row_hashes.groupby(df[key].astype(str)).sum()
+
+
+def is_index_current(conn, workbook_path, sheet_name):
+    # Any save outside this module (Excel, pandas) changes mtime and forces a re-index
+    row = conn.execute(
+        "SELECT mtime_ns, size FROM workbook_state WHERE sheet = ?", (sheet_name,)
+    ).fetchone()
+    stat = os.stat(workbook_path)
+    return row is not None and row == (stat.st_mtime_ns, stat.st_size)
+
+
+def indexed_columns(conn, sheet_name):
+    row = conn.execute("SELECT columns FROM workbook_state WHERE sheet = ?", (sheet_name,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def record_po_hashes(conn, workbook_path, sheet_name, hashes, columns, replace_all=False):
+    with conn:
+        if replace_all:
+            conn.execute("DELETE FROM po_index WHERE sheet = ?", (sheet_name,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO po_index (sheet, po, row_hash) VALUES (?, ?, ?)",
+            ((sheet_name, po, int(h)) for po, h in hashes.items())
+        )
+        stat = os.stat(workbook_path)
+        conn.execute(
+            "INSERT OR REPLACE INTO workbook_state (sheet, mtime_ns, size, columns) VALUES (?, ?, ?, ?)",
+            (sheet_name, stat.st_mtime_ns, stat.st_size, json.dumps([str(c) for c in columns]))
+        )
+
+
+def diff_po_hashes(conn, sheet_name, hashes):
+    """Split incoming PO hashes into new and changed PO numbers"""
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS incoming (po TEXT PRIMARY KEY, row_hash INTEGER)")
+        conn.execute("DELETE FROM incoming")
+        conn.executemany("INSERT INTO incoming VALUES (?, ?)", ((po, int(h)) for po, h in hashes.items()))
+        known = dict(conn.execute(
+            "SELECT i.po, p.row_hash FROM incoming i JOIN po_index p ON p.po = i.po AND p.sheet = ?",
+            (sheet_name,)
+        ).fetchall())
+
+    new_pos = [po for po in hashes.index if po not in known]
+    changed_pos = [po for po, h in hashes.items() if po in known and known[po] != h]
+    return new_pos, changed_pos
@@ -1,112 +1,760 @@
+import numpy as np
 import pandas as pd
 import openpyxl
 import os
 import yaml
 from openpyxl.styles import Font
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, range_boundaries
 from openpyxl.worksheet.table import Table, TableStyleInfo
 import re
 
+from report_writer import (
+    CURRENCY_FORMAT,
+    cell_rows,
+    open_workbook,
+    write_rows,
+    write_frames,
+    column_range,
+    sumifs_formula,
+    write_total
+)
+from sheet_format import HEADER_STYLE, PC_OVERVIEW_WIDTHS, format_sheet, text_width, write_table
+from instrumentation import instrumented, timed_stage
+from schema import apply_schema
+from po_index import (
+    open_po_index,
+    po_hashes,
+    is_index_current,
+    indexed_columns,
+    record_po_hashes,
+    diff_po_hashes
+)
+
 # Load config
 with open('config.yaml', 'r') as file:
     config = yaml.safe_load(file)
 
-def filter_sheets(input_file_path, output_file_path, po_numbers_to_exclude):
-    with pd.ExcelFile(input_file_path) as xls:
-        df_stack = pd.read_excel(xls, "Stack")
-        df_pc_overview = pd.read_excel(xls, "pc_overview")
+# Columns of the processed pc_overview AP sheet, in output order
+PC_OVERVIEW_COLUMNS = [
+    'TSMC 新工',
+    'PM Type',
+    'Mapped_Category',
+    'Scope',
+    'Project Number',
+    'PO #',
+    'Amount',
+    'Project Name',
+    'PO Description',
+    'Vendor/Subcontractor',
+    'Accumulated AP (Paid)',
+    'AP %',
+    'Category',
+    'Main/CO/DCR',
+    'Actual Pertain',
+    'Type',
+    'Type2'
+]
+
+# Sheets split by filter_sheets, mapped to the sheet that receives the excluded rows
+FILTERED_SHEETS = {
+    'Stack': 'Stack_Removed',
+    'pc_overview': 'pc_overview_Removed'
+}
+
+# Columns computed by load_and_process_data rather than read from the source sheet
+DERIVED_COLUMNS = ['PM Type', 'Mapped_Category']
+
+# Columns copied from pc_overview into the Stack sheet by process_data
+STACK_COLUMNS = ['Project Number', 'PO #', 'PO Description', 'Vendor/Subcontractor', 'Amount']
+
+# Columns filled from the AR & AP Real export when blank in last_updated
+AR_FILL_COLUMNS = ['Main Page', 'Project #', 'Project Name', 'Total Contract $']
+
+# Columns copied for POs that are not in last_updated yet
+AR_NEW_ENTRY_COLUMNS = ['PO #', 'Main Page', 'Project #', 'Project Name', 'Total Contract $']
+
+# pc_overview AR columns under the pc_overview AP names reconcile_ap_ar joins on
+AR_RECONCILE_COLUMNS = {'Project #': 'Project Number', 'Main Page': 'PM Type'}
+
+# AP holds vendor POs and AR the TSMC POs, so the sides meet per project and PM Type
+RECONCILE_KEYS = ['Project Number', 'PM Type']
+
+# Status of a reconciled key, in report order; rows lacking a key are never joined
+RECONCILE_STATUSES = ['Matched', 'Amount mismatch', 'AP only', 'AR only', 'Missing key']
+
+# Sheets of the report written by generate_reports, in workbook order
+REPORT_SHEETS = ['pc_overview AP', 'pc_overview AR', 'Combined PM Types', 'Detailed Combined PM Types', 'Base-Build_breakdown']
+
+# PM Types that do not count as a specific classification
+GENERIC_PM_TYPES = ['Base-Build', 'Others']
+
+# PO Description keywords checked in order by categorize_pm_type
+PM_TYPE_KEYWORDS = [
+    ('mechanical', 'Mechanical'),
+    ('electrical', 'Electrical'),
+    ('plumbing', 'Plumbing'),
+]
+
+def iter_sheet_chunks(file_path, sheet_name, columns=None, row_filter=None, dtypes=None, chunk_size=50000):
+    """Yield a sheet as DataFrame chunks without loading the whole workbook
+
+    Only the listed columns are kept, row_filter (chunk -> boolean mask) is
+    applied to each chunk as it is read, and dtypes is applied per column.
+    Completely empty rows are skipped.
+    """
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet_name].iter_rows(values_only=True)
+        header = _column_names(next(rows, ()))
+        if columns is None:
+            columns = header
+        missing = [col for col in columns if col not in header]
+        if missing:
+            raise KeyError(f"Columns {missing} not found in sheet '{sheet_name}' of {file_path}")
+        positions = [header.index(col) for col in columns]
+        
+        buffer = []
+        chunks_yielded = 0
+        for row in rows:
+            values = [row[i] if i < len(row) else None for i in positions]
+            if all(value is None for value in values):
+                continue
+            buffer.append(values)
+            if len(buffer) >= chunk_size:
+                yield _typed_chunk(buffer, columns, row_filter, dtypes)
+                chunks_yielded += 1
+                buffer = []
+        # Always yield at least one (possibly empty) chunk so callers get the columns
+        if buffer or not chunks_yielded:
+            yield _typed_chunk(buffer, columns, row_filter, dtypes)
+    finally:
+        wb.close()
+
+def _column_names(header):
+    # Name blank and repeated headers the way read_excel does ('Unnamed: 3', 'Amount.1')
+    names = []
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else name
+        base, n = name, 0
+        while name in names:
+            n += 1
+            name = f"{base}.{n}"
+        names.append(name)
+    return names
+
+def _typed_chunk(rows, columns, row_filter, dtypes):
+    chunk = pd.DataFrame(rows, columns=columns)
+    # Empty cells come back as None (or ''); read_excel reports both as NaN
+    chunk = chunk.replace('', np.nan).fillna(np.nan)
+    for col, dtype in (dtypes or {}).items():
+        if col not in chunk.columns:
+            continue
+        if pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype)):
+            # Text in an amount column becomes NaN instead of failing the whole load
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype(dtype)
+        else:
+            chunk[col] = chunk[col].astype(dtype)
+    if row_filter is not None:
+        chunk = chunk[row_filter(chunk)]
+    return chunk
+
+def read_excel_sheet(file_path, sheet_name, **read_options):
+    # pd.read_excel of a whole sheet, timed as a stage of its own
+    with timed_stage(f"read_excel {os.path.basename(file_path)}:{sheet_name}") as stage:
+        df = pd.read_excel(file_path, sheet_name=sheet_name, **read_options)
+        stage['rows'] = len(df)
+    return df
 
-    df_stack_filtered = df_stack[~df_stack["PO #"].isin(po_numbers_to_exclude)]
-    df_stack_removed = df_stack[df_stack["PO #"].isin(po_numbers_to_exclude)]
+@instrumented()
+def read_sheet_streaming(file_path, sheet_name, columns=None, row_filter=None, dtypes=None, chunk_size=50000):
+    chunks = iter_sheet_chunks(file_path, sheet_name, columns, row_filter, dtypes, chunk_size)
+    return pd.concat(chunks, ignore_index=True)
 
-    df_pc_overview_filtered = df_pc_overview[~df_pc_overview["PO #"].isin(po_numbers_to_exclude)]
-    df_pc_overview_removed = df_pc_overview[df_pc_overview["PO #"].isin(po_numbers_to_exclude)]
+def load_po_exclusions(po_numbers_to_exclude):
+    """Return PO numbers to exclude as a set, reading them from a file when given a path
 
-    with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-        df_stack_filtered.to_excel(writer, sheet_name="Stack", index=False)
-        df_pc_overview_filtered.to_excel(writer, sheet_name="pc_overview", index=False)
-        df_stack_removed.to_excel(writer, sheet_name="Stack_Removed", index=False)
-        df_pc_overview_removed.to_excel(writer, sheet_name="pc_overview_Removed", index=False)
+    The file lists one PO # per line; blank lines and lines starting with # are ignored.
+    """
+    if isinstance(po_numbers_to_exclude, (str, os.PathLike)):
+        with open(po_numbers_to_exclude, 'r', encoding='utf-8') as file:
+            lines = (line.strip() for line in file)
+            return {line for line in lines if line and not line.startswith('#')}
+    return set(po_numbers_to_exclude)
+
+@instrumented()
+def filter_sheets(input_file_path, output_file_path, po_numbers_to_exclude, output_format='xlsx'):
+    """Split Stack and pc_overview into kept and removed rows by PO #
+
+    Writes a constant-memory xlsx (output_format='xlsx') or one Parquet file
+    per sheet (output_format='parquet') and returns the removed row counts.
+    """
+    if output_format not in ('xlsx', 'parquet'):
+        raise ValueError(f"Unknown output format: {output_format}")
+    po_numbers_to_exclude = load_po_exclusions(po_numbers_to_exclude)
+    removed_counts = {}
+    
+    if output_format == 'parquet':
+        frames = {}
+        for sheet_name, removed_name in FILTERED_SHEETS.items():
+            df = read_sheet_streaming(input_file_path, sheet_name)
+            excluded = df["PO #"].isin(po_numbers_to_exclude).to_numpy()
+            frames[sheet_name], frames[removed_name] = df[~excluded], df[excluded]
+            removed_counts[sheet_name] = int(excluded.sum())
+        write_frames(output_file_path, frames, output_format)
+        return removed_counts
+    
+    # Stream each chunk straight into its kept and removed sheets
+    with open_workbook(output_file_path) as workbook:
+        sheet_names = list(FILTERED_SHEETS) + list(FILTERED_SHEETS.values())
+        worksheets = {name: workbook.add_worksheet(name) for name in sheet_names}
+        
+        for sheet_name, removed_name in FILTERED_SHEETS.items():
+            next_row = {sheet_name: 1, removed_name: 1}
+            for i, chunk in enumerate(iter_sheet_chunks(input_file_path, sheet_name)):
+                if i == 0:
+                    for name in next_row:
+                        worksheets[name].write_row(0, 0, list(chunk.columns))
+                
+                # One mask per chunk splits it into kept and removed rows
+                excluded = chunk["PO #"].isin(po_numbers_to_exclude).to_numpy()
+                next_row[sheet_name] = write_rows(worksheets[sheet_name], chunk[~excluded], next_row[sheet_name])
+                next_row[removed_name] = write_rows(worksheets[removed_name], chunk[excluded], next_row[removed_name])
+            removed_counts[sheet_name] = next_row[removed_name] - 1
+    
+    return removed_counts
 
+@instrumented()
 def process_data():
     ALL_STACK_PATH = os.path.join("AP_Files", "All_Stack_Filtered.xlsx")
     OUTPUT_PATH = os.path.join("AP_Files", "updated_all_stack.xlsx")
     
-    pc_overview = pd.read_excel(ALL_STACK_PATH, sheet_name="pc_overview")
-    stack_data = pd.read_excel(ALL_STACK_PATH, sheet_name="Stack")
+    stack_data = read_excel_sheet(ALL_STACK_PATH, "Stack")
+    pc_overview = read_sheet_streaming(
+        ALL_STACK_PATH, "pc_overview",
+        columns=STACK_COLUMNS,
+        row_filter=lambda chunk: ~chunk['PO #'].isin(stack_data['PO #'])
+    )
     
-    new_rows = pc_overview[~pc_overview['PO #'].isin(stack_data['PO #'])]
-    new_stack_rows = new_rows[['Project Number', 'PO #', 'PO Description', 'Vendor/Subcontractor', 'Amount']].copy()
+    new_stack_rows = pc_overview
     
     stack_data_updated = pd.concat([stack_data, new_stack_rows], ignore_index=True)
     
-    with pd.ExcelWriter(OUTPUT_PATH, engine='openpyxl') as writer:
-        stack_data_updated.to_excel(writer, sheet_name='pc_overview', index=False)
+    with timed_stage('write updated_all_stack.xlsx', rows=len(stack_data_updated)):
+        with pd.ExcelWriter(OUTPUT_PATH, engine='openpyxl') as writer:
+            stack_data_updated.to_excel(writer, sheet_name='pc_overview', index=False)
+
+@instrumented()
+def append_sheet_rows(workbook_path, sheet_name, rows):
+    # Add rows below the existing data instead of rewriting the sheet from a DataFrame
+    wb = openpyxl.load_workbook(workbook_path)
+    ws = wb[sheet_name]
+    header = [cell.value for cell in ws[1]]
+    
+    values = rows.reindex(columns=header).astype(object)
+    values = values.where(values.notna(), None)
+    for row in values.itertuples(index=False):
+        ws.append(list(row))
+    
+    # Grow any Excel table on the sheet so the new rows are part of it
+    for table in ws.tables.values():
+        min_col, min_row, max_col, _ = range_boundaries(table.ref)
+        table.ref = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{ws.max_row}"
+        if table.autoFilter is not None:
+            table.autoFilter.ref = table.ref
+    
+    wb.save(workbook_path)
 
-def update_stack_sheet():
+def append_new_pos(source_rows, workbook_path, sheet_name):
+    """Append rows whose PO # is not yet in the sheet, using the sidecar PO index"""
+    conn = open_po_index(workbook_path)
+    try:
+        if not is_index_current(conn, workbook_path, sheet_name):
+            # First run, or the workbook was saved elsewhere: index the full sheet once
+            sheet_data = read_excel_sheet(workbook_path, sheet_name)
+            record_po_hashes(conn, workbook_path, sheet_name, po_hashes(sheet_data),
+                             sheet_data.columns, replace_all=True)
+        
+        columns = indexed_columns(conn, sheet_name)
+        hashes = po_hashes(source_rows, columns=columns)
+        new_pos, changed_pos = diff_po_hashes(conn, sheet_name, hashes)
+        
+        new_rows = source_rows[source_rows['PO #'].astype(str).isin(new_pos)]
+        if len(new_rows) > 0:
+            append_sheet_rows(workbook_path, sheet_name, new_rows)
+            record_po_hashes(conn, workbook_path, sheet_name, hashes[new_pos], columns)
+        
+        return new_rows, changed_pos
+    finally:
+        conn.close()
+
+@instrumented()
+def update_stack_sheet(incremental=False):
     ALL_STACK_PATH = os.path.join("AP_Files", "All_Stack.xlsx")
     OUTPUT_PATH = os.path.join("AP_Files", "updated_all_stack.xlsx")
     
-    summary_data = pd.read_excel(OUTPUT_PATH, sheet_name='pc_overview')
-    stack_data = pd.read_excel(ALL_STACK_PATH, sheet_name='Stack')
+    summary_data = read_excel_sheet(OUTPUT_PATH, 'pc_overview')
+    if incremental:
+        return append_new_pos(summary_data, ALL_STACK_PATH, 'Stack')
+    
+    stack_data = read_excel_sheet(ALL_STACK_PATH, 'Stack')
     
     new_rows = summary_data[~summary_data['PO #'].isin(stack_data['PO #'])]
     
     if len(new_rows) > 0:
-        with pd.ExcelWriter(ALL_STACK_PATH, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            updated_stack = pd.concat([stack_data, new_rows], ignore_index=True)
-            updated_stack.to_excel(writer, sheet_name='Stack', index=False)
+        with timed_stage('write All_Stack.xlsx:Stack', rows=len(stack_data) + len(new_rows)):
+            with pd.ExcelWriter(ALL_STACK_PATH, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+                updated_stack = pd.concat([stack_data, new_rows], ignore_index=True)
+                updated_stack.to_excel(writer, sheet_name='Stack', index=False)
 
-def update_ar_sheet():
+@instrumented()
+def update_ar_sheet(incremental=False):
     source_file = os.path.join("AR_Files", "AR_Analysis.xlsx")
     dest_file = os.path.join("AR_Files", "AR_updated.xlsx")
     
-    updated_po_data = pd.read_excel(source_file, sheet_name='Updated PO Data')
-    ar_data = pd.read_excel(dest_file, sheet_name='last_updated')
+    updated_po_data = apply_schema(read_excel_sheet(source_file, 'Updated PO Data'))
+    if incremental:
+        return append_new_pos(updated_po_data, dest_file, 'last_updated')
     
-    updated_po_data['PO #'] = updated_po_data['PO #'].astype(str)
-    ar_data['PO #'] = ar_data['PO #'].astype(str)
+    ar_data = apply_schema(read_excel_sheet(dest_file, 'last_updated'), ['PO #'])
     
     new_rows = updated_po_data[~updated_po_data['PO #'].isin(ar_data['PO #'])]
     
     if len(new_rows) > 0:
-        with pd.ExcelWriter(dest_file, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-            updated_ar = pd.concat([ar_data, new_rows], ignore_index=True)
-            updated_ar.to_excel(writer, sheet_name='last_updated', index=False)
-
-def load_and_process_data():
-    pc_overview = pd.read_excel(config['EXISTING_FILE_PATH'], sheet_name='pc_overview')
-    updated_po_data = pd.read_excel(config['UPDATED_PO_DATA_PATH'], sheet_name="Updated PO Data")
-    return pc_overview, updated_po_data
-
-def generate_reports(pc_overview, updated_po_data):
-    # Create a new Excel workbook
-    wb = openpyxl.Workbook()
-    
-    # Process and create Combined PM Types sheet
-    combined_pm_types = process_pm_types(pc_overview, updated_po_data)
-    
-    # Write to Excel file
-    with pd.ExcelWriter(config['NEW_FILE_PATH'], engine='openpyxl') as writer:
-        # Write the main sheets
-        pc_overview.to_excel(writer, sheet_name='pc_overview AP', index=False)
-        updated_po_data.to_excel(writer, sheet_name='pc_overview AR', index=False)
-        combined_pm_types.to_excel(writer, sheet_name='Combined PM Types', index=False)
-        
-        # Create detailed analysis
-        detailed_pm_types = create_detailed_analysis(combined_pm_types)
-        detailed_pm_types.to_excel(writer, sheet_name='Detailed Combined PM Types', index=False)
-        
-        # Create base-build breakdown
-        base_build = create_base_build_breakdown(combined_pm_types)
-        base_build.to_excel(writer, sheet_name='Base-Build_breakdown', index=False)
+        with timed_stage('write AR_updated.xlsx:last_updated', rows=len(ar_data) + len(new_rows)):
+            with pd.ExcelWriter(dest_file, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
+                updated_ar = pd.concat([ar_data, new_rows], ignore_index=True)
+                updated_ar.to_excel(writer, sheet_name='last_updated', index=False)
+
+@instrumented()
+def upsert_po_data(existing, incoming, fill_columns=AR_FILL_COLUMNS, new_columns=AR_NEW_ENTRY_COLUMNS):
+    """Fill blank cells of known POs and append unseen POs in one keyed pass
+
+    Returns the updated data, the cells that were filled (PO #, Column, Value)
+    and the list of PO numbers that were added.
+    """
+    fill_columns = [col for col in fill_columns if col in incoming.columns and col in existing.columns]
+    
+    # First non-blank value per PO, as the first matching export row won in the old row loop
+    incoming_values = incoming.groupby('PO #', sort=False)[fill_columns].first()
+    
+    updated = existing.copy()
+    filled = []
+    for col in fill_columns:
+        candidates = updated['PO #'].map(incoming_values[col])
+        fill_mask = (updated[col].isna() | (updated[col] == '')) & candidates.notna()
+        column = updated[col]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Filled values may be labels the column has not seen yet
+            candidates = candidates.where(fill_mask).astype(object)
+            column = column.cat.add_categories(
+                pd.Index(candidates.dropna().unique()).difference(column.cat.categories)
+            )
+        updated[col] = column.mask(fill_mask, candidates)
+        filled.append(pd.DataFrame({
+            'PO #': updated.loc[fill_mask, 'PO #'],
+            'Column': col,
+            'Value': candidates[fill_mask]
+        }))
+    filled_cells = pd.concat(filled, ignore_index=True) if filled else pd.DataFrame(columns=['PO #', 'Column', 'Value'])
+    
+    # New POs go after the existing rows, sorted by PO #
+    new_columns = [col for col in new_columns if col in incoming.columns]
+    new_entries = incoming.loc[~incoming['PO #'].isin(existing['PO #']), new_columns].sort_values('PO #')
+    updated = pd.concat([updated, new_entries], ignore_index=True)
+    
+    return updated, filled_cells, new_entries['PO #'].drop_duplicates().tolist()
+
+@instrumented()
+def preprocess_ar(file2_path=os.path.join("AR_Files", "PC_Overview_AR.xlsx")):
+    """AR preprocessing, writing AR_Files/AR_Analysis.xlsx; the AR notebook and pipeline.py both call it
+
+    file2_path is the AR & AP export, e.g. the combined one written by ingest.
+    The notebook used to end Updated PO Data with a Total row, but only under
+    an Amount column, which that sheet does not have, so it never wrote one;
+    none is written here either, as update_ar_sheet and the report read every
+    row of the sheet as a PO.
+    """
+    file1_path = os.path.join("AR_Files", "AR_updated.xlsx")
+    new_file_path = os.path.join("AR_Files", "AR_Analysis.xlsx")
+    
+    df1 = read_excel_sheet(file1_path, "last_updated")
+    df2 = read_excel_sheet(file2_path, "AR & AP Real 0804")
+    df2 = df2.rename(columns=lambda x: x.strip() if isinstance(x, str) else x)
+    
+    df1 = apply_schema(df1)
+    df2 = apply_schema(df2)
+    df2 = df2.rename(columns={
+        'tsmc PO #': 'PO #',
+        'System': 'Main Page',
+        'PO Amount': 'Total Contract $'
+    })
+    
+    df_updated, filled_cells, new_pos = upsert_po_data(df1, df2[df2['TSMC Depart'] == '新工'])
+    
+    sheets = {
+        "PO Amount By Category": df1,
+        "AR & AP Real 0804": df2,
+        "Updated PO Data": df_updated
+    }
+    with timed_stage('write AR_Analysis.xlsx', rows=len(df_updated)):
+        with pd.ExcelWriter(new_file_path, engine='openpyxl') as writer:
+            for sheet_name, df in sheets.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+                format_sheet(writer.sheets[sheet_name], df)
+    
+    return new_pos, filled_cells
+
+def compile_type_map(type_map):
+    # Turn TYPE_MAP into integer codes so a whole column can be classified at once
+    pm_types = pd.Index(sorted(set(type_map.values()) | set(GENERIC_PM_TYPES)))
+    code_lookup = {key: pm_types.get_loc(value) for key, value in type_map.items()}
+    is_specific = ~pm_types.isin(GENERIC_PM_TYPES)
+    return pm_types, code_lookup, is_specific
+
+TYPE_MAP_CODES = compile_type_map(config['TYPE_MAP'])
+
+def _type_codes(values, code_lookup, default):
+    # Values missing from TYPE_MAP map to Others, same as TYPE_MAP.get(value, 'Others')
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Look each category up once; blanks have code -1, which picks the default at the end
+        category_codes = [code_lookup.get(category, default) for category in values.cat.categories]
+        return np.array(category_codes + [default], dtype=np.intp)[values.cat.codes.to_numpy()]
+    return values.map(code_lookup).fillna(default).to_numpy(dtype=np.intp)
+
+@instrumented()
+def classify_pm_types(df, type_map_codes=TYPE_MAP_CODES):
+    pm_types, code_lookup, is_specific = type_map_codes
+    others_code = pm_types.get_loc('Others')
+    base_build_code = pm_types.get_loc('Base-Build')
+
+    type_codes = _type_codes(df['Type'], code_lookup, others_code)
+    pertain_codes = _type_codes(df['Actual Pertain'], code_lookup, others_code)
+
+    # Same priority order as the per-row get_pm_type in the ARAP notebook
+    codes = np.select(
+        [
+            (df['Type'].isna() & df['Actual Pertain'].isna()).to_numpy(),
+            is_specific[pertain_codes],
+            is_specific[type_codes],
+            type_codes == base_build_code
+        ],
+        [others_code, pertain_codes, type_codes, base_build_code],
+        default=others_code
+    )
+    return pd.Series(pm_types.take(codes), index=df.index, name='PM Type')
+
+def map_categories(categories):
+    # Anything outside CORRECT_CATEGORY_ORDER (blank, 0, 'Others ...') becomes Others
+    known = categories.isin(config['CORRECT_CATEGORY_ORDER']).to_numpy()
+    return pd.Series(np.where(known, categories.to_numpy(dtype=object), 'Others'), index=categories.index, name=categories.name)
 
+def read_pc_overview_source(po_numbers_to_exclude=()):
+    # Stream only the columns the report uses, keeping Base-Build rows as they are read
+    pc_overview = read_sheet_streaming(
+        config['EXISTING_FILE_PATH'], 'pc_overview',
+        columns=[col for col in PC_OVERVIEW_COLUMNS if col not in DERIVED_COLUMNS],
+        row_filter=lambda chunk: (chunk['TSMC 新工'] == 'Base-Build') & ~chunk['PO #'].isin(po_numbers_to_exclude)
+    )
+    return apply_schema(pc_overview)
+
+def process_pc_overview(pc_overview, type_map_codes=TYPE_MAP_CODES):
+    """The pc_overview AP sheet from the rows read by read_pc_overview_source"""
+    pc_overview = pc_overview.copy()
+    pc_overview['PM Type'] = classify_pm_types(pc_overview, type_map_codes)
+    pc_overview['Mapped_Category'] = map_categories(pc_overview['Category'])
+    pc_overview = pc_overview[pc_overview['Amount'].notna() & (pc_overview['Amount'] != 0)]
+    return apply_schema(pc_overview[PC_OVERVIEW_COLUMNS], DERIVED_COLUMNS)
+
+def read_updated_po_data():
+    return apply_schema(read_excel_sheet(config['UPDATED_PO_DATA_PATH'], "Updated PO Data"))
+
+@instrumented()
+def load_and_process_data(po_numbers_to_exclude=()):
+    pc_overview = process_pc_overview(read_pc_overview_source(po_numbers_to_exclude))
+    return pc_overview, read_updated_po_data()
+
+@instrumented()
+def generate_reports(pc_overview, updated_po_data, totals='values', from_apn=None):
+    # totals='formulas' keeps live SUMIFS cells (with the same values cached) instead of numbers;
+    # from_apn (see read_from_apn) adds the From APN table under the detailed blocks
+    if totals not in ('values', 'formulas'):
+        raise ValueError(f"Unknown totals mode: {totals}")
+
+    # Rows are streamed to disk sheet by sheet, top to bottom
+    with open_workbook(config['NEW_FILE_PATH']) as workbook:
+        for sheet_name in REPORT_SHEETS:
+            write_report_sheet(workbook, sheet_name, pc_overview, updated_po_data, totals, from_apn)
+
+def write_report_sheet(workbook, sheet_name, pc_overview, updated_po_data, totals='values', from_apn=None):
+    """Write one of REPORT_SHEETS, so a build can rewrite only the sheets whose inputs changed"""
+    if sheet_name == 'pc_overview AP':
+        return write_table(workbook, sheet_name, pc_overview, PC_OVERVIEW_WIDTHS)
+    if sheet_name == 'pc_overview AR':
+        return write_table(workbook, sheet_name, updated_po_data, PC_OVERVIEW_WIDTHS)
+    if sheet_name == 'Combined PM Types':
+        return write_combined_sheet(workbook, pc_overview, updated_po_data, totals)
+    if sheet_name == 'Detailed Combined PM Types':
+        return write_detailed_combined_sheet(workbook, pc_overview, updated_po_data, from_apn, totals)
+    if sheet_name == 'Base-Build_breakdown':
+        return write_base_build_sheet(workbook, pc_overview, totals)
+    raise ValueError(f"Unknown report sheet: {sheet_name}")
+
+@instrumented()
+def pm_type_totals(pc_overview, updated_po_data):
+    """Amount per PM Type x category and TSMC PO Total $ per PM Type
+
+    One groupby per sheet replaces a SUMIFS over the whole sheet for every cell.
+    """
+    pm_types = pc_overview['PM Type'].unique()
+    amounts = (pc_overview.groupby(['PM Type', 'Mapped_Category'], observed=True)['Amount'].sum()
+               .unstack(fill_value=0)
+               .reindex(index=pm_types, columns=config['CORRECT_CATEGORY_ORDER'], fill_value=0))
+    return amounts, tsmc_po_totals(updated_po_data, pm_types)
+
+def tsmc_po_totals(updated_po_data, pm_types):
+    # TSMC PO Total $ per PM Type from one groupby over pc_overview AR;
+    # SUMIFS skips text, so non-numeric contract values count as nothing
+    contract = pd.to_numeric(updated_po_data['Total Contract $'], errors='coerce')
+    return contract.groupby(updated_po_data['Main Page'], observed=True).sum().reindex(pm_types, fill_value=0)
+
+def read_from_apn(file_path, header=1):
+    """Scope and Amount columns of the From APN sheet
+
+    header is the row holding Scope/Amount: 1 under the title row of the APN
+    export, 0 in the combined export written by ingest.
+    """
+    return read_excel_sheet(file_path, 'From APN', header=header).iloc[:, :2]
+
+def key_hashes(df, keys):
+    # One uint64 per row from its trimmed, upper-cased keys, so the join runs on a single column
+    normalized = pd.DataFrame({key: df[key].astype('str').str.strip().str.upper() for key in keys})
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+def missing_keys(df, keys):
+    # Rows with a blank or missing key, which would otherwise all hash to the same key on both sides
+    missing = np.zeros(len(df), dtype=bool)
+    for key in keys:
+        missing |= (df[key].isna() | df[key].astype('str').str.strip().eq('')).to_numpy()
+    return missing
+
+def _reconcile_side(df, keys, value_column, side):
+    # Total value and PO count per key; the keys are shown as first spelled, as plain text
+    values = pd.to_numeric(df[value_column], errors='coerce')
+    keyed = df[list(dict.fromkeys(keys + ['PO #']))].astype({key: 'str' for key in keys}).assign(
+        Key=key_hashes(df, keys), Value=values.to_numpy()
+    )
+    return keyed.groupby('Key', sort=False).agg(
+        **{key: (key, 'first') for key in keys},
+        **{f'{side} Amount': ('Value', 'sum'), f'{side} POs': ('PO #', 'nunique')}
+    )
+
+@instrumented()
+def reconcile_ap_ar(pc_overview, updated_po_data, keys=RECONCILE_KEYS, tolerance=0.01):
+    """AP Amount against AR Total Contract $ per key, with a Status from RECONCILE_STATUSES
+
+    Both sides are totalled per key and joined once on a hash of the
+    normalized keys. pc_overview AR's Project # and Main Page count as
+    Project Number and PM Type, with MAIN_PAGE_MAPPING applied to Main Page.
+    Keys whose totals differ by more than tolerance are an Amount mismatch.
+    Rows with a blank key are left out of the join: each side's are totalled
+    on their own under Missing key, so they never match one another.
+    """
+    keys = list(keys)
+    ar = updated_po_data.rename(columns=AR_RECONCILE_COLUMNS)
+    ar['PM Type'] = ar['PM Type'].replace(config['MAIN_PAGE_MAPPING'])
+    ap_missing, ar_missing = missing_keys(pc_overview, keys), missing_keys(ar, keys)
+    joined = _reconcile_side(pc_overview[~ap_missing], keys, 'Amount', 'AP').join(
+        _reconcile_side(ar[~ar_missing], keys, 'Total Contract $', 'AR'), how='outer', rsuffix=' (AR)'
+    )
+    for key in keys:
+        joined[key] = joined[key].fillna(joined.pop(f'{key} (AR)'))
+    unkeyed = pd.concat([
+        _reconcile_side(pc_overview[ap_missing], keys, 'Amount', 'AP'),
+        _reconcile_side(ar[ar_missing], keys, 'Total Contract $', 'AR')
+    ]).assign(Status='Missing key')
+
+    in_ap, in_ar = joined['AP POs'].notna(), joined['AR POs'].notna()
+    joined['Status'] = np.select(
+        [~in_ar, ~in_ap, (joined['AP Amount'] - joined['AR Amount']).abs() <= tolerance],
+        ['AP only', 'AR only', 'Matched'],
+        default='Amount mismatch'
+    )
+    joined = pd.concat([joined, unkeyed]) if len(unkeyed) else joined
+    joined['Difference'] = joined['AP Amount'].fillna(0) - joined['AR Amount'].fillna(0)
+    joined['Status'] = pd.Categorical(joined['Status'], categories=RECONCILE_STATUSES)
+    joined = joined.assign(Gap=joined['Difference'].abs()).sort_values(['Status', 'Gap'], ascending=[True, False])
+    return joined.drop(columns='Gap').reset_index(drop=True)
+
+def reconciliation_summary(reconciled):
+    """Keys, AP and AR totals and net difference per Status of reconcile_ap_ar's result"""
+    return reconciled.groupby('Status', observed=False).agg(
+        Keys=('Status', 'size'),
+        **{'AP Amount': ('AP Amount', 'sum'), 'AR Amount': ('AR Amount', 'sum'), 'Difference': ('Difference', 'sum')}
+    ).reset_index()
+
+@instrumented()
+def write_combined_sheet(workbook, pc_overview, updated_po_data, totals='values'):
+    # One block per PM Type: title, header, a row per category and a Total row
+    worksheet = workbook.add_worksheet('Combined PM Types')
+    bold = workbook.add_format({'bold': True})
+    header = workbook.add_format(HEADER_STYLE)
+    currency = workbook.add_format({'num_format': CURRENCY_FORMAT})
+    bold_currency = workbook.add_format({'bold': True, 'num_format': CURRENCY_FORMAT})
+    headers = ["Category", "Amount", "TSMC PO Total $"]
+
+    amounts, tsmc_po_totals = pm_type_totals(pc_overview, updated_po_data)
+
+    def ap_range(column):
+        return column_range('pc_overview AP', pc_overview.columns.get_loc(column), len(pc_overview))
+
+    def ar_range(column):
+        return column_range('pc_overview AR', updated_po_data.columns.get_loc(column), len(updated_po_data))
+
+    formulas = totals == 'formulas'
+    row = 0
+    for pm_type, category_amounts in amounts.iterrows():
+        worksheet.write(row, 0, pm_type, bold)
+        worksheet.write_row(row + 1, 0, headers, header)
+        first_row = row + 2
+
+        for row, (category, amount) in enumerate(category_amounts.items(), start=first_row):
+            worksheet.write(row, 0, category)
+            formula = sumifs_formula(ap_range('Amount'), [
+                (ap_range('PM Type'), pm_type),
+                (ap_range('Mapped_Category'), category)
+            ]) if formulas else None
+            write_total(worksheet, row, 1, amount, currency, formula)
+            worksheet.write_blank(row, 2, None, currency)
+
+        total_row = first_row + len(category_amounts)
+        worksheet.write(total_row, 0, 'Total', bold)
+        formula = f"=SUM(B{first_row + 1}:B{total_row})" if formulas else None
+        write_total(worksheet, total_row, 1, category_amounts.sum(), bold_currency, formula)
+        formula = sumifs_formula(ar_range('Total Contract $'), [
+            (ar_range('Main Page'), pm_type)
+        ]) if formulas else None
+        write_total(worksheet, total_row, 2, tsmc_po_totals[pm_type], bold_currency, formula)
+
+        row = total_row + 3
+
+    worksheet.set_column(0, 0, text_width([*amounts.index, headers[0], *amounts.columns, 'Total']))
+    worksheet.set_column(1, 2, 20)
+    return worksheet
+
+@instrumented()
+def detailed_pm_type_totals(pc_overview):
+    """Amount per PM Type x category x Scope, in the row order of the detailed sheet
+
+    One groupby replaces filtering pc_overview once per PM Type. Scopes are
+    sorted within each category; a category without rows for a PM Type gets
+    a single N/A row of 0, and one whose rows all lack a Scope gets no rows.
+    """
+    pm_types = list(pc_overview['PM Type'].unique())
+    categories = config['CORRECT_CATEGORY_ORDER']
+    amounts = pc_overview.groupby(
+        ['PM Type', 'Mapped_Category', 'Scope'], dropna=False, observed=True
+    )['Amount'].sum().reset_index()
+    amounts = amounts.astype({col: object for col in ['PM Type', 'Mapped_Category', 'Scope']})
+
+    present = pd.MultiIndex.from_frame(amounts[['PM Type', 'Mapped_Category']])
+    blocks = pd.MultiIndex.from_product([pm_types, categories], names=['PM Type', 'Mapped_Category'])
+    missing = blocks[~blocks.isin(present)].to_frame(index=False).assign(Scope='N/A', Amount=0)
+
+    rows = pd.concat([amounts.dropna(subset=['Scope']), missing], ignore_index=True)
+    rows = rows.rename(columns={'Mapped_Category': 'Category'})
+    # The stable sort keeps the Scope order of the groupby inside each block
+    order = pd.DataFrame({
+        'pm_type': pd.Categorical(rows['PM Type'], categories=pm_types).codes,
+        'category': pd.Categorical(rows['Category'], categories=categories).codes
+    })
+    order = order[(order['pm_type'] >= 0) & (order['category'] >= 0)]
+    order = order.sort_values(['pm_type', 'category'], kind='stable')
+    return rows.loc[order.index].reset_index(drop=True)
+
+@instrumented()
+def write_detailed_combined_sheet(workbook, pc_overview, updated_po_data, from_apn=None, totals='values'):
+    """One block per PM Type with its Amount by category and Scope, then the From APN table
+
+    Each block has a title, a header, the rows of detailed_pm_type_totals and
+    a Total row with the PM Type's TSMC PO Total $.
+    """
+    worksheet = workbook.add_worksheet('Detailed Combined PM Types')
+    bold = workbook.add_format({'bold': True})
+    header = workbook.add_format(HEADER_STYLE)
+    currency = workbook.add_format({'num_format': CURRENCY_FORMAT})
+    bold_currency = workbook.add_format({'bold': True, 'num_format': CURRENCY_FORMAT})
+    headers = ["Category", "Scope", "Amount", "TSMC PO Total $"]
+
+    pm_types = list(pc_overview['PM Type'].unique())
+    detailed = detailed_pm_type_totals(pc_overview)
+    contract_totals = tsmc_po_totals(updated_po_data, pm_types)
+
+    def ap_range(column):
+        return column_range('pc_overview AP', pc_overview.columns.get_loc(column), len(pc_overview))
+
+    def ar_range(column):
+        return column_range('pc_overview AR', updated_po_data.columns.get_loc(column), len(updated_po_data))
+
+    formulas = totals == 'formulas'
+    blocks = dict(tuple(detailed.groupby('PM Type', sort=False)))
+    row = 0
+    for pm_type in pm_types:
+        block = blocks.get(pm_type, detailed.iloc[:0])
+        worksheet.write(row, 0, pm_type, bold)
+        worksheet.write_row(row + 1, 0, headers, header)
+        first_row = row + 2
+
+        for row, (category, scope, amount) in enumerate(
+                block[['Category', 'Scope', 'Amount']].itertuples(index=False), start=first_row):
+            worksheet.write(row, 0, category)
+            worksheet.write(row, 1, scope)
+            formula = sumifs_formula(ap_range('Amount'), [
+                (ap_range('PM Type'), pm_type),
+                (ap_range('Mapped_Category'), category),
+                (ap_range('Scope'), scope)
+            ]) if formulas and scope != 'N/A' else None
+            write_total(worksheet, row, 2, amount, currency, formula)
+
+        total_row = first_row + len(block)
+        worksheet.write(total_row, 0, 'Total', bold)
+        worksheet.write_blank(total_row, 1, None, bold)
+        formula = f"=SUM(C{first_row + 1}:C{total_row})" if formulas else None
+        write_total(worksheet, total_row, 2, block['Amount'].sum(), bold_currency, formula)
+        formula = sumifs_formula(ar_range('Total Contract $'), [
+            (ar_range('Main Page'), pm_type)
+        ]) if formulas else None
+        write_total(worksheet, total_row, 3, contract_totals[pm_type], bold_currency, formula)
+
+        row = total_row + 2
+
+    apn_labels = []
+    if from_apn is not None:
+        row += 1
+        worksheet.write(row, 0, 'From APN', bold)
+        worksheet.write_row(row + 1, 0, ['Scope', 'Amount'], header)
+        first_row = row + 2
+        for row, (scope, amount) in enumerate(cell_rows(from_apn), start=first_row):
+            worksheet.write(row, 0, scope)
+            worksheet.write(row, 1, amount, currency)
+        total_row = first_row + len(from_apn)
+        worksheet.write(total_row, 0, 'Total', bold)
+        amounts = pd.to_numeric(from_apn.iloc[:, 1], errors='coerce')
+        formula = f"=SUM(B{first_row + 1}:B{total_row})" if formulas else None
+        write_total(worksheet, total_row, 1, amounts.sum(), bold_currency, formula)
+        apn_labels = ['From APN', *from_apn.iloc[:, 0].dropna()]
+
+    worksheet.set_column(0, 0, text_width([*pm_types, headers[0], *config['CORRECT_CATEGORY_ORDER'], 'Total', *apn_labels]))
+    worksheet.set_column(1, 1, text_width([headers[1], 'N/A', *detailed['Scope']]))
+    worksheet.set_column(2, 3, 20)
+    return worksheet
+
+@instrumented()
 def process_pm_types(pc_overview, updated_po_data):
     # Combine and process the data
     combined_data = pd.concat([pc_overview, updated_po_data], ignore_index=True)
     
     # Add necessary calculations and columns
-    combined_data['PM Type'] = combined_data['PO Description'].apply(categorize_pm_type)
+    combined_data['PM Type'] = categorize_pm_types(combined_data['PO Description'])
     combined_data['Amount'] = pd.to_numeric(combined_data['Amount'], errors='coerce')
     
     # Group by PM Type and calculate totals
@@ -125,51 +773,52 @@ def categorize_pm_type(description):
     # Define PM Type categories based on PO Description
     description = str(description).lower()
     
-    # Add your categorization logic here
-    if 'mechanical' in description:
-        return 'Mechanical'
-    elif 'electrical' in description:
-        return 'Electrical'
-    elif 'plumbing' in description:
-        return 'Plumbing'
-    # Add more categories as needed
-    else:
-        return 'Other'
+    for keyword, pm_type in PM_TYPE_KEYWORDS:
+        if keyword in description:
+            return pm_type
+    return 'Other'
 
-def create_detailed_analysis(combined_pm_types):
-    # Create more detailed analysis of the PM Types
-    detailed_analysis = combined_pm_types.copy()
-    
-    # Add additional analysis columns
-    detailed_analysis['Running Total'] = detailed_analysis['Amount'].cumsum()
-    detailed_analysis['Cumulative Percentage'] = detailed_analysis['Running Total'] / detailed_analysis['Amount'].sum() * 100
-    
-    return detailed_analysis
+def categorize_pm_types(descriptions):
+    # Column version of categorize_pm_type, first matching keyword wins
+    lowered = descriptions.astype(str).str.lower()
+    conditions = [lowered.str.contains(keyword, regex=False, na=False).to_numpy()
+                  for keyword, _ in PM_TYPE_KEYWORDS]
+    labels = [pm_type for _, pm_type in PM_TYPE_KEYWORDS]
+    return pd.Series(np.select(conditions, labels, default='Other'), index=descriptions.index)
 
-def create_base_build_breakdown(combined_pm_types):
-    # Create base vs. build analysis
-    base_build = combined_pm_types.copy()
-    
-    # Add base/build categorization
-    base_build['Category'] = base_build['PM Type'].apply(categorize_base_build)
-    
-    # Group by category
-    base_build_summary = base_build.groupby('Category').agg({
-        'Amount': 'sum',
-        'PO #': 'count'
-    }).reset_index()
-    
-    return base_build_summary
+def create_base_build_breakdown(pc_overview):
+    """Amount of the Base-Build PM Type per Scope x Type2, by Scope and then largest Amount first"""
+    base_build = pc_overview[pc_overview['PM Type'] == 'Base-Build']
+    grouped = base_build.groupby(['Scope', 'Type2'], observed=True)['Amount'].sum().reset_index()
+    grouped = grouped.astype({col: object for col in ['Scope', 'Type2']})
+    return grouped.sort_values(['Scope', 'Amount'], ascending=[True, False], kind='stable').reset_index(drop=True)
 
-def categorize_base_build(pm_type):
-    # Define which PM Types are base vs. build
-    base_types = ['Mechanical', 'Electrical', 'Plumbing']  # Add your base types
-    return 'Base' if pm_type in base_types else 'Build'
+@instrumented()
+def write_base_build_sheet(workbook, pc_overview, totals='values'):
+    # The breakdown table and, as in the ARAP notebook, a bold Total row summing every column after the first
+    breakdown = create_base_build_breakdown(pc_overview)
+    worksheet = write_table(workbook, 'Base-Build_breakdown', breakdown)
+    total_row = len(breakdown) + 1
+    bold_currency = workbook.add_format({'bold': True, 'num_format': CURRENCY_FORMAT})
+    worksheet.write(total_row, 0, 'Total', workbook.add_format({'bold': True}))
+    for col in range(1, len(breakdown.columns)):
+        letter = get_column_letter(col + 1)
+        formula = f'=SUM({letter}2:{letter}{total_row})' if totals == 'formulas' else None
+        total = pd.to_numeric(breakdown.iloc[:, col], errors='coerce').sum()
+        write_total(worksheet, total_row, col, total, bold_currency, formula)
+    return worksheet
 
+@instrumented()
 def cleanup_workbook():
-    wb = openpyxl.load_workbook(config['NEW_FILE_PATH'])
     sheets_to_keep = ['pc_overview AP', 'pc_overview AR', 'Combined PM Types', 'Detailed Combined PM Types', 'Base-Build_breakdown']
-    for sheet_name in wb.sheetnames:
-        if sheet_name not in sheets_to_keep:
-            del wb[sheet_name]
+    # Reading the sheet names alone is cheap; only load and save the workbook if there is something to delete
+    wb = openpyxl.load_workbook(config['NEW_FILE_PATH'], read_only=True)
+    extra_sheets = [sheet_name for sheet_name in wb.sheetnames if sheet_name not in sheets_to_keep]
+    wb.close()
+    if not extra_sheets:
+        return
+
+    wb = openpyxl.load_workbook(config['NEW_FILE_PATH'])
+    for sheet_name in extra_sheets:
+        del wb[sheet_name]
     wb.save(config['NEW_FILE_PATH'])
\ No newline at end of file
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+import process_excel
+import report_writer
+import schema
+import sheet_format
+from arrow_handoff import current_handoff, publish
+from data_cache import CACHE_DIR, file_fingerprint
+from instrumentation import timed_stage
+from process_excel import (
+    REPORT_SHEETS,
+    compile_type_map,
+    config,
+    process_pc_overview,
+    read_from_apn,
+    read_pc_overview_source,
+    read_updated_po_data,
+    write_report_sheet
+)
+from report_writer import assemble_workbook, open_workbook
+
+# Modules whose code decides what ends up in the report
+CODE_MODULES = [process_excel, report_writer, sheet_format, schema]
+
+# Sections of config.yaml the sheets are built from
+CONFIG_SECTIONS = ['TYPE_MAP', 'CORRECT_CATEGORY_ORDER']
+
+
+def fingerprint(*parts):
+    """Short hash of JSON-serialisable parts"""
+    text = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def code_version(modules=CODE_MODULES):
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def _file_hash(file_path):
+    return file_fingerprint(file_path)['sha256'] if file_path and os.path.exists(file_path) else None
+
+
+def input_fingerprints(apn_path=None, apn_header=1, totals='values'):
+    """Fingerprints of the cached source reads ('stages') and of every report sheet
+
+    A source read depends on its file and the code; pc_overview AP adds the
+    TYPE_MAP and CORRECT_CATEGORY_ORDER sections, and each summary sheet
+    depends on the sheets and options it is computed from.
+    """
+    code = code_version()
+    sections = {name: config[name] for name in CONFIG_SECTIONS}
+    stages = {
+        'ap_source': fingerprint('ap_source', code, _file_hash(config['EXISTING_FILE_PATH'])),
+        'ar_source': fingerprint('ar_source', code, _file_hash(config['UPDATED_PO_DATA_PATH'])),
+    }
+    ap = fingerprint('pc_overview AP', stages['ap_source'], sections)
+    ar = fingerprint('pc_overview AR', stages['ar_source'])
+    apn = fingerprint('From APN', code, _file_hash(apn_path), apn_header)
+    sheets = {
+        'pc_overview AP': ap,
+        'pc_overview AR': ar,
+        'Combined PM Types': fingerprint(ap, ar, totals),
+        'Detailed Combined PM Types': fingerprint(ap, ar, apn, totals),
+        'Base-Build_breakdown': fingerprint(ap, ar),
+    }
+    return stages, sheets
+
+
+def _build_dir(workbook_path):
+    source_dir, file_name = os.path.split(os.path.abspath(workbook_path))
+    return os.path.join(source_dir, CACHE_DIR, f"{os.path.splitext(file_name)[0]}_build")
+
+
+def _read_manifest(build_dir):
+    try:
+        with open(os.path.join(build_dir, 'manifest.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(build_dir, manifest):
+    path = os.path.join(build_dir, 'manifest.json')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _cached_stage(build_dir, name, stage_fingerprint, manifest, read):
+    # The stage's saved copy if it was written for the same fingerprint, else read it again and save it.
+    # Pickle rather than Parquet: mixed number/text columns must come back exactly as read for the report
+    path = os.path.join(build_dir, f"{name}.pkl")
+    if manifest and manifest['stages'].get(name) == stage_fingerprint and os.path.exists(path):
+        with timed_stage(f"reuse {name}"):
+            return pd.read_pickle(path)
+    df = read()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    return df
+
+
+def _sheet_path(build_dir, sheet_name):
+    # Each report sheet is kept as its own one-sheet workbook, e.g. sheets/pc_overview_AR.xlsx
+    safe_name = re.sub(r'\W+', '_', sheet_name)
+    return os.path.join(build_dir, 'sheets', f"{safe_name}.xlsx")
+
+
+def _write_sheet(path, sheet_name, *frames):
+    tmp_path = f"{path}.{os.getpid()}.tmp.xlsx"
+    with open_workbook(tmp_path) as workbook:
+        write_report_sheet(workbook, sheet_name, *frames)
+    os.replace(tmp_path, path)
+
+
+def build_report(apn_path=None, apn_header=1, totals='values', force=False):
+    """Rewrite only the sheets of config NEW_FILE_PATH whose inputs changed
+
+    Returns the names of the sheets written again, [] when the report was
+    already up to date. Every sheet is kept as its own workbook in the build
+    directory and the report is assembled from them (see assemble_workbook),
+    so e.g. a TYPE_MAP edit rewrites the pc_overview AP sheet and the
+    summaries but not pc_overview AR. The raw AP and AR reads are kept on
+    disk too, so such an edit reclassifies the cached rows instead of reading
+    the source workbooks again. The pc_overview sheets are then published as
+    Arrow files for the dashboard (see arrow_handoff), also for an up-to-date
+    report that was not published yet.
+    """
+    workbook_path = config['NEW_FILE_PATH']
+    build_dir = _build_dir(workbook_path)
+    os.makedirs(os.path.join(build_dir, 'sheets'), exist_ok=True)
+    manifest = None if force else _read_manifest(build_dir)
+    stages, sheets = input_fingerprints(apn_path, apn_header, totals)
+
+    changed = [
+        name for name, value in sheets.items()
+        if not (manifest and manifest['sheets'].get(name) == value and os.path.exists(_sheet_path(build_dir, name)))
+    ]
+    if manifest and os.path.exists(workbook_path):
+        stat = os.stat(workbook_path)
+        assembled = manifest['workbook'] == {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    else:
+        assembled = False
+    if not changed and assembled and current_handoff(workbook_path) is not None:
+        print("The report is up to date")
+        return []
+    if changed:
+        print(f"Rebuilding the report for changes to: {', '.join(changed)}")
+
+    ap_source = _cached_stage(build_dir, 'ap_source', stages['ap_source'], manifest, read_pc_overview_source)
+    pc_overview = process_pc_overview(ap_source, compile_type_map(config['TYPE_MAP']))
+    updated_po_data = _cached_stage(build_dir, 'ar_source', stages['ar_source'], manifest, read_updated_po_data)
+    if changed or not assembled:
+        from_apn = read_from_apn(apn_path, apn_header) if changed and apn_path and os.path.exists(apn_path) else None
+        for sheet_name in changed:
+            _write_sheet(_sheet_path(build_dir, sheet_name), sheet_name, pc_overview, updated_po_data, totals, from_apn)
+        with timed_stage("assemble report"):
+            assemble_workbook(workbook_path, [_sheet_path(build_dir, name) for name in REPORT_SHEETS])
+        stat = os.stat(workbook_path)
+        _write_manifest(build_dir, {
+            'stages': stages,
+            'sheets': sheets,
+            'workbook': {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        })
+
+    # Hand the frames to the dashboard as they are, rather than through the workbook
+    with timed_stage("publish arrow"):
+        publish(workbook_path, {'pc_overview AP': pc_overview, 'pc_overview AR': updated_po_data})
+    return changed
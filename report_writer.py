@@ -0,0 +1,266 @@
+import os
+import re
+import zipfile
+
+import pandas as pd
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+
+from data_cache import normalize_for_parquet
+
+# constant_memory flushes each row to disk as soon as the next row starts,
+# so rows must be written top to bottom
+WORKBOOK_OPTIONS = {
+    'constant_memory': True,
+    'nan_inf_to_errors': True,
+    'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+}
+
+
+CURRENCY_FORMAT = '_($* #,##0.00_);_($* (#,##0.00);_($* "-"??_);_(@_)'
+
+
+def open_workbook(output_path):
+    return xlsxwriter.Workbook(output_path, WORKBOOK_OPTIONS)
+
+
+# Excel's escape for control characters, e.g. _x0002_, which openpyxl reads back undecoded
+OOXML_ESCAPE = re.compile(r'_x([0-9A-Fa-f]{4})_')
+
+
+def _decode_ooxml_escapes(values):
+    # xlsxwriter would escape these again, so turn them back into characters first
+    for col in range(values.shape[1]):
+        column = values.iloc[:, col]
+        if column.astype(str).str.contains('_x', regex=False, na=False).any():
+            values.iloc[:, col] = column.map(
+                lambda v: OOXML_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), v) if isinstance(v, str) else v
+            )
+    return values
+
+
+def cell_rows(df):
+    # Plain Python values with NaN/NaT as None, which xlsxwriter leaves blank
+    values = _decode_ooxml_escapes(df.astype(object))
+    return values.where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def write_rows(worksheet, df, first_row):
+    """Write df's values starting at first_row and return the next free row"""
+    row = first_row
+    for values in cell_rows(df):
+        worksheet.write_row(row, 0, values)
+        row += 1
+    return row
+
+
+def write_frame(workbook, sheet_name, df, header_format=None):
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, list(df.columns), header_format)
+    write_rows(worksheet, df, 1)
+    return worksheet
+
+
+def column_range(sheet_name, column, n_rows):
+    # Absolute range over the data rows of a sheet written by write_frame,
+    # e.g. 'pc_overview AP'!$G$2:$G$2056 instead of the whole column $G:$G
+    letter = xl_col_to_name(column)
+    return f"'{sheet_name}'!${letter}$2:${letter}${max(n_rows, 1) + 1}"
+
+
+def _excel_string(value):
+    # Double any quotes so the value stays one Excel string literal
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _exact_criterion(value):
+    # SUMIFS reads * ? as wildcards (~ escapes them) and a leading < > = as a comparison,
+    # so match the value itself with an explicit = and its wildcards escaped
+    return _excel_string('=' + re.sub(r'([~*?])', r'~\1', str(value)))
+
+
+def sumifs_formula(sum_range, criteria):
+    """SUMIFS over sum_range for a list of (criteria range, value) pairs, each matched exactly"""
+    conditions = ''.join(f", {criteria_range}, {_exact_criterion(value)}" for criteria_range, value in criteria)
+    return f"=SUMIFS({sum_range}{conditions})"
+
+
+def write_total(worksheet, row, col, value, cell_format=None, formula=None):
+    # Formulas carry the precomputed value as their cached result, so the
+    # workbook shows correct totals before Excel recalculates
+    if formula is None:
+        worksheet.write_number(row, col, value, cell_format)
+    else:
+        worksheet.write_formula(row, col, formula, cell_format, value)
+
+
+def parquet_path(output_path, sheet_name):
+    # e.g. AP_Files/All_Stack_Filtered.xlsx + Stack -> AP_Files/All_Stack_Filtered_Stack.parquet
+    safe_name = re.sub(r'\W+', '_', sheet_name)
+    return f"{os.path.splitext(output_path)[0]}_{safe_name}.parquet"
+
+
+def write_frames(output_path, frames, output_format='xlsx'):
+    """Write {sheet name: DataFrame} as one xlsx workbook or one Parquet file per sheet"""
+    if output_format == 'parquet':
+        for sheet_name, df in frames.items():
+            normalize_for_parquet(df).to_parquet(parquet_path(output_path, sheet_name), index=False)
+    elif output_format == 'xlsx':
+        with open_workbook(output_path) as workbook:
+            for sheet_name, df in frames.items():
+                write_frame(workbook, sheet_name, df)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+
+# Parts of styles.xml that are lists of styles, in the order xlsxwriter writes them
+STYLE_LISTS = {'fonts': 'font', 'fills': 'fill', 'borders': 'border', 'cellXfs': 'xf', 'dxfs': 'dxf'}
+
+# The first custom number format id; lower ids are Excel's built-in formats
+FIRST_CUSTOM_NUM_FMT = 164
+
+
+def _style_list(styles, name):
+    block = re.search(rf'<{name}\b[^>]*?(?:/>|>(.*?)</{name}>)', styles)
+    item = STYLE_LISTS[name]
+    return re.findall(rf'<{item}\b[^>]*?(?:/>|>.*?</{item}>)', block.group(1) or '') if block else []
+
+
+def _remap_attributes(xml, attributes, mapping, tag=None):
+    # Replace the values of the given attributes, e.g. s="3", through mapping; tag limits it to one element
+    element = rf'<{tag}\b[^>]*?\s' if tag else r'\s'
+    pattern = re.compile(rf'({element}(?:{"|".join(attributes)})=")(\d+)(")')
+    return pattern.sub(lambda m: f"{m.group(1)}{mapping[m.group(2)]}{m.group(3)}", xml)
+
+
+class _StyleMerger:
+    """The styles of several xlsxwriter workbooks as one styles.xml, without duplicates"""
+
+    def __init__(self):
+        self.num_fmts = {}
+        self.lists = {name: {} for name in STYLE_LISTS}
+
+    def _add(self, name, item):
+        return str(self.lists[name].setdefault(item, len(self.lists[name])))
+
+    def add_part(self, styles):
+        """Add one workbook's styles.xml and return its xf and dxf index mappings"""
+        num_fmts = {}
+        for fmt_id, code in re.findall(r'<numFmt numFmtId="(\d+)" formatCode="([^"]*)"/>', styles):
+            num_fmts[fmt_id] = str(self.num_fmts.setdefault(code, FIRST_CUSTOM_NUM_FMT + len(self.num_fmts)))
+        num_fmt = lambda fmt_id: num_fmts.get(fmt_id, fmt_id)
+
+        mappings = {}
+        for name in ['fonts', 'fills', 'borders']:
+            mappings[name] = {str(i): self._add(name, item) for i, item in enumerate(_style_list(styles, name))}
+        mappings['numFmts'] = {fmt_id: num_fmt(fmt_id) for fmt_id in re.findall(r'numFmtId="(\d+)"', styles)}
+
+        xfs = {}
+        for i, xf in enumerate(_style_list(styles, 'cellXfs')):
+            xf = _remap_attributes(xf, ['numFmtId'], mappings['numFmts'])
+            for attribute, name in [('fontId', 'fonts'), ('fillId', 'fills'), ('borderId', 'borders')]:
+                xf = _remap_attributes(xf, [attribute], mappings[name])
+            xfs[str(i)] = self._add('cellXfs', xf)
+        dxfs = {
+            str(i): self._add('dxfs', _remap_attributes(dxf, ['numFmtId'], mappings['numFmts']))
+            for i, dxf in enumerate(_style_list(styles, 'dxfs'))
+        }
+        return xfs, dxfs
+
+    def styles_xml(self, template):
+        """template (the first part's styles.xml) with the merged lists in place of its own"""
+        num_fmts = ''.join(
+            f'<numFmt numFmtId="{fmt_id}" formatCode="{code}"/>' for code, fmt_id in self.num_fmts.items()
+        )
+        styles = re.sub(r'<numFmts\b.*?</numFmts>', '', template)
+        if num_fmts:
+            styles = styles.replace('<fonts', f'<numFmts count="{len(self.num_fmts)}">{num_fmts}</numFmts><fonts', 1)
+        for name, items in self.lists.items():
+            block = f'<{name} count="{len(items)}">{"".join(items)}</{name}>' if items else f'<{name} count="0"/>'
+            styles = re.sub(rf'<{name}\b[^>]*?(?:/>|>.*?</{name}>)', lambda m: block, styles, count=1)
+        return styles
+
+
+def _sheet_entry(workbook_xml):
+    # The escaped name attribute of a one-sheet workbook and its defined names (e.g. autofilters)
+    names = re.findall(r'<sheet name="([^"]*)"', workbook_xml)
+    if len(names) != 1:
+        raise ValueError(f"Expected a workbook with one sheet, found {len(names)}")
+    return names[0], re.findall(r'<definedName\b.*?</definedName>', workbook_xml)
+
+
+def assemble_workbook(output_path, part_paths):
+    """Join one-sheet xlsxwriter workbooks into output_path, sheets in the order of part_paths
+
+    Lets a report keep every sheet written as its own file and rewrite only
+    the sheets whose inputs changed. Cell styles are merged and renumbered;
+    parts with their own relationships (tables, images, comments) are not
+    supported.
+    """
+    styles = _StyleMerger()
+    sheets = []
+    with zipfile.ZipFile(part_paths[0]) as first:
+        template = {name: first.read(name).decode('utf-8') for name in [
+            '[Content_Types].xml', 'docProps/app.xml', 'docProps/core.xml', 'xl/workbook.xml',
+            'xl/_rels/workbook.xml.rels', 'xl/styles.xml', 'xl/theme/theme1.xml', '_rels/.rels'
+        ]}
+    for index, part_path in enumerate(part_paths):
+        with zipfile.ZipFile(part_path) as part:
+            if any(name.startswith('xl/worksheets/_rels/') for name in part.namelist()):
+                raise ValueError(f"{part_path} has sheet relationships, which cannot be assembled")
+            name, defined_names = _sheet_entry(part.read('xl/workbook.xml').decode('utf-8'))
+            xfs, dxfs = styles.add_part(part.read('xl/styles.xml').decode('utf-8'))
+            sheet = part.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        sheet = _remap_attributes(sheet, ['s'], xfs, 'c')
+        sheet = _remap_attributes(sheet, ['s'], xfs, 'row')
+        sheet = _remap_attributes(sheet, ['style'], xfs, 'col')
+        sheet = _remap_attributes(sheet, ['dxfId'], dxfs, 'cfRule')
+        if index > 0:
+            # Only the first sheet is open when the workbook is
+            sheet = sheet.replace(' tabSelected="1"', '', 1)
+        defined_names = [re.sub(r'localSheetId="\d+"', f'localSheetId="{index}"', entry) for entry in defined_names]
+        sheets.append((name, defined_names, sheet))
+
+    n_sheets = len(sheets)
+    workbook = re.sub(r'<sheets>.*?</sheets>', lambda m: '<sheets>' + ''.join(
+        f'<sheet name="{name}" sheetId="{i}" r:id="rId{i}"/>' for i, (name, _, _) in enumerate(sheets, start=1)
+    ) + '</sheets>', template['xl/workbook.xml'])
+    workbook = re.sub(r'<definedNames>.*?</definedNames>', '', workbook)
+    defined_names = [entry for _, entries, _ in sheets for entry in entries]
+    if defined_names:
+        workbook = workbook.replace('</sheets>', f'</sheets><definedNames>{"".join(defined_names)}</definedNames>', 1)
+
+    relationships = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    workbook_rels = re.sub(r'<Relationship .*/>', lambda m: ''.join(
+        [f'<Relationship Id="rId{i}" Type="{relationships}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+         for i in range(1, n_sheets + 1)]
+        + [f'<Relationship Id="rId{n_sheets + 1}" Type="{relationships}/theme" Target="theme/theme1.xml"/>',
+           f'<Relationship Id="rId{n_sheets + 2}" Type="{relationships}/styles" Target="styles.xml"/>']
+    ), template['xl/_rels/workbook.xml.rels'])
+
+    sheet_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+    content_types = template['[Content_Types].xml'].replace(
+        '<Override PartName="/xl/worksheets/sheet1.xml" ' f'ContentType="{sheet_type}"/>',
+        ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{sheet_type}"/>'
+                for i in range(1, n_sheets + 1)), 1)
+
+    app = re.sub(r'<vt:i4>\d+</vt:i4>', f'<vt:i4>{n_sheets}</vt:i4>', template['docProps/app.xml'], count=1)
+    app = re.sub(r'<TitlesOfParts>.*?</TitlesOfParts>', lambda m: (
+        f'<TitlesOfParts><vt:vector size="{n_sheets}" baseType="lpstr">'
+        + ''.join(f'<vt:lpstr>{name}</vt:lpstr>' for name, _, _ in sheets)
+        + '</vt:vector></TitlesOfParts>'
+    ), app)
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as out:
+        out.writestr('[Content_Types].xml', content_types)
+        out.writestr('_rels/.rels', template['_rels/.rels'])
+        out.writestr('docProps/app.xml', app)
+        out.writestr('docProps/core.xml', template['docProps/core.xml'])
+        out.writestr('xl/workbook.xml', workbook)
+        out.writestr('xl/_rels/workbook.xml.rels', workbook_rels)
+        out.writestr('xl/styles.xml', styles.styles_xml(template['xl/styles.xml']))
+        out.writestr('xl/theme/theme1.xml', template['xl/theme/theme1.xml'])
+        for i, (_, _, sheet) in enumerate(sheets, start=1):
+            out.writestr(f'xl/worksheets/sheet{i}.xml', sheet)
+    os.replace(tmp_path, output_path)
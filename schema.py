@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# Arrow-backed strings with NaN for blanks, the default str dtype from pandas 3 on
+PO_NUMBER_DTYPE = pd.StringDtype('pyarrow', na_value=np.nan)
+
+# Low-cardinality text: a few dozen labels repeated over every row
+CATEGORY_COLUMNS = [
+    'TSMC 新工',
+    'PM Type',
+    'Mapped_Category',
+    'Scope',
+    'Category',
+    'Main/CO/DCR',
+    'Actual Pertain',
+    'Type',
+    'Type2',
+    'Type 2',
+    'Project Number',
+    'Project #',
+    'Project Name',
+    'Vendor/Subcontractor',
+    'Main Page',
+    'CO/Added',
+    'System',
+    'TSMC Depart',
+    'Amy PO ',
+]
+
+PO_NUMBER_COLUMNS = ['PO #', 'tsmc PO #']
+
+AMOUNT_COLUMNS = [
+    'Amount',
+    'Accumulated AP (Paid)',
+    'AP %',
+    'Total Contract $',
+    'PO Amount',
+]
+
+# dtype of every known column of the AP/AR sheets; other columns are left as read
+COLUMN_DTYPES = {
+    **{col: 'category' for col in CATEGORY_COLUMNS},
+    **{col: PO_NUMBER_DTYPE for col in PO_NUMBER_COLUMNS},
+    **{col: 'float64' for col in AMOUNT_COLUMNS},
+}
+
+
+def as_text(values):
+    # Excel gives numbers for some labels and PO numbers (0, 12345); keep them as text, blanks as NaN
+    return values.where(values.isna(), values.astype(str))
+
+
+def _has_dtype(values, dtype):
+    if dtype == 'category':
+        return isinstance(values.dtype, pd.CategoricalDtype)
+    return values.dtype == dtype
+
+
+def apply_schema(df, columns=None):
+    """df with its known columns (or just columns) converted to the dtypes in COLUMN_DTYPES
+
+    Text in amount columns becomes NaN. Columns already of the right dtype are
+    left alone, so applying the schema twice costs nothing.
+    """
+    columns = [col for col in (columns or df.columns) if col in COLUMN_DTYPES and col in df.columns]
+    converted = {}
+    for col in columns:
+        dtype = COLUMN_DTYPES[col]
+        if _has_dtype(df[col], dtype):
+            continue
+        if dtype == 'float64':
+            converted[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        else:
+            converted[col] = as_text(df[col]).astype(dtype)
+    return df.assign(**converted) if converted else df
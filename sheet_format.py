@@ -0,0 +1,96 @@
+import re
+
+import pandas as pd
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.table import Table, TableStyleInfo
+
+from instrumentation import timed_stage
+from report_writer import write_frame
+
+TABLE_STYLE = 'TableStyleMedium9'
+
+# Header and stripe colours of TableStyleMedium9, for constant_memory sheets
+# where xlsxwriter cannot add a real table
+HEADER_STYLE = {'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#4F81BD'}
+STRIPE_STYLE = {'bg_color': '#DCE6F1'}
+
+# Fixed widths for the long text columns of the pc_overview sheets
+PC_OVERVIEW_WIDTHS = {
+    'TSMC 新工': 20,
+    'PM Type': 20,
+    'Mapped_Category': 20,
+    'Scope': 20,
+    'Project Number': 20,
+    'PO #': 20,
+    'Amount': 20,
+    'Project Name': 55,
+    'PO Description': 90
+}
+
+
+def fit_width(length):
+    return (length + 2) * 1.2
+
+
+def text_width(values):
+    """Width that fits the longest of values once written as text"""
+    lengths = pd.Series(values, dtype=object).dropna().astype(str).str.len()
+    return fit_width(lengths.max() if len(lengths) else 0)
+
+
+def column_widths(df, overrides=None, sample_size=None):
+    """One width per column of df from its header and longest value
+
+    overrides maps column names to fixed widths. With sample_size, only that
+    many rows are measured, which is enough for columns of similar values.
+    """
+    overrides = overrides or {}
+    if sample_size is not None and len(df) > sample_size:
+        df = df.sample(sample_size, random_state=0)
+    return [
+        overrides[col] if col in overrides else max(text_width([col]), text_width(df[col]))
+        for col in df.columns
+    ]
+
+
+def table_name(title):
+    return 'Table_' + re.sub(r'\W+', '_', title)
+
+
+def format_as_table(worksheet, data_range, name=None, style=TABLE_STYLE):
+    # openpyxl worksheets only
+    table = Table(displayName=name or table_name(worksheet.title), ref=data_range)
+    table.tableStyleInfo = TableStyleInfo(name=style, showFirstColumn=False,
+                                          showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+    worksheet.add_table(table)
+
+
+def set_column_widths(worksheet, widths):
+    # openpyxl worksheets only
+    for col, width in enumerate(widths, start=1):
+        worksheet.column_dimensions[get_column_letter(col)].width = width
+
+
+def format_sheet(worksheet, df, overrides=None, sample_size=None):
+    """Size the columns of an openpyxl sheet holding df from A1 and style it as one table"""
+    set_column_widths(worksheet, column_widths(df, overrides, sample_size))
+    format_as_table(worksheet, f"A1:{get_column_letter(len(df.columns))}{len(df) + 1}")
+
+
+def write_table(workbook, sheet_name, df, overrides=None, sample_size=None):
+    """Stream df into an xlsxwriter sheet sized and styled like format_sheet"""
+    with timed_stage(f"write {sheet_name}", rows=len(df)):
+        worksheet = write_frame(workbook, sheet_name, df, workbook.add_format(HEADER_STYLE))
+    for col, width in enumerate(column_widths(df, overrides, sample_size)):
+        worksheet.set_column(col, col, width)
+
+    last_row, last_col = len(df), len(df.columns) - 1
+    worksheet.autofilter(0, 0, last_row, last_col)
+    worksheet.freeze_panes(1, 0)
+    if last_row > 0:
+        worksheet.conditional_format(1, 0, last_row, last_col, {
+            'type': 'formula',
+            'criteria': '=MOD(ROW(),2)=0',
+            'format': workbook.add_format(STRIPE_STYLE)
+        })
+    return worksheet
@@ -0,0 +1,182 @@
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from data_cache import load_sheet, source_version
+
+SNAPSHOT_DIR = 'snapshots'
+
+# Report sheets kept in the snapshots, with the column their trends are grouped by and summed over,
+# and the columns telling apart the rows of one PO
+SNAPSHOT_DATASETS = {
+    'AP': {'sheet': 'pc_overview AP', 'group': 'PM Type', 'value': 'Amount', 'row': ['Main/CO/DCR']},
+    'AR': {'sheet': 'pc_overview AR', 'group': 'Main Page', 'value': 'Total Contract $', 'row': ['CO/Added', 'Total Contract $']},
+}
+
+# A PO can have several rows (AR has one per CO), so rows are keyed by PO # and a Row label built from
+# their row columns rather than their position, which changes when a CO row is inserted or rows are reordered
+KEY_COLUMNS = ['PO #', 'Row']
+
+# What a delta row does: added and removed rows, and a changed row as its old and new values
+DELTA_COLUMN = 'Delta'
+DELTA_SIGNS = {'added': 1, 'new': 1, 'removed': -1, 'old': -1}
+
+
+def _read_manifest(root):
+    try:
+        with open(os.path.join(root, 'manifest.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'snapshots': []}
+
+
+def _write_manifest(root, manifest):
+    path = os.path.join(root, 'manifest.json')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _write_parquet(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _delta_path(root, dataset, label):
+    return os.path.join(root, dataset, f"{label}.parquet")
+
+
+def keyed_rows(df, row_columns=()):
+    """df as snapshots store it: text columns as str, indexed by KEY_COLUMNS
+
+    Row is the values of row_columns, numbered only among rows of a PO that
+    share them. A row whose row columns change (an AR CO amount) is stored
+    as removed and added rather than changed.
+    """
+    # Columns mixing numbers and text (Main/CO/DCR) compare and store as text
+    df = df.astype({col: 'str' for col in df.columns if not is_numeric_dtype(df[col])})
+    label = pd.Series('', index=df.index, dtype='str')
+    for col in row_columns:
+        label = label + df[col].astype('str').fillna('') + '|'
+    occurrence = df.groupby([df['PO #'], label], dropna=False).cumcount().astype('str')
+    return df.assign(Row=label + occurrence).set_index(KEY_COLUMNS)
+
+
+def diff_rows(old, new):
+    """Delta turning the keyed rows old into new"""
+    columns = list(dict.fromkeys([*new.columns, *old.columns]))
+    old, new = old.reindex(columns=columns), new.reindex(columns=columns)
+    common = new.index.intersection(old.index)
+    before, after = old.loc[common], new.loc[common]
+    changed = ~((before == after) | (before.isna() & after.isna())).all(axis=1)
+    return pd.concat([
+        new.loc[new.index.difference(old.index)].assign(**{DELTA_COLUMN: 'added'}),
+        old.loc[old.index.difference(new.index)].assign(**{DELTA_COLUMN: 'removed'}),
+        before[changed].assign(**{DELTA_COLUMN: 'old'}),
+        after[changed].assign(**{DELTA_COLUMN: 'new'}),
+    ]).reset_index()
+
+
+def apply_delta(rows, delta):
+    """The keyed rows a delta from diff_rows turns rows into"""
+    delta = delta.set_index(KEY_COLUMNS)
+    kept = rows.drop(delta.index[delta[DELTA_COLUMN].isin(['removed', 'old'])])
+    incoming = delta[delta[DELTA_COLUMN].isin(['added', 'new'])].drop(columns=DELTA_COLUMN)
+    return pd.concat([kept, incoming]).sort_index()
+
+
+def snapshot_labels(root=SNAPSHOT_DIR):
+    return [snapshot['label'] for snapshot in _read_manifest(root)['snapshots']]
+
+
+def manifest_version(root=SNAPSHOT_DIR):
+    """Label, time and source of every snapshot taken; changes whenever a snapshot is taken or retaken"""
+    return tuple(
+        (snapshot['label'], snapshot['taken_at'], snapshot['source_version'])
+        for snapshot in _read_manifest(root)['snapshots']
+    )
+
+
+def _replay(dataset, label, root):
+    # Keyed rows of dataset as of label, applying every delta up to it
+    labels = snapshot_labels(root)
+    if label not in labels:
+        raise ValueError(f"No snapshot {label} in {root}")
+    rows = None
+    for past_label in labels[:labels.index(label) + 1]:
+        delta = pd.read_parquet(_delta_path(root, dataset, past_label))
+        if rows is None:
+            rows = delta.iloc[:0].drop(columns=DELTA_COLUMN).set_index(KEY_COLUMNS)
+        rows = apply_delta(rows, delta)
+    return rows
+
+
+def load_snapshot(dataset, label, root=SNAPSHOT_DIR):
+    """The rows of dataset as of snapshot label, sorted by PO #"""
+    return _replay(dataset, label, root).reset_index()
+
+
+def take_snapshot(workbook_path, label=None, root=SNAPSHOT_DIR):
+    """Store the report's AP and AR rows as the changes since the previous snapshot
+
+    label defaults to the current month; taking the latest snapshot again
+    replaces it. Returns the added/removed/changed counts per dataset.
+    """
+    label = label or datetime.now().strftime('%Y-%m')
+    manifest = _read_manifest(root)
+    previous = manifest['snapshots']
+    if previous and label < previous[-1]['label']:
+        raise ValueError(f"Snapshot {label} is older than the latest one, {previous[-1]['label']}")
+    if previous and label == previous[-1]['label']:
+        previous = previous[:-1]
+
+    entry = {
+        'label': label,
+        'taken_at': datetime.now().isoformat(timespec='seconds'),
+        'source_version': source_version(workbook_path),
+        'datasets': {}
+    }
+    for dataset, spec in SNAPSHOT_DATASETS.items():
+        new = keyed_rows(load_sheet(workbook_path, spec['sheet']), spec['row'])
+        old = _replay(dataset, previous[-1]['label'], root) if previous else new.iloc[:0]
+        delta = diff_rows(old, new)
+        _write_parquet(delta, _delta_path(root, dataset, label))
+        counts = delta[DELTA_COLUMN].value_counts()
+        entry['datasets'][dataset] = {
+            'rows': len(new),
+            'added': int(counts.get('added', 0)),
+            'removed': int(counts.get('removed', 0)),
+            'changed': int(counts.get('new', 0))
+        }
+
+    manifest['snapshots'] = previous + [entry]
+    _write_manifest(root, manifest)
+    return entry['datasets']
+
+
+def period_changes(dataset, root=SNAPSHOT_DIR, blank_label='Unspecified'):
+    """Change and running total of the dataset's value per group for every snapshot
+
+    Only the group, value and Delta columns of each delta are read: a
+    snapshot's change is what its added and new rows bring minus what its
+    removed and old rows took away, and the totals are the changes summed up.
+    """
+    spec = SNAPSHOT_DATASETS[dataset]
+    group, value = spec['group'], spec['value']
+    changes = {}
+    for label in snapshot_labels(root):
+        delta = pd.read_parquet(_delta_path(root, dataset, label), columns=[group, value, DELTA_COLUMN])
+        signed = pd.to_numeric(delta[value], errors='coerce').fillna(0) * delta[DELTA_COLUMN].map(DELTA_SIGNS)
+        changes[label] = signed.groupby(delta[group].fillna(blank_label)).sum()
+    if not changes:
+        return pd.DataFrame(columns=['Snapshot', group, 'Change', 'Total'])
+
+    wide = pd.DataFrame(changes).T.fillna(0)
+    wide.index.name, wide.columns.name = 'Snapshot', group
+    return pd.concat({'Change': wide.stack(), 'Total': wide.cumsum().stack()}, axis=1).reset_index()
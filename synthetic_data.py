@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from report_writer import write_frames
+
+with open('config.yaml', 'r') as file:
+    config = yaml.safe_load(file)
+
+TSMC_NEW_WORK = ['Base-Build', 'Hookup', 'Non-TSMC', 'Others', 'Interconnection']
+MAIN_CO_DCR = [
+    'Main Contract Scope',
+    'CO Scope (adding/additional scope)',
+    'DCR Scope',
+    'The budget execution does not pertain to this project'
+]
+CATEGORIES = config['CORRECT_CATEGORY_ORDER'][:-1] + ['Others (commissioning, QAQC, Safety, Outsourcing, etc)']
+SCOPES = ['M+L', 'Labor', 'Material', 'Equipment', 'Site Expense', 'Outsourcing', 'Consultant']
+DESCRIPTION_WORDS = [
+    'Mechanical', 'Electrical', 'Plumbing', 'Installation', 'works', 'package', 'Material',
+    'Engineering Support', 'Commissioning', 'Piping', 'Tank', 'Labor', 'Equipment', 'Rental'
+]
+AR_TYPES = ['Scope', 'GC', 'Material', 'Labor']
+CO_ADDED = ['Main', 'CO', 'Added']
+
+
+def _choice(rng, values, n, blank_share=0.0, p=None):
+    picked = pd.Series(rng.choice(np.asarray(values, dtype=object), size=n, p=p), dtype=object)
+    return picked.mask(rng.random(n) < blank_share)
+
+
+def _projects(rng, n, count=110):
+    numbers = np.array([f"USC2{1 + i % 5}C{i:03d}" for i in range(count)], dtype=object)
+    names = np.array([f"F21P{1 + i % 3} Project {i:03d}" for i in range(count)], dtype=object)
+    picked = rng.integers(0, count, size=n)
+    return numbers[picked], names[picked]
+
+
+def make_pc_overview(n_rows, seed=0, po_prefix='USCSB'):
+    """pc_overview/Stack rows with the real source columns and value mixes"""
+    rng = np.random.default_rng(seed)
+    type_keys = list(config['TYPE_MAP'])
+    project_numbers, project_names = _projects(rng, n_rows)
+    words = np.array(DESCRIPTION_WORDS, dtype=object)
+    descriptions = [' '.join(parts) for parts in words[rng.integers(0, len(words), size=(n_rows, 3))]]
+    amounts = np.round(rng.lognormal(mean=10, sigma=2, size=n_rows), 2)
+    amounts[rng.random(n_rows) < 0.02] = 0
+    paid = np.round(amounts * rng.random(n_rows), 2)
+
+    return pd.DataFrame({
+        'TSMC 新工': _choice(rng, TSMC_NEW_WORK, n_rows, 0.03, p=[0.7, 0.1, 0.1, 0.05, 0.05]),
+        'Type': _choice(rng, type_keys, n_rows, 0.03),
+        'Type2': _choice(rng, [f"Vendor Group {i}" for i in range(25)], n_rows, 0.2),
+        'Main/CO/DCR': _choice(rng, MAIN_CO_DCR, n_rows, 0.6),
+        'Actual Pertain': _choice(rng, type_keys, n_rows, 0.6),
+        'Category': _choice(rng, CATEGORIES, n_rows, 0.55),
+        'Scope': _choice(rng, SCOPES, n_rows, 0.55),
+        'Project Number': project_numbers,
+        'PO #': [f"{po_prefix}{i:08d}A" for i in range(n_rows)],
+        'Amount': amounts,
+        'Project Name': project_names,
+        'Item': np.arange(1, n_rows + 1),
+        'Rev': _choice(rng, ['-01', '-02', '-03'], n_rows, 0.9),
+        'PO Description': descriptions,
+        'PO Date': pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 1200, size=n_rows), unit='D'),
+        'Vendor/Subcontractor': _choice(rng, [f"Vendor {i}, Inc." for i in range(440)], n_rows, 0.05),
+        'Remark M2': _choice(rng, ['Price Discount', 'Scope reduction', 'Contract terminated'], n_rows, 0.8),
+        'Accumulated AP (Paid)': paid,
+        'AP %': np.divide(paid, amounts, out=np.zeros(n_rows), where=amounts != 0),
+    })
+
+
+def make_ar_data(n_rows, seed=0):
+    """last_updated / Updated PO Data rows"""
+    rng = np.random.default_rng(seed + 1)
+    project_numbers, project_names = _projects(rng, n_rows)
+    main_pages = sorted(set(config['TYPE_MAP'].values()) | set(config['MAIN_PAGE_MAPPING']))
+    return pd.DataFrame({
+        'Type': _choice(rng, AR_TYPES, n_rows),
+        'Project #': project_numbers,
+        'Project Name': project_names,
+        'PO #': [f"TSMC{i:08d}" for i in range(n_rows)],
+        'Total Contract $': np.round(rng.lognormal(mean=12, sigma=1.5, size=n_rows), 2),
+        'Main Page': _choice(rng, main_pages, n_rows, 0.05),
+        'CO/Added': _choice(rng, CO_ADDED, n_rows, 0.2, p=[0.6, 0.3, 0.1]),
+        'Amy PO ': _choice(rng, ['Y', 'N'], n_rows, 0.5),
+    })
+
+
+def make_ar_export(last_updated, new_share=0.05, seed=0):
+    """'AR & AP Real 0804' export covering the known POs plus some new ones"""
+    rng = np.random.default_rng(seed + 2)
+    n_new = max(1, int(len(last_updated) * new_share))
+    new_rows = make_ar_data(n_new, seed + 3)
+    new_rows['PO #'] = [f"TSMCN{i:07d}" for i in range(n_new)]
+    rows = pd.concat([last_updated, new_rows], ignore_index=True)
+    n_rows = len(rows)
+    return pd.DataFrame({
+        'Type': rows['Type'],
+        'TSMC Depart': _choice(rng, ['新工', '廠務', '設備'], n_rows, p=[0.8, 0.1, 0.1]),
+        'Type 2': _choice(rng, ['Scope', 'GC'], n_rows),
+        'System': rows['Main Page'],
+        'tsmc PO #': rows['PO #'],
+        'Project #': rows['Project #'],
+        'Project Name': rows['Project Name'],
+        'PO Amount': rows['Total Contract $'],
+        'Tax': np.round(rows['Total Contract $'] * 0.08, 2),
+    })
+
+
+def write_workspace(root, n_rows, seed=0):
+    """Write the AP_Files/AR_Files workbooks the pipeline reads, n_rows per sheet, under root"""
+    os.makedirs(os.path.join(root, 'AP_Files'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'AR_Files'), exist_ok=True)
+
+    # pc_overview holds every PO; Stack is missing the newest 2%
+    pc_overview = make_pc_overview(n_rows, seed)
+    stack = pc_overview.iloc[:n_rows - max(1, n_rows // 50)]
+    write_frames(os.path.join(root, 'AP_Files', 'All_Stack.xlsx'), {'Stack': stack, 'pc_overview': pc_overview})
+    with open(os.path.join(root, 'AP_Files', 'po_exclusions.txt'), 'w') as f:
+        f.write('\n'.join(pc_overview['PO #'].sample(frac=0.01, random_state=seed)) + '\n')
+
+    last_updated = make_ar_data(n_rows, seed)
+    write_frames(os.path.join(root, 'AR_Files', 'AR_updated.xlsx'), {'last_updated': last_updated})
+    write_frames(os.path.join(root, 'AR_Files', 'PC_Overview_AR.xlsx'),
+                 {'AR & AP Real 0804': make_ar_export(last_updated, seed=seed)})
@@ -0,0 +1,59 @@
+import os
+
+import pandas as pd
+
+import aggregations
+from aggregations import clear_cache
+from arrow_handoff import current_handoff, handoff_dir, map_sheet, publish
+from data_cache import load_sheet, source_version
+from dataset_registry import clear_registry, current_version, registry_stats, shared_sheet
+from schema import apply_schema
+
+
+def write_report(path, amount):
+    # Categorical like the pipeline's frame, whose zero-amount rows go after the dtypes are set
+    ap = apply_schema(pd.DataFrame({
+        'PM Type': ['UPW', 'WWT', 'UPW'], 'Scope': ['Pip', 'Sla', 0], 'Main/CO/DCR': ['DCR Scope', 0, 'CO'],
+        'Amount': [amount, 2.0, 0.0]
+    }))
+    frames = {
+        'pc_overview AP': ap[ap['Amount'] != 0],
+        'pc_overview AR': pd.DataFrame({
+            'Main Page': ['UPW'], 'CO/Added': ['Main'], 'Total Contract $': [10.0]
+        }),
+    }
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name, df in frames.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return frames
+
+
+def test_published_frames_are_mapped_instead_of_parsed(tmp_path):
+    clear_registry()
+    clear_cache()
+    workbook = str(tmp_path / 'analysis.xlsx')
+    pointer = publish(workbook, write_report(workbook, 1.0))
+
+    assert current_handoff(workbook) == pointer
+    assert pointer['version'] == source_version(workbook)
+    # The published frame is the one the dashboard would have read back from the workbook,
+    # without the categories of the rows filtered out
+    pd.testing.assert_frame_equal(map_sheet(workbook, pointer, 'pc_overview AP'), load_sheet(workbook, 'pc_overview AP'))
+
+    clear_registry()
+    assert current_version(workbook) == pointer['version']
+    assert ('group', pointer['version'], 'Amount', ('PM Type', 'Main/CO/DCR')) in aggregations._cache
+    assert shared_sheet(workbook, 'pc_overview AR')['Total Contract $'].tolist() == [10.0]
+    assert registry_stats()['mapped'] == 1 and registry_stats()['loads'] == 0
+
+    # A workbook written without publishing is read as before
+    write_report(workbook, 3.0)
+    assert current_handoff(workbook) is None
+    assert shared_sheet(workbook, 'pc_overview AP')['Amount'].tolist() == [3.0, 2.0]
+    assert registry_stats()['loads'] == 1
+
+    # Only the current and the previous version stay on disk
+    for amount in [4.0, 5.0]:
+        publish(workbook, write_report(workbook, amount))
+    versions = [name for name in os.listdir(handoff_dir(workbook)) if name != 'current.json']
+    assert len(versions) == 2 and current_handoff(workbook)['version'] in versions
@@ -0,0 +1,30 @@
+from benchmark import compare, run_benchmarks
+from process_excel import DERIVED_COLUMNS, PC_OVERVIEW_COLUMNS, STACK_COLUMNS, config
+from synthetic_data import make_ar_data, make_pc_overview
+
+
+def test_synthetic_sheets_use_real_columns_and_values():
+    pc_overview = make_pc_overview(1000)
+    source_columns = [col for col in PC_OVERVIEW_COLUMNS + STACK_COLUMNS if col not in DERIVED_COLUMNS]
+    assert set(source_columns) <= set(pc_overview.columns)
+    assert pc_overview['PO #'].is_unique
+    assert set(pc_overview['Type'].dropna()) <= set(config['TYPE_MAP'])
+
+    ar_data = make_ar_data(1000)
+    assert list(ar_data.columns) == [
+        'Type', 'Project #', 'Project Name', 'PO #', 'Total Contract $', 'Main Page', 'CO/Added', 'Amy PO '
+    ]
+
+
+def test_benchmarks_record_each_run_and_flag_regressions():
+    names = ['pm_type_totals', 'ap_pivot_breakdown', 'generate_reports']
+    results = run_benchmarks([300], repeat=1, only=names)
+
+    assert [(r['name'], r['rows'], r['memory']) for r in results] == [
+        ('pm_type_totals', 300, 'tracemalloc'),
+        ('ap_pivot_breakdown', 300, 'tracemalloc'),
+        ('generate_reports', 300, 'rss'),
+    ]
+    assert compare(results, results) == []
+    slower = [dict(r, seconds=r['seconds'] + 1) for r in results]
+    assert [result['name'] for result, _ in compare(slower, results)] == names
@@ -1,11 +1,16 @@
+import numpy as np
 import pandas as pd
 
+from aggregations import grouped_breakdown, pivot_breakdown, share_of_parent, clear_cache
+from analytics_store import fill_store, open_store
+from data_cache import load_sheet
+
 def test_percentage_calculation(df):
-    # Calculate total amount per PM Type
+    # Calculate total amount per PM Type, blank Main/CO/DCR rows included
     pm_type_totals = df.groupby('PM Type')['Amount'].sum()
     
-    # Group by PM Type and Main/CO/DCR
-    grouped_df = df.groupby(['PM Type', 'Main/CO/DCR']).agg({
+    # Group by PM Type and Main/CO/DCR, keeping blank Main/CO/DCR rows in the PM Type totals
+    grouped_df = df.groupby(['PM Type', 'Main/CO/DCR'], dropna=False).agg({
         'Amount': ['sum', 'count']
     }).reset_index()
     
@@ -22,15 +27,80 @@ def test_percentage_calculation(df):
     })
     
     # Calculate percentages
-    grouped_df['Percentage of PM Type'] = grouped_df.apply(
+    grouped_df['Percentage of PM Type'] = share_of_parent(grouped_df, ['PM Type'])
+    grouped_df = grouped_df.dropna(subset=['PM Type', 'Main/CO/DCR'])
+
+    # Same percentages as dividing each row by its PM Type total, row by row
+    expected = grouped_df.apply(
         lambda row: (row['Total Amount'] / pm_type_totals[row['PM Type']]) * 100,
         axis=1
     )
-    
-    return grouped_df
+    blank_pm_types = df.loc[df['Main/CO/DCR'].isna(), 'PM Type'].unique()
+    assert len(blank_pm_types) > 0
+    assert grouped_df['PM Type'].isin(blank_pm_types).any()
+    np.testing.assert_allclose(grouped_df['Percentage of PM Type'], expected)
+    # Their shown shares leave room for the blank rows rather than adding up to 100
+    assert (grouped_df.groupby('PM Type')['Percentage of PM Type'].sum().loc[blank_pm_types] < 100 - 1e-9).any()
+
+def test_rollup_matches_direct_groupby():
+    clear_cache()
+    df = pd.DataFrame({
+        'PM Type': ['UPW', 'UPW', 'WWT', 'WWT', np.nan, 'UPW'],
+        'Scope': ['Material', np.nan, 'Labor', 'Labor', 'Material', 'Material'],
+        'Main/CO/DCR': ['DCR Scope', '', 0, np.nan, 'DCR Scope', 'DCR Scope'],
+        'Amount': [1.0, 2.0, 3.0, np.nan, 5.0, 6.0],
+    })
+
+    # Computing the finer grouping first makes the coarser ones roll up from it
+    grouped_breakdown(df, 'v1', ['PM Type', 'Scope', 'Main/CO/DCR'], 'Amount')
+    for columns in (['PM Type'], ['Scope', 'PM Type'], ['Main/CO/DCR']):
+        expected = df.groupby(columns).agg(total=('Amount', 'sum'), count=('Amount', 'count')).reset_index()
+        result = grouped_breakdown(df, 'v1', columns, 'Amount')
+        assert result[columns].values.tolist() == expected[columns].values.tolist()
+        assert result['Total Amount'].tolist() == expected['total'].tolist()
+        assert result['Count'].tolist() == expected['count'].tolist()
+
+    pivot_df = pivot_breakdown(df, 'v1', 'PM Type', 'Main/CO/DCR', 'Amount', ['DCR Scope', 'Unspecified'])
+    assert pivot_df.loc['UPW'].tolist() == [7.0, 2.0]
+    assert pivot_df.loc['WWT'].tolist() == [0.0, 3.0]
+
+def test_store_breakdowns_match_pandas(tmp_path):
+    workbook = tmp_path / 'analysis.xlsx'
+    df = pd.DataFrame({
+        'PM Type': ['UPW', 'UPW', 'WWT', 'WWT', np.nan, 'UPW'],
+        'Main/CO/DCR': ['DCR Scope', np.nan, 0, 'Main', 'DCR Scope', 'DCR Scope'],
+        'PO #': ['P1', 'P2', 'P3', 'P4', 'P5', 'P6'],
+        'Amount': [1.0, 2.0, 3.0, np.nan, 5.0, 6.0],
+    })
+    def write_workbook(df):
+        with pd.ExcelWriter(workbook) as writer:
+            df.to_excel(writer, sheet_name='pc_overview AP', index=False)
+            df.rename(columns={'Amount': 'Total Contract $'}).to_excel(writer, sheet_name='pc_overview AR', index=False)
+
+    write_workbook(df)
+
+    assert open_store(str(workbook), 'pc_overview AP') is None
+    assert fill_store(str(workbook)) == {'pc_overview_ap': 6, 'pc_overview_ar': 6}
+    store = open_store(str(workbook), 'pc_overview AP')
+    df = load_sheet(str(workbook), 'pc_overview AP')
+
+    for columns in (['PM Type'], ['PM Type', 'Main/CO/DCR'], ['PO #']):
+        clear_cache()
+        expected = grouped_breakdown(df, 'v1', columns, 'Amount')
+        clear_cache()
+        result = grouped_breakdown(None, 'v1', columns, 'Amount', store=store)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False)
+
+    clear_cache()
+    pivot_df = pivot_breakdown(None, 'v1', 'PM Type', 'Main/CO/DCR', 'Amount', ['Main', 'DCR Scope', 'Unspecified'], store=store)
+    assert pivot_df.loc['UPW'].tolist() == [0.0, 7.0, 2.0]
+    assert pivot_df.loc['WWT'].tolist() == [0.0, 0.0, 3.0]
+
+    # A store built from an older workbook is ignored
+    write_workbook(df.assign(Amount=df['Amount'] * 2))
+    assert open_store(str(workbook), 'pc_overview AP') is None
 
 # Test with your data
 if __name__ == "__main__":
     df = pd.read_excel('summary_table_updated_analysis.xlsx', sheet_name='pc_overview AP')
-    result = test_percentage_calculation(df)
-    print(result)
\ No newline at end of file
+    test_percentage_calculation(df)
\ No newline at end of file
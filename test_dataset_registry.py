@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+import aggregations
+from aggregations import cache_stats, cached_frame, clear_cache, grouped_breakdown
+from dataset_registry import clear_registry, current_version, registry_stats, shared_sheet
+
+
+def write_workbook(path, amounts):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({
+            'PM Type': ['UPW', 'WWT', 'UPW'], 'Scope': ['Pip', 'Sla', 'Pip'], 'Amount': amounts
+        }).to_excel(writer, sheet_name='pc_overview AP', index=False)
+        pd.DataFrame({'Main Page': ['UPW'], 'Total Contract $': [10.0]}).to_excel(writer, sheet_name='pc_overview AR', index=False)
+
+
+def test_sessions_share_one_frame_and_a_bounded_breakdown_cache(tmp_path, monkeypatch):
+    clear_registry()
+    clear_cache()
+    workbook = str(tmp_path / 'analysis.xlsx')
+    write_workbook(workbook, [1.0, 2.0, 3.0])
+
+    first = shared_sheet(workbook, 'pc_overview AP')
+    second = shared_sheet(workbook, 'pc_overview AP')
+    assert np.shares_memory(first['Amount'].to_numpy(), second['Amount'].to_numpy())
+    assert registry_stats()['loads'] == 1 and registry_stats()['hits'] == 1
+    # A session changing its frame, even in place, does not change the others' (copy-on-write, pandas>=3)
+    first['Amount'] = 0.0
+    edited = shared_sheet(workbook, 'pc_overview AP')
+    edited.loc[0, 'Scope'] = 'Sla'
+    assert shared_sheet(workbook, 'pc_overview AP')['Scope'].tolist() == ['Pip', 'Sla', 'Pip']
+    assert shared_sheet(workbook, 'pc_overview AP')['Amount'].tolist() == [1.0, 2.0, 3.0]
+
+    version = current_version(workbook)
+    grouped_breakdown(second, version, ['PM Type'], 'Amount')
+    grouped_breakdown(second, version, ['PM Type'], 'Amount')
+    assert cache_stats()['hits'] == 1
+
+    # Past the memory budget the least recently used breakdown goes
+    monkeypatch.setattr(aggregations, 'CACHE_BYTES', cache_stats()['bytes'] + 1)
+    grouped_breakdown(second, version, ['Scope'], 'Amount')
+    assert ('group', version, 'Amount', ('PM Type',)) not in aggregations._cache
+    assert cache_stats()['evictions'] == 1
+    monkeypatch.undo()
+
+    # Other results of the same data (the reconciliation) are computed once per version and params
+    computed = []
+    compute = lambda: computed.append(1) or second.head(1)
+    assert cached_frame('reconcile', version, (('PM Type',),), compute).equals(cached_frame('reconcile', version, (('PM Type',),), compute))
+    assert len(computed) == 1
+
+    # A new workbook drops the old frames and breakdowns
+    write_workbook(workbook, [5.0, 2.0, 3.0])
+    assert shared_sheet(workbook, 'pc_overview AP')['Amount'].tolist() == [5.0, 2.0, 3.0]
+    assert cache_stats()['entries'] == 0
+    assert registry_stats()['sheets'] == 1
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from grid_paging import apply_filter_model, apply_sort_model
+
+
+def test_filter_and_sort_models_match_ag_grid():
+    df = pd.DataFrame({
+        'PM Type': ['UPW', 'upw', 'WWT', np.nan, 'Chemical'],
+        'Amount': [5.0, 1.0, 3.0, 2.0, np.nan],
+    })
+
+    text = {'PM Type': {'filterType': 'text', 'type': 'equals', 'filter': 'UPW'}}
+    assert apply_filter_model(df, text).index.tolist() == [0, 1]
+
+    not_contains = {'PM Type': {'filterType': 'text', 'type': 'notContains', 'filter': 'p'}}
+    assert apply_filter_model(df, not_contains).index.tolist() == [2, 3, 4]
+
+    either = {'Amount': {
+        'filterType': 'number', 'operator': 'OR',
+        'conditions': [{'type': 'lessThan', 'filter': 2}, {'type': 'inRange', 'filter': 2, 'filterTo': 5}]
+    }}
+    assert apply_filter_model(df, either).index.tolist() == [1, 2]
+
+    sort = [{'colId': 'Amount', 'sort': 'desc'}]
+    assert apply_sort_model(df, sort).index.tolist() == [0, 2, 3, 1, 4]
+    assert apply_sort_model(df, [{'colId': 'Amount', 'sort': 'asc'}]).index.tolist() == [4, 1, 3, 2, 0]
+
+    # Blanks of a secondary key sort below its values in that key's direction, not the first key's
+    grouped = pd.DataFrame({'Group': ['A', 'A', 'A', 'B'], 'Amount': [1.0, np.nan, 3.0, 2.0]})
+    by_group = [{'colId': 'Group', 'sort': 'desc'}, {'colId': 'Amount', 'sort': 'asc'}]
+    assert apply_sort_model(grouped, by_group).index.tolist() == [3, 1, 0, 2]
@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from ingest import discover_workbooks, ingest_sources
+
+
+def write_export(path, frames, mtime):
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name, df in frames.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    os.utime(path, (mtime, mtime))
+
+
+def test_exports_are_combined_with_the_newest_row_per_po(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('AP_Files')
+    march = pd.DataFrame({'PO #': ['P1', 'P2'], 'Amount': [1.0, 2.0]})
+    april = pd.DataFrame({'PO # ': ['P2', 'P3'], 'Amount': [20.0, 3.0], 'Vendor': ['A', 'B']})
+    write_export(os.path.join('AP_Files', 'stack_april.xlsx'), {'Stack': april, 'pc_overview': april}, 2000)
+    write_export(os.path.join('AP_Files', 'stack_march.xlsx'), {'Stack': march, 'pc_overview': march}, 1000)
+    # Not exports: a workbook without the Stack sheet, a lock file and a pipeline output
+    write_export(os.path.join('AP_Files', 'summary_table_updated.xlsx'), {'pc_overview': march}, 3000)
+    write_export(os.path.join('AP_Files', '~$stack_march.xlsx'), {'Stack': march, 'pc_overview': march}, 3000)
+    write_export(os.path.join('AP_Files', 'All_Stack_Filtered.xlsx'), {'Stack': march, 'pc_overview': march}, 3000)
+
+    assert [os.path.basename(path) for path in discover_workbooks('AP_Files')] == [
+        'stack_march.xlsx', 'stack_april.xlsx', 'summary_table_updated.xlsx'
+    ]
+
+    datasets = ingest_sources(['AP', 'AR'], max_workers=2)
+    assert datasets['AR'] == {}
+    stack = datasets['AP']['Stack']
+    assert list(stack.columns) == ['PO #', 'Amount', 'Vendor']
+    assert stack['PO #'].tolist() == ['P1', 'P2', 'P3']
+    assert stack['Amount'].tolist() == [1.0, 20.0, 3.0]
+    pd.testing.assert_frame_equal(datasets['AP']['pc_overview'], stack)
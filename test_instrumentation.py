@@ -0,0 +1,25 @@
+import json
+import logging
+
+import pandas as pd
+
+from instrumentation import clear_stages, instrumented, recent_stages, stages_frame, timed_stage
+
+
+def test_stages_are_recorded_and_logged_as_json(caplog):
+    @instrumented('load rows')
+    def load():
+        return pd.DataFrame({'PO #': ['P1', 'P2', 'P3']}), ['ignored']
+
+    clear_stages()
+    records = []
+    with caplog.at_level(logging.INFO, logger='arap.perf'):
+        load()
+        with timed_stage('pivot', records=records) as stage:
+            stage['rows'] = 7
+
+    assert [(s['stage'], s['rows']) for s in recent_stages()] == [('load rows', 3), ('pivot', 7)]
+    assert records == recent_stages()[1:]
+    assert all(s['seconds'] >= 0 for s in records)
+    assert [json.loads(r.getMessage())['stage'] for r in caplog.records] == ['load rows', 'pivot']
+    assert list(stages_frame(records).columns) == ['stage', 'rows', 'seconds', 'peak_rss_mb', 'rss_growth_mb']
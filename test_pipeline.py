@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from pipeline import run_pipeline
+
+
+def step_pid():
+    return os.getpid()
+
+
+def test_run_pipeline_orders_steps_and_skips_declined_branches():
+    steps = {
+        'ap': {'run': step_pid, 'after': []},
+        'ar': {'run': step_pid, 'after': []},
+        'update_ar': {'run': step_pid, 'after': ['ar'], 'confirm': 'Update AR?'},
+        'after_update_ar': {'run': step_pid, 'after': ['update_ar']},
+        'report': {'run': step_pid, 'after': ['ap', 'ar']},
+    }
+    questions = []
+
+    def decline(question):
+        questions.append(question)
+        return 'no'
+
+    results = run_pipeline(steps, max_workers=2, ask=decline)
+    assert sorted(results) == ['ap', 'ar', 'report']
+    assert questions == ['Update AR? (yes/no): ']
+    assert os.getpid() not in results.values()
+
+    results = run_pipeline(steps, yes=True, max_workers=2, ask=decline)
+    assert sorted(results) == sorted(steps)
+    assert len(questions) == 1
+
+
+def test_run_pipeline_rejects_unknown_dependencies():
+    with pytest.raises(ValueError):
+        run_pipeline({'report': {'run': step_pid, 'after': ['missing']}}, yes=True)
+
@@ -0,0 +1,336 @@
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from process_excel import (
+    classify_pm_types,
+    map_categories,
+    categorize_pm_types,
+    append_new_pos,
+    upsert_po_data,
+    iter_sheet_chunks,
+    filter_sheets,
+    write_combined_sheet,
+    write_detailed_combined_sheet,
+    reconcile_ap_ar,
+    write_base_build_sheet,
+    reconciliation_summary
+)
+from report_writer import open_workbook, sumifs_formula, write_frame
+from schema import PO_NUMBER_DTYPE, apply_schema
+from sheet_format import column_widths
+
+
+def test_classify_pm_types_priority():
+    df = pd.DataFrame({
+        'Type':           ['UPW',  'Base-Build', 'Base-Build', np.nan, 'Hookup', 'Unknown', np.nan],
+        'Actual Pertain': ['WWT',  'Chemical',   np.nan,       np.nan, np.nan,   'Hookup',  'CCTV'],
+    })
+
+    result = classify_pm_types(df)
+
+    assert result.tolist() == [
+        'WWT',          # Actual Pertain wins when specific
+        'Chemical',
+        'Base-Build',   # falls back to Type == Base-Build
+        'Others',       # both empty
+        'Others',       # Hookup maps to Others
+        'Others',       # unknown Type
+        'Low Voltage',
+    ]
+
+
+def test_map_categories():
+    categories = pd.Series(['Mechanical', 'Others - misc', '', 0, np.nan, 'Steel'], dtype=object)
+    assert map_categories(categories).tolist() == ['Mechanical', 'Others', 'Others', 'Others', 'Others', 'Steel']
+
+
+def test_categorize_pm_types_first_keyword_wins():
+    descriptions = pd.Series(['Mechanical and Electrical work', 'ELECTRICAL panel', np.nan, 'plumbing'])
+    assert categorize_pm_types(descriptions).tolist() == ['Mechanical', 'Electrical', 'Other', 'Plumbing']
+
+
+def test_append_new_pos_only_writes_delta(tmp_path):
+    workbook_path = str(tmp_path / 'AR_updated.xlsx')
+    existing = pd.DataFrame({'PO #': ['A', 'B'], 'Total Contract $': [1.0, 2.0]})
+    existing.to_excel(workbook_path, sheet_name='last_updated', index=False)
+
+    source = pd.DataFrame({'PO #': ['A', 'B', 'C', 'C'], 'Total Contract $': [1.0, 5.0, 3.0, 4.0]})
+    new_rows, changed_pos = append_new_pos(source, workbook_path, 'last_updated')
+
+    assert new_rows['PO #'].tolist() == ['C', 'C']
+    assert changed_pos == ['B']
+    assert pd.read_excel(workbook_path, sheet_name='last_updated')['PO #'].tolist() == ['A', 'B', 'C', 'C']
+
+    # Second run finds nothing new and leaves the workbook alone
+    new_rows, _ = append_new_pos(source, workbook_path, 'last_updated')
+    assert new_rows.empty
+
+
+def test_upsert_po_data_fills_blanks_and_adds_new_pos():
+    existing = pd.DataFrame({
+        'Type': ['Scope', 'GC', 'Scope'],
+        'PO #': ['P1', 'P1', 'P2'],
+        'Main Page': [np.nan, 'Chemical', ''],
+        'Total Contract $': [10.0, 2.0, np.nan],
+    })
+    incoming = pd.DataFrame({
+        'PO #': ['P1', 'P2', 'P2', 'P4', 'P3'],
+        'Main Page': ['UPW', np.nan, 'WWT', 'AMHS', 'UPW'],
+        'Total Contract $': [99.0, 5.0, 6.0, 1.0, 2.0],
+    })
+
+    updated, filled_cells, added_pos = upsert_po_data(existing, incoming)
+
+    # Only blank cells are filled, with the first non-blank export value per PO
+    assert updated['Main Page'].tolist()[:3] == ['UPW', 'Chemical', 'WWT']
+    assert updated['Total Contract $'].tolist()[:3] == [10.0, 2.0, 5.0]
+    assert sorted(zip(filled_cells['PO #'], filled_cells['Column'])) == [
+        ('P1', 'Main Page'), ('P2', 'Main Page'), ('P2', 'Total Contract $')
+    ]
+    assert added_pos == ['P3', 'P4']
+    assert updated['PO #'].tolist() == ['P1', 'P1', 'P2', 'P3', 'P4']
+
+
+def test_apply_schema_types_known_columns():
+    df = pd.DataFrame({
+        'PO #': [12345, 'P2', np.nan],
+        'Main/CO/DCR': ['DCR Scope', 0, np.nan],
+        'Total Contract $': [1, 'n/a', 2.5],
+        'Note': ['x', 'y', 'z'],
+    })
+
+    typed = apply_schema(df)
+
+    assert typed['PO #'].dtype == PO_NUMBER_DTYPE
+    assert typed['PO #'].tolist()[:2] == ['12345', 'P2'] and pd.isna(typed['PO #'][2])
+    assert list(typed['Main/CO/DCR'].cat.categories) == ['0', 'DCR Scope']
+    assert typed['Total Contract $'].dtype == 'float64' and np.isnan(typed['Total Contract $'][1])
+    assert typed['Note'].dtype == df['Note'].dtype
+    assert apply_schema(typed) is typed
+
+    # Blank categorical cells can still be filled with labels they have not seen
+    updated, _, _ = upsert_po_data(
+        apply_schema(pd.DataFrame({'PO #': ['P1'], 'Main Page': [np.nan]})),
+        pd.DataFrame({'PO #': ['P1'], 'Main Page': ['UPW']})
+    )
+    assert updated['Main Page'].tolist() == ['UPW']
+
+
+def test_iter_sheet_chunks_projects_and_filters(tmp_path):
+    workbook_path = str(tmp_path / 'All_Stack.xlsx')
+    pd.DataFrame({
+        'TSMC 新工': ['Base-Build', 'Other', 'Base-Build', 'Base-Build', 'Base-Build'],
+        'PO #': ['P1', 'P2', 'P3', 'P4', 'P5'],
+        'Amount': [1, 2, 'n/a', 4, 5],
+        'Unused': ['x'] * 5,
+    }).to_excel(workbook_path, sheet_name='pc_overview', index=False)
+
+    chunks = list(iter_sheet_chunks(
+        workbook_path, 'pc_overview',
+        columns=['PO #', 'Amount', 'TSMC 新工'],
+        row_filter=lambda chunk: (chunk['TSMC 新工'] == 'Base-Build') & ~chunk['PO #'].isin({'P5'}),
+        dtypes={'Amount': 'float64'},
+        chunk_size=2
+    ))
+
+    assert len(chunks) == 3
+    result = pd.concat(chunks, ignore_index=True)
+    assert list(result.columns) == ['PO #', 'Amount', 'TSMC 新工']
+    assert result['PO #'].tolist() == ['P1', 'P3', 'P4']
+    assert result['Amount'].dtype == 'float64'
+    assert np.isnan(result['Amount'][1])
+
+
+def test_filter_sheets_splits_with_exclusion_file(tmp_path):
+    input_path = str(tmp_path / 'All_Stack.xlsx')
+    with pd.ExcelWriter(input_path) as writer:
+        pd.DataFrame({'PO #': ['P1', 'P2', 'P3'], 'Amount': [1.0, np.nan, 3.0]}).to_excel(writer, sheet_name='Stack', index=False)
+        pd.DataFrame({'PO #': ['P2', 'P4'], 'Note': ['re_x0002_-work', None]}).to_excel(writer, sheet_name='pc_overview', index=False)
+    exclusions_path = tmp_path / 'po_exclusions.txt'
+    exclusions_path.write_text('# excluded POs\nP2\n\nP9\n')
+
+    output_path = str(tmp_path / 'All_Stack_Filtered.xlsx')
+    removed_counts = filter_sheets(input_path, output_path, str(exclusions_path))
+
+    assert removed_counts == {'Stack': 1, 'pc_overview': 1}
+    sheets = pd.read_excel(output_path, sheet_name=None)
+    assert list(sheets) == ['Stack', 'pc_overview', 'Stack_Removed', 'pc_overview_Removed']
+    assert sheets['Stack']['PO #'].tolist() == ['P1', 'P3']
+    assert sheets['Stack_Removed']['Amount'].isna().all()
+    assert sheets['pc_overview_Removed']['Note'].tolist() == ['re_x0002_-work']
+
+    filter_sheets(input_path, output_path, {'P1'}, output_format='parquet')
+    assert pd.read_parquet(tmp_path / 'All_Stack_Filtered_Stack_Removed.parquet')['PO #'].tolist() == ['P1']
+
+    # An unknown format is refused before any sheet is read
+    with pytest.raises(ValueError, match='csv'):
+        filter_sheets(str(tmp_path / 'missing.xlsx'), output_path, {'P1'}, output_format='csv')
+
+
+def test_write_combined_sheet_values_and_formulas(tmp_path):
+    pc_overview = pd.DataFrame({
+        'PM Type': ['UPW', 'UPW', 'WWT'],
+        'Mapped_Category': ['Steel', 'Steel', 'Civil'],
+        'Amount': [1.5, 2.0, 4.0],
+    })
+    updated_po_data = pd.DataFrame({'Main Page': ['UPW', 'UPW'], 'Total Contract $': [10.0, 'n/a']})
+
+    for totals in ['values', 'formulas']:
+        output_path = str(tmp_path / f'report_{totals}.xlsx')
+        with open_workbook(output_path) as workbook:
+            write_frame(workbook, 'pc_overview AP', pc_overview)
+            write_frame(workbook, 'pc_overview AR', updated_po_data)
+            write_combined_sheet(workbook, pc_overview, updated_po_data, totals)
+
+        sheet = pd.read_excel(output_path, sheet_name='Combined PM Types', header=None)
+        assert sheet[0].tolist()[:8] == ['UPW', 'Category', 'Mechanical', 'Electrical', 'Steel', 'Civil', 'Others', 'Total']
+        assert sheet.loc[4, 1] == 3.5
+        assert sheet.loc[7, 1:2].tolist() == [3.5, 10.0]
+        assert sheet.loc[10, 0] == 'WWT'
+        assert sheet.loc[17, 1:2].tolist() == [4.0, 0.0]
+
+    cells = openpyxl.load_workbook(output_path)['Combined PM Types']
+    assert cells['B5'].value == (
+        "=SUMIFS('pc_overview AP'!$C$2:$C$4, 'pc_overview AP'!$A$2:$A$4, \"=UPW\", "
+        "'pc_overview AP'!$B$2:$B$4, \"=Steel\")"
+    )
+    assert cells['B8'].value == '=SUM(B3:B7)'
+
+
+def test_write_base_build_sheet_by_scope_and_type2(tmp_path):
+    pc_overview = pd.DataFrame({
+        'PM Type': ['Base-Build', 'Base-Build', 'Base-Build', 'Base-Build', 'UPW'],
+        'Scope': ['Site Expense', 'Site Expense', 'Housekeeping', 'Site Expense', 'Site Expense'],
+        'Type2': ['Trailer', 'Scaffolding', 'Housekeeping', 'Trailer', 'Trailer'],
+        'Amount': [1.0, 5.0, 2.0, 3.0, 100.0],
+    })
+
+    for totals in ['values', 'formulas']:
+        output_path = str(tmp_path / f'report_{totals}.xlsx')
+        with open_workbook(output_path) as workbook:
+            write_base_build_sheet(workbook, pc_overview, totals)
+
+        # Base-Build rows only, by Scope and then largest Amount first, under a Total row
+        sheet = pd.read_excel(output_path, sheet_name='Base-Build_breakdown')
+        assert sheet.columns.tolist() == ['Scope', 'Type2', 'Amount']
+        assert sheet.values.tolist()[:3] == [
+            ['Housekeeping', 'Housekeeping', 2.0], ['Site Expense', 'Scaffolding', 5.0], ['Site Expense', 'Trailer', 4.0]
+        ]
+        assert sheet.loc[3, 'Scope'] == 'Total' and sheet.loc[3, 'Amount'] == 11.0
+
+    cells = openpyxl.load_workbook(output_path)['Base-Build_breakdown']
+    assert cells['C5'].value == '=SUM(C2:C4)'
+
+
+def test_sumifs_formula_matches_labels_exactly():
+    # Wildcards and leading comparison operators in a label are matched as plain text
+    assert sumifs_formula('S', [('A', 'Pipe*'), ('B', '>5'), ('C', 'a~b?'), ('D', 'x"y')]) == (
+        '=SUMIFS(S, A, "=Pipe~*", B, "=>5", C, "=a~~b~?", D, "=x""y")'
+    )
+
+
+def test_write_detailed_combined_sheet_blocks_and_from_apn(tmp_path):
+    pc_overview = pd.DataFrame({
+        'PM Type': ['UPW', 'UPW', 'UPW', 'UPW', 'WWT'],
+        'Mapped_Category': ['Steel', 'Steel', 'Steel', 'Civil', 'Civil'],
+        'Scope': ['Pipe', 'Duct', 'Pipe', np.nan, 'Slab'],
+        'Amount': [1.5, 2.0, 4.0, 8.0, 16.0],
+    })
+    updated_po_data = pd.DataFrame({'Main Page': ['UPW', 'UPW'], 'Total Contract $': [10.0, 'n/a']})
+    from_apn = pd.DataFrame({'Scope': ['Scaffolding', 'Lease'], 'Amount': [100.0, 50.0]})
+
+    output_path = str(tmp_path / 'report.xlsx')
+    with open_workbook(output_path) as workbook:
+        write_frame(workbook, 'pc_overview AP', pc_overview)
+        write_frame(workbook, 'pc_overview AR', updated_po_data)
+        write_detailed_combined_sheet(workbook, pc_overview, updated_po_data, from_apn, 'formulas')
+
+    sheet = pd.read_excel(output_path, sheet_name='Detailed Combined PM Types', header=None)
+    # Civil has UPW rows but none with a Scope, so it gets no row at all
+    assert sheet.loc[:8, 0].tolist() == ['UPW', 'Category', 'Mechanical', 'Electrical', 'Steel', 'Steel', 'Others', 'Total', np.nan]
+    assert sheet.loc[4:5, 1:2].values.tolist() == [['Duct', 2.0], ['Pipe', 5.5]]
+    assert sheet.loc[2, 2] == 0
+    assert sheet.loc[7, 2:3].tolist() == [7.5, 10.0]
+    assert sheet.loc[9, 0] == 'WWT'
+    assert sheet.loc[16, 2:3].tolist() == [16.0, 0.0]
+    assert sheet.loc[19:23, 0:1].values.tolist() == [
+        ['From APN', np.nan], ['Scope', 'Amount'], ['Scaffolding', 100], ['Lease', 50], ['Total', 150]
+    ]
+
+    cells = openpyxl.load_workbook(output_path)['Detailed Combined PM Types']
+    assert cells['C6'].value == (
+        "=SUMIFS('pc_overview AP'!$D$2:$D$6, 'pc_overview AP'!$A$2:$A$6, \"=UPW\", "
+        "'pc_overview AP'!$B$2:$B$6, \"=Steel\", 'pc_overview AP'!$C$2:$C$6, \"=Pipe\")"
+    )
+    assert cells['B3'].value == 'N/A'
+    assert cells['C8'].value == '=SUM(C3:C7)'
+    assert cells['B24'].value == '=SUM(B22:B23)'
+
+
+def test_reconcile_ap_ar_per_project_and_pm_type():
+    pc_overview = pd.DataFrame({
+        'Project Number': ['USC21C003', 'USC21C003', ' usc21c003', 'USC21C005', 'USC21C009'],
+        'PM Type': ['UPW', 'UPW', 'WWT', 'Water_Sewer', 'Chemical'],
+        'PO #': ['A1', 'A2', 'A3', 'A4', 'A5'],
+        'Amount': [4.0, 6.0, 5.0, 7.0, 1.0],
+    })
+    updated_po_data = pd.DataFrame({
+        'Project #': ['USC21C003', 'USC21C003', 'USC21C003', 'USC21C005', 'USC22C001'],
+        'Main Page': ['UPW', 'UPW', 'WWT', 'Water/Sewer', 'UPW'],
+        'PO #': ['T1', 'T1', 'T2', 'T3', 'T4'],
+        'Total Contract $': [8.0, 2.0, 9.0, 7.0, 'n/a'],
+    })
+
+    reconciled = reconcile_ap_ar(pc_overview, updated_po_data).set_index(['Project Number', 'PM Type'])
+    assert reconciled['Status'].to_dict() == {
+        ('USC21C003', 'UPW'): 'Matched',
+        ('USC21C005', 'Water_Sewer'): 'Matched',   # Main Page mapped through MAIN_PAGE_MAPPING
+        (' usc21c003', 'WWT'): 'Amount mismatch',   # keys match once trimmed and upper-cased
+        ('USC21C009', 'Chemical'): 'AP only',
+        ('USC22C001', 'UPW'): 'AR only',
+    }
+    assert reconciled.loc[('USC21C003', 'UPW'), ['AP POs', 'AR POs']].tolist() == [2, 1]
+    assert reconciled.loc[(' usc21c003', 'WWT'), 'Difference'] == -4.0
+
+    summary = reconciliation_summary(reconciled.reset_index()).set_index('Status')
+    assert summary['Keys'].tolist() == [2, 1, 1, 1, 0]
+    assert summary.loc['AP only', 'Difference'] == 1.0
+
+    # PO numbers of the two sides differ, so reconciling on them alone matches nothing
+    assert set(reconcile_ap_ar(pc_overview, updated_po_data, ['PO #'])['Status']) == {'AP only', 'AR only'}
+
+
+def test_reconcile_ap_ar_keeps_rows_without_a_project_apart():
+    pc_overview = pd.DataFrame({
+        'Project Number': ['USC21C003', np.nan, np.nan],
+        'PM Type': ['UPW', 'UPW', 'UPW'],
+        'PO #': ['A1', 'A2', 'A3'],
+        'Amount': [4.0, 2.0, 1.0],
+    })
+    updated_po_data = pd.DataFrame({
+        'Project #': ['USC21C003', None, ' '],
+        'Main Page': ['UPW', 'UPW', 'UPW'],
+        'PO #': ['T1', 'T2', 'T3'],
+        'Total Contract $': [4.0, 3.0, 5.0],
+    })
+
+    reconciled = reconcile_ap_ar(pc_overview, updated_po_data)
+    # Blank projects on the two sides are not the same project, so they are never matched
+    assert reconciled['Status'].tolist() == ['Matched', 'Missing key', 'Missing key', 'Missing key']
+    unkeyed = reconciled[reconciled['Status'] == 'Missing key']
+    assert unkeyed[['AP Amount', 'AP POs']].dropna().values.tolist() == [[3.0, 2]]
+    assert sorted(unkeyed['AR Amount'].dropna()) == [3.0, 5.0]
+
+    summary = reconciliation_summary(reconciled).set_index('Status')
+    assert summary.loc['Missing key', ['Keys', 'AP Amount', 'AR Amount', 'Difference']].tolist() == [3, 3.0, 8.0, -5.0]
+
+
+def test_column_widths_fit_longest_header_or_value():
+    df = pd.DataFrame({
+        'PO #': ['P1', 'P1000000'],
+        'Amount': [1.5, np.nan],
+        'PO Description': ['x', 'y'],
+    })
+    assert column_widths(df, overrides={'PO Description': 90}) == [(8 + 2) * 1.2, (6 + 2) * 1.2, 90]
@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+
+import process_excel
+import report_build
+from report_build import build_report
+
+
+def write_sources(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(process_excel.config, 'EXISTING_FILE_PATH', 'stack.xlsx')
+    monkeypatch.setitem(process_excel.config, 'UPDATED_PO_DATA_PATH', 'ar.xlsx')
+    monkeypatch.setitem(process_excel.config, 'NEW_FILE_PATH', 'report.xlsx')
+    columns = [col for col in process_excel.PC_OVERVIEW_COLUMNS if col not in process_excel.DERIVED_COLUMNS]
+    pc_overview = pd.DataFrame([['Base-Build'] + [None] * (len(columns) - 1)] * 2, columns=columns)
+    pc_overview['PO #'] = ['P1', 'P2']
+    pc_overview['Amount'] = [1.0, 2.0]
+    pc_overview['Category'] = ['Steel', 'Civil']
+    pc_overview['Actual Pertain'] = ['UPW', 'WWT']
+    pc_overview.to_excel('stack.xlsx', sheet_name='pc_overview', index=False)
+    pd.DataFrame({
+        'Main Page': ['UPW'], 'PO #': ['P9'], 'PO Description': ['Pipe'], 'Total Contract $': [10.0]
+    }).to_excel('ar.xlsx', sheet_name='Updated PO Data', index=False)
+
+
+def test_report_is_only_rebuilt_for_changed_inputs(tmp_path, monkeypatch):
+    write_sources(tmp_path, monkeypatch)
+
+    reads = []
+    for name in ['read_pc_overview_source', 'read_updated_po_data']:
+        read = getattr(report_build, name)
+        monkeypatch.setattr(report_build, name, lambda read=read, name=name: reads.append(name) or read())
+
+    assert build_report() == list(report_build.input_fingerprints()[1])
+    written = os.stat('report.xlsx').st_mtime_ns
+
+    # Nothing changed: the workbook is left alone
+    assert build_report() == []
+    assert os.stat('report.xlsx').st_mtime_ns == written
+
+    # A new category order rebuilds every sheet but pc_overview AR from the saved source reads
+    monkeypatch.setitem(process_excel.config, 'CORRECT_CATEGORY_ORDER', ['Steel', 'Others'])
+    assert build_report() == ['pc_overview AP', 'Combined PM Types', 'Detailed Combined PM Types', 'Base-Build_breakdown']
+    assert reads == ['read_pc_overview_source', 'read_updated_po_data']
+    report = pd.read_excel('report.xlsx', sheet_name='pc_overview AP')
+    assert report['Mapped_Category'].tolist() == ['Steel', 'Others']
+
+
+def test_type_map_edit_keeps_pc_overview_ar(tmp_path, monkeypatch):
+    write_sources(tmp_path, monkeypatch)
+    build_report()
+    ar_sheet = report_build._sheet_path(report_build._build_dir('report.xlsx'), 'pc_overview AR')
+    ar_written = os.stat(ar_sheet).st_mtime_ns
+
+    written = []
+    write_sheet = report_build.write_report_sheet
+    monkeypatch.setattr(report_build, 'write_report_sheet',
+                        lambda workbook, sheet_name, *args: written.append(sheet_name) or write_sheet(workbook, sheet_name, *args))
+    monkeypatch.setitem(process_excel.config, 'TYPE_MAP', {**process_excel.config['TYPE_MAP'], 'WWT': 'UPW'})
+    changed = build_report()
+
+    assert changed == ['pc_overview AP', 'Combined PM Types', 'Detailed Combined PM Types', 'Base-Build_breakdown']
+    assert written == changed
+    assert os.stat(ar_sheet).st_mtime_ns == ar_written
+    report = pd.read_excel('report.xlsx', sheet_name=None)
+    assert list(report) == process_excel.REPORT_SHEETS
+    assert report['pc_overview AP']['PM Type'].tolist() == ['UPW', 'UPW']
+    assert report['pc_overview AR']['PO #'].tolist() == ['P9']
@@ -0,0 +1,51 @@
+import os
+
+import pandas as pd
+import pytest
+
+from snapshots import load_snapshot, manifest_version, period_changes, take_snapshot
+
+
+def write_report(path, ap_rows, ar_rows):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame(ap_rows, columns=['PO #', 'PM Type', 'Main/CO/DCR', 'Amount']).to_excel(
+            writer, sheet_name='pc_overview AP', index=False)
+        pd.DataFrame(ar_rows, columns=['PO #', 'Main Page', 'CO/Added', 'Total Contract $']).to_excel(
+            writer, sheet_name='pc_overview AR', index=False)
+
+
+def test_snapshots_store_deltas_and_replay_past_months(tmp_path):
+    report, root = str(tmp_path / 'report.xlsx'), str(tmp_path / 'snapshots')
+    write_report(report, [['P1', 'UPW', 'DCR Scope', 1.0], ['P2', 'WWT', 0, 2.0], ['P3', 'UPW', None, 4.0]],
+                 [['P1', 'UPW', 'Main', 10.0], ['P1', 'UPW', 'CO', 5.0]])
+    assert take_snapshot(report, '2026-08', root)['AP'] == {'rows': 3, 'added': 3, 'removed': 0, 'changed': 0}
+
+    # P1 moves to WWT, P3 goes, P4 arrives and P1 gets another CO, listed before its other rows
+    write_report(report, [['P1', 'WWT', 'DCR Scope', 1.0], ['P2', 'WWT', 0, 2.0], ['P4', 'UPW', None, 8.0]],
+                 [['P1', 'UPW', 'CO', 1.0], ['P1', 'UPW', 'Main', 10.0], ['P1', 'UPW', 'CO', 5.0]])
+    assert take_snapshot(report, '2026-09', root) == {
+        'AP': {'rows': 3, 'added': 1, 'removed': 1, 'changed': 1},
+        'AR': {'rows': 3, 'added': 1, 'removed': 0, 'changed': 0}
+    }
+    # The delta holds P4, P3 and P1's old and new values rather than the whole sheet
+    assert len(pd.read_parquet(os.path.join(root, 'AP', '2026-09.parquet'))) == 4
+
+    august = load_snapshot('AP', '2026-08', root)
+    assert august['PO #'].tolist() == ['P1', 'P2', 'P3']
+    assert august['PM Type'].tolist() == ['UPW', 'WWT', 'UPW']
+    assert august['Main/CO/DCR'].tolist()[:2] == ['DCR Scope', '0']
+    assert load_snapshot('AP', '2026-09', root)['PO #'].tolist() == ['P1', 'P2', 'P4']
+
+    trend = period_changes('AP', root).set_index(['Snapshot', 'PM Type'])
+    assert trend.loc['2026-09', 'Change'].to_dict() == {'UPW': 3.0, 'WWT': 1.0}
+    assert trend.loc['2026-09', 'Total'].to_dict() == {'UPW': 8.0, 'WWT': 3.0}
+    assert period_changes('AR', root).set_index('Snapshot').loc['2026-09', 'Total'] == 16.0
+
+    # The latest month can be taken again, which the trends cache sees as a new manifest version;
+    # earlier ones cannot
+    taken = manifest_version(root)
+    write_report(report, [['P1', 'WWT', 'DCR Scope', 1.0]], [['P1', 'UPW', 'Main', 10.0]])
+    assert take_snapshot(report, '2026-09', root)['AP']['removed'] == 2
+    assert manifest_version(root) != taken and [label for label, *_ in manifest_version(root)] == ['2026-08', '2026-09']
+    with pytest.raises(ValueError):
+        take_snapshot(report, '2026-07', root)
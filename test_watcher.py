@@ -0,0 +1,55 @@
+import os
+import time
+
+import pandas as pd
+
+import aggregations
+import watcher
+from data_cache import source_version
+
+
+def write_workbook(path, amount):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({
+            'PM Type': ['UPW', 'WWT'], 'Main/CO/DCR': ['DCR Scope', ''], 'Amount': [amount, 2.0]
+        }).to_excel(writer, sheet_name='pc_overview AP', index=False)
+        pd.DataFrame({
+            'Main Page': ['UPW'], 'CO/Added': ['Main'], 'Total Contract $': [10.0]
+        }).to_excel(writer, sheet_name='pc_overview AR', index=False)
+
+
+def wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, watcher.watcher_status()
+        time.sleep(0.05)
+
+
+def test_watcher_reruns_reports_for_new_exports_and_warms_caches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('AP_Files')
+    pipeline_runs = []
+    monkeypatch.setattr(watcher, 'run_pipeline', lambda steps, ask: pipeline_runs.append(('ingest' in steps, ask('Write back?'))))
+    workbook = 'analysis.xlsx'
+    write_workbook(workbook, 1.0)
+
+    stop = watcher.start_watcher(workbook, poll_seconds=0.05)
+    try:
+        wait_for(lambda: watcher.watcher_status()['version'] == source_version(workbook))
+        first = watcher.watcher_status()
+        assert first['state'] == 'ready'
+        assert ('group', first['version'], 'Amount', ('PM Type',)) in aggregations._cache
+        assert pipeline_runs == []
+
+        # A new export reruns the pipeline with ingest, so the report includes it, declining the write-backs
+        pd.DataFrame({'PO #': ['P1']}).to_excel(os.path.join('AP_Files', 'export.xlsx'), index=False)
+        wait_for(lambda: pipeline_runs and watcher.watcher_status()['refreshed_at'] > first['refreshed_at'])
+        assert pipeline_runs == [(True, 'no')]
+
+        # A rewritten report only warms the caches for its new version
+        write_workbook(workbook, 5.0)
+        wait_for(lambda: watcher.watcher_status()['version'] != first['version'])
+        assert watcher.watcher_status()['version'] == source_version(workbook)
+        assert pipeline_runs == [(True, 'no')]
+    finally:
+        stop.set()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+
+from aggregations import DEFAULT_BREAKDOWNS, grouped_breakdown, pivot_breakdown
+from analytics_store import fill_store, open_store, store_path
+from dataset_registry import current_version, shared_sheet
+from ingest import discover_workbooks
+from instrumentation import configure_logging, logger, timed_stage
+from pipeline import build_pipeline, run_pipeline
+from process_excel import config
+
+# Folders whose exports feed the report; a change there reruns the pipeline with ingest,
+# which reads every export in them
+SOURCE_FOLDERS = ['AP_Files', 'AR_Files', 'APN_Files']
+
+POLL_SECONDS = 5
+
+_status = {'state': 'starting', 'version': None, 'refreshed_at': None, 'error': None}
+_status_lock = threading.Lock()
+
+
+def watcher_status():
+    """State, data version and last refresh time of the background refresh"""
+    with _status_lock:
+        return dict(_status)
+
+
+def _set_status(**changes):
+    with _status_lock:
+        _status.update(changes)
+
+
+def snapshot(workbook_path, folders=SOURCE_FOLDERS):
+    # (mtime, size) of every source export and of the analysis workbook
+    paths = [path for folder in folders for path in discover_workbooks(folder)] + [workbook_path]
+    files = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def warm_caches(workbook_path):
+    """Build the Parquet cache, the SQL store if one is used, the shared sheets and the tabs' default breakdowns
+
+    Returns the data version the caches now hold.
+    """
+    version = current_version(workbook_path)
+    if os.path.exists(store_path(workbook_path)) and open_store(workbook_path, 'pc_overview AP', version) is None:
+        fill_store(workbook_path)
+    for sheet_name, value_column, columns, shares, index, pivot_columns, order in DEFAULT_BREAKDOWNS:
+        store = open_store(workbook_path, sheet_name, version)
+        df = None if store else shared_sheet(workbook_path, sheet_name)
+        grouped_breakdown(df, version, columns, value_column, shares=shares, store=store)
+        pivot_breakdown(df, version, index, pivot_columns, value_column, order, store=store)
+    return version
+
+
+def _decline(question):
+    # Writing back into the source workbooks stays a manual, confirmed step
+    return 'no'
+
+
+def refresh(workbook_path, run_reports=False):
+    """Rebuild the report if asked, then warm the caches; errors end up in the status"""
+    _set_status(state='refreshing')
+    try:
+        if run_reports:
+            with timed_stage('watcher pipeline'):
+                run_pipeline(build_pipeline(ingest=True), ask=_decline)
+        with timed_stage('watcher warm caches'):
+            version = warm_caches(workbook_path)
+    except Exception as e:
+        logger.error(json.dumps({'stage': 'watcher refresh', 'error': str(e)}, ensure_ascii=False))
+        _set_status(state='error', error=str(e))
+        return False
+    _set_status(state='ready', version=version, refreshed_at=datetime.now(), error=None)
+    return True
+
+
+def watch(workbook_path, poll_seconds=POLL_SECONDS, run_reports=True, stop=None):
+    """Poll the source folders and the workbook, refreshing after every change until stop is set
+
+    A change is acted on once the files have stayed the same for one more
+    poll, so a workbook still being saved is not read half-written. Changed
+    exports rerun the pipeline with ingest when run_reports is set, so the
+    report includes them; the write-backs into the source workbooks are
+    declined. A changed workbook only warms the caches.
+    """
+    stop = stop or threading.Event()
+    seen = snapshot(workbook_path)
+    refresh(workbook_path)
+    pending = None
+    while not stop.wait(poll_seconds):
+        current = snapshot(workbook_path)
+        if current == seen or current != pending:
+            pending = None if current == seen else current
+            continue
+        changed = {path for path in current.keys() | seen.keys() if current.get(path) != seen.get(path)}
+        refresh(workbook_path, run_reports and bool(changed - {workbook_path}))
+        # The report just written is not a change of its own; exports saved meanwhile still are
+        seen = dict(current)
+        written = snapshot(workbook_path, folders=[]).get(workbook_path)
+        if written is not None:
+            seen[workbook_path] = written
+        pending = None
+
+
+def start_watcher(workbook_path, poll_seconds=POLL_SECONDS, run_reports=True):
+    """Run watch in a daemon thread; set the returned event to stop it"""
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch, args=(workbook_path, poll_seconds, run_reports, stop),
+        name='arap-watcher', daemon=True
+    )
+    thread.start()
+    return stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the report and warm the dashboard caches when files change")
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS,
+                        help=f"seconds between checks for changed files (default: {POLL_SECONDS})")
+    parser.add_argument('--cache-only', action='store_true',
+                        help="only warm the caches, never rerun the pipeline")
+    parser.add_argument('--log-file', help="append the per-stage timings here instead of printing them")
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_file)
+    watch(config['NEW_FILE_PATH'], args.poll_seconds, not args.cache_only)
+
+
+if __name__ == '__main__':
+    main()